@@ -0,0 +1,173 @@
+from spirit.events import Store, Bus
+from spirit.workers import Nursery
+from spirit.storage import BaseModel
+from spirit.utils import Model
+from spirit.utils.codec import codec_for
+
+from sys import argv, executable
+from subprocess import run
+from typing import Optional
+from pickle import dumps, loads, HIGHEST_PROTOCOL
+from time import perf_counter
+from statistics import median
+
+def report(name, count, elapsed, latencies=list()):
+    print(f"{name}: {count} in {elapsed:.3f}s ({count / elapsed:,.0f}/s)")
+    if len(latencies) > 0:
+        latencies = sorted(latencies)
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        print(f"  latency median {median(latencies) * 1e6:.1f}us", end="")
+        print(f" p99 {p99 * 1e6:.1f}us max {latencies[-1] * 1e6:.1f}us")
+
+def bench_bus(count=100000, batch=100):
+    bus = Bus(2)
+
+    def parent(nursery, states, pid, pids):
+        pass
+
+    def producer(index, state, pid, ppid):
+        store = Store(dict())
+        bus.join(store, publish=["ping", "done"])
+        for i in range(0, count, batch):
+            store.log_many([("ping", perf_counter()) for _ in range(batch)])
+
+        store.log("done", count)
+
+    def consumer(index, state, pid, ppid):
+        latencies = list()
+        received = dict(start=None)
+
+        def on_ping(events):
+            now = perf_counter()
+            if received["start"] is None:
+                received["start"] = now
+
+            latencies.extend(now - event.data for event in events)
+
+        store = Store(dict())
+        store.subscribe(["ping"], on_ping, batch=True)
+        store.subscribe(["done"], lambda e: received.update(done=e.data))
+        bus.join(store, subscribe=["ping", "done"])
+
+        while "done" not in received:
+            bus.pump(1)
+
+        elapsed = perf_counter() - received["start"]
+        report("bus events", len(latencies), elapsed, latencies)
+
+    nursery = Nursery(parent, [producer, consumer], bus=bus)
+    nursery.spawn([dict(), dict()])
+
+def bench_import(runs=10):
+    heavy = ["sqlite3", "logging.handlers", "socket", "concurrent.futures"]
+    packages = ["spirit", "spirit.utils", "spirit.events", "spirit.workers"]
+    packages.append("spirit.storage")
+    for name in packages:
+        # Every sample needs a fresh interpreter
+        script = "\n".join([
+            "from sys import modules",
+            "from time import perf_counter",
+            "start = perf_counter()",
+            f"import {name}",
+            "print(perf_counter() - start)",
+            f"print(','.join(m for m in {heavy!r} if m in modules))"
+        ])
+        samples = list()
+        for _ in range(runs):
+            result = run([executable, "-c", script], capture_output=True)
+            elapsed, loaded = result.stdout.decode().splitlines()
+            samples.append(float(elapsed))
+
+        loaded = loaded or "nothing heavy"
+        print(f"import {name}: {median(samples) * 1e3:.1f}ms, loads {loaded}")
+
+def bench_models(count=1000):
+    start = perf_counter()
+    for i in range(count):
+        namespace = dict()
+        namespace["__module__"] = __name__
+        namespace["__qualname__"] = f"Model{i}"
+        namespace["__annotations__"] = dict(
+            name=str,
+            count=int,
+            note=Optional[str]
+        )
+        namespace["note"] = None
+        type(BaseModel)(f"Model{i}", (BaseModel,), namespace)
+
+    report("model classes", count, perf_counter() - start)
+
+class Reading(Model):
+    sensor: str
+    sequence: int
+    value: float
+    valid: bool
+    note: Optional[str]
+    raw: bytes
+
+def bench_codec(count=100000):
+    readings = list()
+    for i in range(count):
+        kwargs = dict()
+        kwargs["sensor"] = f"sensor-{i % 16}"
+        kwargs["sequence"] = i
+        kwargs["value"] = i * 0.5
+        kwargs["valid"] = i % 3 != 0
+        kwargs["note"] = None if i % 4 else "calibrated"
+        kwargs["raw"] = bytes(8)
+        readings.append(Reading(**kwargs))
+
+    codec = codec_for(Reading)
+    start = perf_counter()
+    single = [codec.encode(reading) for reading in readings]
+    report("codec encode", count, perf_counter() - start)
+
+    start = perf_counter()
+    for data in single:
+        codec.decode(data)
+
+    report("codec decode", count, perf_counter() - start)
+
+    start = perf_counter()
+    pickled = [dumps(reading, HIGHEST_PROTOCOL) for reading in readings]
+    report("pickle dumps", count, perf_counter() - start)
+
+    start = perf_counter()
+    for data in pickled:
+        loads(data)
+
+    report("pickle loads", count, perf_counter() - start)
+
+    start = perf_counter()
+    batch = codec.encode_many(readings)
+    report("codec encode_many", count, perf_counter() - start)
+
+    start = perf_counter()
+    codec.decode_many(batch, copy=False)
+    report("codec decode_many", count, perf_counter() - start)
+
+    start = perf_counter()
+    whole = dumps(readings, HIGHEST_PROTOCOL)
+    loads(whole)
+    report("pickle list round trip", count, perf_counter() - start)
+
+    codec_size = sum(len(data) for data in single) / count
+    pickle_size = sum(len(data) for data in pickled) / count
+    print(f"  bytes per record: codec {codec_size:.1f}", end="")
+    print(f" pickle {pickle_size:.1f}", end="")
+    print(f" batched codec {len(batch) / count:.1f}", end="")
+    print(f" pickle {len(whole) / count:.1f}")
+
+def main():
+    benches = dict()
+    benches["bus"] = bench_bus
+    benches["import"] = bench_import
+    benches["models"] = bench_models
+    benches["codec"] = bench_codec
+
+    selected = argv[1:] if len(argv) > 1 else list(benches.keys())
+    for name in selected:
+        benches[name]()
+
+if __name__ == "__main__":
+    main()
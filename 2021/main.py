@@ -99,12 +99,11 @@ def child(index, state, pid, ppid):
 
     authors = author_mem.recite()
     print(authors)
-    assert len(authors) == 1, "Forget is not working"
-    assert list(authors.keys())[0] == 1, "Forget is removing wrong ID"
+    assert author_mem.count() == 1, "Forget is not working"
+    assert author_mem.exists(dict(id=1)), "Forget is removing wrong ID"
 
-    notes = note_mem.recite()
-    print(notes)
-    assert len(notes) == 0, "Cascade on delete is not working"
+    assert note_mem.count() == 0, "Cascade on delete is not working"
+    assert not note_mem.exists(), "Cascade on delete is not working"
 
 def main():
     state = [{}]
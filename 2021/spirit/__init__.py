@@ -0,0 +1,10 @@
+from importlib import import_module
+
+# Subpackages pull in sqlite3, sockets and logging, so wait until they are used
+subpackages = ["events", "storage", "utils", "workers"]
+
+def __getattr__(name):
+    if name not in subpackages:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    return import_module(f"{__name__}.{name}")
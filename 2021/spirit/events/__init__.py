@@ -1,2 +1,10 @@
-from spirit.events.store import Store, Event
+from spirit.utils import lazy
+from spirit.events.store import Store, Event, WILDCARD
 from spirit.events.ref import Ref
+from spirit.events.snapshot import Snapshot, Snapshotter
+from spirit.events.snapshot import dump_snapshot, load_snapshot, latest_snapshot
+
+exports = dict()
+exports["spirit.events.bus"] = ["Bus"]
+
+__getattr__ = lazy(__name__, exports)
@@ -0,0 +1,408 @@
+from spirit.events.store import WILDCARD
+from spirit.utils.wire import Channel
+from spirit.utils.metrics import metrics
+
+from socket import socketpair
+from selectors import DefaultSelector, EVENT_READ, EVENT_WRITE
+from threading import Thread, Condition
+from queue import Queue, Empty
+from collections import deque
+from pickle import dumps, HIGHEST_PROTOCOL
+
+dropped = metrics.counter("bus.dropped")
+
+class Backlog:
+    """
+    Batches of events waiting for a reader, the oldest are dropped once
+    they take more than limit bytes
+    """
+    def __init__(self, limit=None):
+        self._limit = limit
+        self._batches = deque()
+        self._size = 0
+        self._condition = Condition()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._batches)
+
+    def put(self, events):
+        size = 0
+        if self._limit is not None:
+            size = len(dumps(events, HIGHEST_PROTOCOL))
+
+        with self._condition:
+            self._batches.append((events, size))
+            self._size = self._size + size
+            while self._limit is not None and self._size > self._limit:
+                events, size = self._batches.popleft()
+                self._size = self._size - size
+                dropped.inc(len(events))
+
+            self._condition.notify()
+
+    def take(self, timeout=0):
+        """
+        Returns every batch waiting, after waiting up to timeout for one
+        """
+        with self._condition:
+            if len(self._batches) == 0 and timeout:
+                self._condition.wait(timeout)
+
+            batches = [events for events, _ in self._batches]
+            self._batches.clear()
+            self._size = 0
+
+        return batches
+
+class Bus:
+    """
+    Fans Store events out between processes forked from the same parent
+
+    The bus must be created before forking, afterwards each process calls
+    child or parent once and then join to connect its Store. Events for a
+    child are held until it joins, so publishers need not wait for it.
+
+    Only the hub thread in the parent writes to children, each through its
+    own outbound queue. A child that stops reading has events for it
+    dropped once limit bytes are queued, instead of stalling the others.
+    The same goes for events held for a child that has not joined yet and
+    for events waiting for the parent to pump, the oldest are dropped.
+    """
+    def __init__(self, workers, limit=None):
+        self._pairs = {index: socketpair() for index in range(workers)}
+        self._limit = limit
+        self._index = None
+        self._channel = None
+        self._channels = dict()
+        self._topics = dict()
+        self._held = dict()
+        self._early = list()
+        self._inbox = Backlog(limit)
+        self._posts = Queue()
+        self._wake = None
+        self._waker = None
+        self._selector = None
+        self._serving = False
+        self._hub = None
+        self._pump = None
+
+        self._store = None
+        self._publish = set()
+        self._subscribe = set()
+        self._absorbing = False
+
+    @property
+    def is_parent(self):
+        return self._index is None
+
+    def child(self, index):
+        self._index = index
+        for i, (parent_end, child_end) in self._pairs.items():
+            parent_end.close()
+            if i != index:
+                child_end.close()
+
+        # A restarted worker also inherits the hub's end of every channel
+        for channel in self._channels.values():
+            channel.close()
+
+        if self._selector is not None:
+            self._selector.close()
+            self._wake.close()
+            self._waker.close()
+
+        self._channels = dict()
+        self._topics = dict()
+        self._held = dict()
+        self._channel = Channel(self._pairs[index][1])
+        self._pairs = dict()
+
+    def reopen(self, index):
+        """
+        Gives a worker that is forked again a new pair, the old one is gone
+        """
+        if index not in self._pairs:
+            self._pairs[index] = socketpair()
+
+    def parent(self):
+        """
+        Connects the parent to the pairs forked so far, the first call starts
+        the hub and later ones hand reopened pairs to it
+        """
+        started = self._selector is not None
+        if not started:
+            self._selector = DefaultSelector()
+            self._wake, self._waker = socketpair()
+            self._wake.setblocking(False)
+            self._waker.setblocking(False)
+            self._selector.register(self._wake, EVENT_READ)
+
+        for index, (parent_end, child_end) in self._pairs.items():
+            child_end.close()
+            parent_end.setblocking(False)
+            channel = Channel(parent_end)
+            if started:
+                self._post("attach", (index, channel))
+
+            else:
+                self._attach(index, channel)
+
+        self._pairs = dict()
+        if not started:
+            self._serving = True
+            self._hub = Thread(target=self._serve, daemon=True)
+            self._hub.start()
+
+    def _attach(self, index, channel):
+        self._drop(index)
+        self._channels[index] = channel
+        self._selector.register(channel, EVENT_READ, index)
+
+        # No topics yet, events are held until the child subscribes
+        self._topics[index] = None
+        self._held[index] = Backlog(self._limit)
+
+    def _matches(self, topics, kind):
+        return WILDCARD in topics or kind in topics
+
+    def _serve(self):
+        while self._serving:
+            for key, mask in self._selector.select():
+                if key.fileobj is self._wake:
+                    self._receive_posts()
+                    continue
+
+                # Events of a channel replaced during this round are stale
+                index = key.data
+                if self._channels.get(index) is not key.fileobj:
+                    continue
+
+                try:
+                    if mask & EVENT_WRITE:
+                        key.fileobj.flush()
+
+                    messages = list()
+                    if mask & EVENT_READ:
+                        messages = key.fileobj.read()
+
+                except (BlockingIOError, InterruptedError):
+                    # Ready but nothing to take after all, the next round
+                    continue
+
+                except (EOFError, OSError):
+                    self._drop(index)
+                    continue
+
+                for message in messages:
+                    self._route(index, *message)
+
+            self._flush()
+
+        self._selector.close()
+
+    def _flush(self):
+        # Whatever a socket does not take now waits for it to be writable
+        for index, channel in list(self._channels.items()):
+            try:
+                done = channel.flush()
+
+            except OSError:
+                self._drop(index)
+                continue
+
+            events = EVENT_READ if done else EVENT_READ | EVENT_WRITE
+            if self._selector.get_key(channel).events != events:
+                self._selector.modify(channel, events, index)
+
+    def _receive_posts(self):
+        try:
+            while self._wake.recv(4096):
+                pass
+
+        except (BlockingIOError, InterruptedError):
+            pass
+
+        while True:
+            try:
+                action, payload = self._posts.get_nowait()
+
+            except Empty:
+                return
+
+            self._route(None, action, payload)
+
+    def _post(self, action, payload):
+        # Hands a message from the parent to the hub thread
+        self._posts.put((action, payload))
+        try:
+            self._waker.send(b"\0")
+
+        except (BlockingIOError, InterruptedError):
+            # Plenty of wake ups are pending already
+            pass
+
+    def _drop(self, index):
+        channel = self._channels.pop(index, None)
+        self._topics.pop(index, None)
+        self._held.pop(index, None)
+        if channel is not None:
+            self._selector.unregister(channel)
+            channel.close()
+
+    def _deliver(self, index, events):
+        channel = self._channels[index]
+        if self._limit is not None and channel.pending > self._limit:
+            dropped.inc(len(events))
+            return
+
+        channel.put(("events", events))
+
+    def _route(self, origin, action, payload):
+        if action == "close":
+            for index in list(self._channels):
+                self._drop(index)
+
+            self._serving = False
+            return
+
+        if action == "attach":
+            self._attach(*payload)
+            return
+
+        if action == "subscribe":
+            topics = self._topics[origin] = set(payload)
+            held = self._held.pop(origin, None)
+            batches = list() if held is None else held.take()
+            selected = list()
+            for events in batches:
+                for event in events:
+                    if self._matches(topics, event.kind):
+                        selected.append(event)
+
+            if len(selected) > 0:
+                self._deliver(origin, selected)
+
+            self._channels[origin].put(("subscribed", None))
+            return
+
+        self._forward(origin, payload)
+
+    def _forward(self, origin, events):
+        for index, topics in list(self._topics.items()):
+            if index == origin:
+                continue
+
+            if topics is None:
+                self._held[index].put(events)
+                continue
+
+            selected = [e for e in events if self._matches(topics, e.kind)]
+            if len(selected) > 0:
+                self._deliver(index, selected)
+
+        if origin is not None and self._store is not None:
+            topics = self._subscribe
+            selected = [e for e in events if self._matches(topics, e.kind)]
+            if len(selected) > 0:
+                self._inbox.put(selected)
+
+    def join(self, store, publish=list(), subscribe=list()):
+        """
+        Connects store to the bus, in a child this returns once the hub has
+        its subscription
+        """
+        self._store = store
+        self._publish = set(publish)
+        self._subscribe = set(subscribe)
+
+        if not self.is_parent:
+            self._channel.send(("subscribe", list(self._subscribe)))
+            while True:
+                message = self._channel.recv()
+                if message[0] == "subscribed":
+                    break
+
+                # Held events arrive first, they are kept for pump
+                self._early.append(message)
+
+        store.subscribe(list(self._publish), self._send, batch=True)
+
+    def _send(self, events):
+        if self._absorbing:
+            return
+
+        selected = [e for e in events if self._matches(self._publish, e.kind)]
+        if len(selected) == 0:
+            return
+
+        if self.is_parent:
+            self._post("events", selected)
+
+        else:
+            self._channel.send(("events", selected))
+
+    def _absorb(self, events):
+        self._absorbing = True
+        try:
+            return self._store.absorb(events)
+
+        finally:
+            self._absorbing = False
+
+    def pump(self, timeout=0):
+        """
+        Delivers received events into the joined store, returns their count
+        """
+        if self.is_parent:
+            batches = self._inbox.take(timeout)
+            if len(batches) == 0:
+                return 0
+
+        else:
+            if len(self._early) > 0:
+                messages = self._early
+                self._early = list()
+
+            elif self._channel.poll(timeout):
+                messages = self._channel.read()
+
+            else:
+                return 0
+
+            batches = [payload for _, payload in messages]
+
+        return sum(self._absorb(events) for events in batches)
+
+    def close(self):
+        """
+        Disconnects this process from the bus, in the parent it stops the hub
+        """
+        if not self.is_parent:
+            self._channel.close()
+            return
+
+        if self._hub is not None and self._hub.is_alive():
+            self._post("close", None)
+            self._hub.join()
+
+        for index in list(self._channels):
+            self._drop(index)
+
+        if self._wake is not None:
+            self._wake.close()
+            self._waker.close()
+
+    def start(self, interval=0.1):
+        # NOTE: Store is not thread-safe, only pump in background when the
+        # store is not also written from the main thread
+        def run():
+            while True:
+                try:
+                    self.pump(interval)
+
+                except (EOFError, OSError):
+                    return
+
+        self._pump = Thread(target=run, daemon=True)
+        self._pump.start()
@@ -5,10 +5,20 @@ class Frozen:
     def __init__(self, value):
         self.set_value(value)
 
+    @classmethod
+    def thaw(cls, raw):
+        frozen = cls.__new__(cls)
+        frozen._value = raw
+        return frozen
+
     @property
     def value(self):
         return loads(self._value)
 
+    @property
+    def raw(self):
+        return self._value
+
     def set_value(self, value):
         self._value = dumps(value)
 
@@ -19,6 +29,9 @@ class Ref(MutableMapping):
         self._freeze = freeze
         self._refs = dict()
 
+        # Event kinds written through this ref, the only ones it mirrors
+        self._tracked = set()
+
     def __getitem__(self, key):
         #return self._transform(self._refs.get(key))
         ref = self._refs.get(key)
@@ -28,6 +41,7 @@ class Ref(MutableMapping):
         return ref
 
     def __setitem__(self, key, value):
+        self._tracked.add(key)
         #value = self._transform(value)
         #self._refs[key] = value
         if self._freeze:
@@ -62,6 +76,44 @@ class Ref(MutableMapping):
 
         return value
 
+    def dump(self):
+        # Copied at once, snapshots may dump from a thread of their own
+        items = list(self._refs.items())
+        if self._freeze:
+            return [(key, ref.raw) for key, ref in items]
+
+        return [(key, dumps(value)) for key, value in items]
+
+    def tracks(self, kind):
+        return kind in self._tracked
+
+    def track(self, kinds):
+        self._tracked.update(kinds)
+
+    def load(self, items):
+        self._refs.clear()
+        self._tracked.clear()
+        for key, raw in items:
+            self._tracked.add(key)
+            self._refs[key] = Frozen.thaw(raw) if self._freeze else loads(raw)
+
+    def apply(self, event):
+        """
+        Mirrors an event without logging it back to the store, events of
+        kinds the ref does not track are ignored like on the live path
+        """
+        if event.kind == "CLEAN":
+            self._refs.pop(event.data, None)
+
+        elif not self.tracks(event.kind):
+            return
+
+        elif self._freeze:
+            self._refs[event.kind] = Frozen(event.data)
+
+        else:
+            self._refs[event.kind] = event.data
+
     def pop(self, key, default=None):
         value = self[key]
         del self[key]
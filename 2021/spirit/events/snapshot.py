@@ -0,0 +1,188 @@
+from typing import NamedTuple, Any
+from datetime import datetime
+from pathlib import Path
+from threading import Thread, Lock, Event as Signal
+from struct import Struct
+from pickle import loads, dumps
+from calendar import timegm
+from time import monotonic
+from os import replace
+
+MAGIC = b"SPRT"
+VERSION = 1
+
+# magic, version, sequence number, timestamp, entry count
+HEADER = Struct("<4sBQdI")
+
+# key length, value length
+ENTRY = Struct("<II")
+
+class Snapshot(NamedTuple):
+    seq: int
+    when: datetime
+    refs: Any
+
+def utc_timestamp(when):
+    # Naive datetimes are UTC here, timestamp() would read them as local
+    return timegm(when.utctimetuple()) + when.microsecond / 1e6
+
+def snapshot_name(seq):
+    return f"snapshot-{seq:020d}.snap"
+
+def dump_snapshot(path, seq, items, when=None):
+    """
+    Writes (key, pickled value) pairs to path, atomically replacing it
+    """
+    if when is None:
+        when = datetime.utcnow()
+
+    items = list(items)
+    path = Path(path)
+    partial = path.with_suffix(".partial")
+    with open(partial, "wb") as snap:
+        stamp = utc_timestamp(when)
+        snap.write(HEADER.pack(MAGIC, VERSION, seq, stamp, len(items)))
+        for key, value in items:
+            key = dumps(key)
+            snap.write(ENTRY.pack(len(key), len(value)))
+            snap.write(key)
+            snap.write(value)
+
+    replace(partial, path)
+    return path
+
+def load_snapshot(path):
+    data = memoryview(Path(path).read_bytes())
+    magic, version, seq, when, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a valid snapshot")
+
+    refs = list()
+    offset = HEADER.size
+    for _ in range(count):
+        key_size, value_size = ENTRY.unpack_from(data, offset)
+        offset = offset + ENTRY.size
+        key = loads(data[offset:offset + key_size])
+        offset = offset + key_size
+        refs.append((key, bytes(data[offset:offset + value_size])))
+        offset = offset + value_size
+
+    return Snapshot(seq, datetime.utcfromtimestamp(when), refs)
+
+def latest_snapshot(directory):
+    snaps = sorted(Path(directory).glob("snapshot-*.snap"))
+    if len(snaps) == 0:
+        return None
+
+    return load_snapshot(snaps[-1])
+
+class Snapshotter:
+    """
+    Writes snapshots of ref from a thread, every few events or seconds
+
+    Event intervals are checked as events are observed. With seq, the
+    current sequence number, seconds intervals also pass while nothing is
+    logged, the items are then captured on the snapshot thread.
+    """
+    def __init__(
+        self,
+        ref,
+        directory,
+        events=None,
+        seconds=None,
+        keep=2,
+        seq=None
+    ):
+        if events is None and seconds is None:
+            raise ValueError("Snapshot interval requires events or seconds")
+
+        self._ref = ref
+        self._seq = seq
+        self._directory = Path(directory)
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._events = events
+        self._seconds = seconds
+        self._keep = keep
+
+        self._last_seq = 0
+        self._last_time = monotonic()
+
+        # Only the most recent capture is worth writing
+        self._pending = None
+        self._lock = Lock()
+        self._wake = Signal()
+        self._running = True
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _due(self, seq):
+        if self._events is not None and seq - self._last_seq >= self._events:
+            return True
+
+        if self._seconds is not None:
+            return monotonic() - self._last_time >= self._seconds
+
+        return False
+
+    def _timeout(self):
+        if self._seconds is None or self._seq is None:
+            return None
+
+        return max(self._seconds - (monotonic() - self._last_time), 0)
+
+    def _idle(self):
+        # Nothing was logged since the last snapshot, there is nothing new
+        seq = self._seq()
+        if seq == self._last_seq:
+            self._last_time = monotonic()
+            return
+
+        self.capture(seq)
+
+    def _run(self):
+        while self._running or self._pending is not None:
+            woken = self._wake.wait(self._timeout())
+            with self._lock:
+                pending = self._pending
+                self._pending = None
+                self._wake.clear()
+
+            # A failed snapshot must not stop the ones after it
+            try:
+                if not woken and self._running:
+                    self._idle()
+
+                elif pending is not None:
+                    self._write(*pending)
+
+            except Exception:
+                from spirit.utils.log import get_logger
+                logger = get_logger("snapshot")
+                logger.exception("Snapshot to %s failed", self._directory)
+
+    def _write(self, seq, when, items):
+        path = self._directory / snapshot_name(seq)
+        dump_snapshot(path, seq, items, when)
+
+        snaps = sorted(self._directory.glob("snapshot-*.snap"))
+        for old in snaps[:-self._keep]:
+            old.unlink()
+
+    def observe(self, seq):
+        if self._due(seq):
+            self.capture(seq)
+
+    def capture(self, seq):
+        # Items are captured on the caller's thread to keep them consistent
+        items = self._ref.dump()
+        with self._lock:
+            self._pending = seq, datetime.utcnow(), items
+            self._wake.set()
+
+        self._last_seq = seq
+        self._last_time = monotonic()
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        self._thread.join()
@@ -1,7 +1,16 @@
 from spirit.events.ref import Ref
+from spirit.events.snapshot import Snapshotter, load_snapshot, latest_snapshot
+from spirit.utils.metrics import metrics
 
 from typing import NamedTuple, Any
 from datetime import datetime, timedelta
+from pathlib import Path
+from time import monotonic, perf_counter
+
+logged = metrics.counter("store.events")
+
+# Subscribing to it subscribes to every kind
+WILDCARD = "*"
 
 class Event(NamedTuple):
     kind: str
@@ -12,7 +21,16 @@ class Store:
     def __init__(self, listeners=dict(), debug=False):
         self._listeners = listeners
         self._events = list()
+        self._offset = 0
         self._ref = Ref(self)
+        self._snapshotter = None
+        self._batch_listeners = dict()
+        self._timers = dict()
+
+        # Coalesced kinds map to their window, pending writes to a deadline
+        self._windows = dict()
+        self._pending = dict()
+        self._deadline = None
 
         self._stats = dict()
         self._stats["start"] = datetime.utcnow()
@@ -32,6 +50,11 @@ class Store:
 
             yield event
 
+    @property
+    def seq(self):
+        # Sequence number of the next event to be logged
+        return self._offset + len(self._events)
+
     def use(self, key):
         value = self._ref[key]
         change = lambda v: self._ref.update({key: v})
@@ -39,43 +62,116 @@ class Store:
 
     def silence(self, kind, clean=False):
         listeners = self._listeners.pop(kind, None)
+        self._batch_listeners.pop(kind, None)
         if clean:
             self.log("CLEAN", kind)
 
         return listeners
 
-    def subscribe(self, kinds, listener):
+    def subscribe(self, kinds, listener, batch=False):
         if not callable(listener):
             return None
 
-        patched = kinds + ["CLEAN"]
+        # Batch listeners are called once per kind with a list of events
+        registry = self._batch_listeners if batch else self._listeners
+
+        patched = kinds if WILDCARD in kinds else kinds + ["CLEAN"]
         for kind in patched:
-            listeners = self._listeners.get(kind, list())
+            listeners = registry.get(kind, list())
             if listener not in listeners:
                 listeners.append(listener)
 
-            self._listeners[kind] = listeners
+            registry[kind] = listeners
 
-        return self.unsubscribe(kinds, listener)
+        return self.unsubscribe(kinds, listener, batch)
 
-    def unsubscribe(self, kinds, listener):
+    def unsubscribe(self, kinds, listener, batch=False):
+        registry = self._batch_listeners if batch else self._listeners
         def execute():
-            for kind, listeners in self._listeners.items():
+            for kind, listeners in registry.items():
                 if kind in kinds:
                     listeners.remove(listener)
 
         return execute
 
+    def coalesce(self, kinds, window):
+        """
+        Collapses writes to kinds within window milliseconds into the latest
+
+        Nothing runs when a window closes: the held write goes out with the
+        next log or log_many after it, or with flush. Callers have to flush
+        once a burst is over, snapshot and compact flush on their own.
+        """
+        for kind in kinds:
+            if window is None:
+                self._windows.pop(kind, None)
+
+            else:
+                self._windows[kind] = window / 1000
+
+    def _dispatch_timer(self, kind):
+        timer = self._timers.get(kind)
+        if timer is None:
+            timer = metrics.histogram("store.dispatch", kind=kind)
+            self._timers[kind] = timer
+
+        return timer
+
+    def _matching(self, registry, kind):
+        listeners = registry.get(kind, list())
+        everything = registry.get(WILDCARD)
+        if everything and kind != WILDCARD:
+            return listeners + everything
+
+        return listeners
+
     def process(self, event):
         if self._debug:
             print(event.when, event.kind, event.data)
 
-        for kind, listeners in self._listeners.items():
-            if event.kind == kind:
-                for listener in listeners:
-                    listener(event)
+        start = perf_counter()
+        for listener in self._matching(self._listeners, event.kind):
+            listener(event)
+
+        self._dispatch_timer(event.kind).observe(perf_counter() - start)
+
+    def process_many(self, events):
+        batches = dict()
+        spent = dict()
+        for event in events:
+            if self._debug:
+                print(event.when, event.kind, event.data)
+
+            start = perf_counter()
+            for listener in self._matching(self._listeners, event.kind):
+                listener(event)
+
+            elapsed = perf_counter() - start
+            spent[event.kind] = spent.get(event.kind, 0) + elapsed
+
+            batch = batches.get(event.kind)
+            if batch is None:
+                batch = batches[event.kind] = list()
+
+            batch.append(event)
+
+        for kind, batch in batches.items():
+            start = perf_counter()
+            for listener in self._matching(self._batch_listeners, kind):
+                listener(batch)
+
+            elapsed = spent[kind] + perf_counter() - start
+            self._dispatch_timer(kind).observe(elapsed)
+
+    def get_events(self, after=timedelta(0), since=None):
+        if since is not None:
+            start = max(since - self._offset, 0)
+            for event in self._events[start:]:
+                if event is not None:
+                    yield event
+
+            return
 
-    def get_events(self, after=timedelta(0)):
         if isinstance(after, timedelta):
             after = datetime.utcnow() - after
 
@@ -83,19 +179,193 @@ class Store:
             if event.when >= after:
                 yield event
 
+    def _hold(self, kind, data, now):
+        pending = self._pending.get(kind)
+        if pending is not None:
+            self._pending[kind] = pending[0], data
+            return
+
+        deadline = now + self._windows[kind]
+        self._pending[kind] = deadline, data
+        if self._deadline is None or deadline < self._deadline:
+            self._deadline = deadline
+
+    def _release(self, now=None, everything=False):
+        if len(self._pending) == 0:
+            return list()
+
+        if not everything and now < self._deadline:
+            return list()
+
+        released = list()
+        deadline = None
+        for kind, (due, data) in list(self._pending.items()):
+            if everything or due <= now:
+                released.append((kind, data))
+                del self._pending[kind]
+
+            elif deadline is None or due < deadline:
+                deadline = due
+
+        self._deadline = deadline
+        return released
+
+    def _commit(self, pairs):
+        if len(pairs) == 0:
+            return 0
+
+        # A single timestamp is shared by the whole batch
+        when = datetime.utcnow()
+        events = [Event(kind, when, data) for kind, data in pairs]
+        return self.absorb(events)
+
+    def absorb(self, events):
+        """
+        Dispatches and records events created elsewhere, keeping their times
+        """
+        if len(events) == 0:
+            return 0
+
+        self.process_many(events)
+
+        self._events.extend(events)
+        self._stats["events"] = self._stats["events"] + len(events)
+        logged.inc(len(events))
+
+        if self._snapshotter is not None:
+            self._snapshotter.observe(self.seq)
+
+        return len(events)
+
     def log(self, kind, data):
+        if len(self._windows) > 0:
+            now = monotonic()
+            released = self._release(now)
+            if kind in self._windows:
+                self._hold(kind, data, now)
+                return self._commit(released)
+
+            if len(released) > 0:
+                released.append((kind, data))
+                return self._commit(released)
+
+        if len(self._batch_listeners) > 0:
+            return self._commit([(kind, data)])
+
         when = datetime.utcnow()
         event = Event(kind, when, data)
         self.process(event)
 
         self._events.append(event)
         self._stats["events"] = self._stats["events"] + 1
+        logged.inc()
+
+        if self._snapshotter is not None:
+            self._snapshotter.observe(self.seq)
+
+        return 1
+
+    def log_many(self, events):
+        """
+        Implements log but for multiple (kind, data) pairs or a mapping
+        """
+        if isinstance(events, dict):
+            events = events.items()
+
+        pairs = list()
+        if len(self._windows) > 0:
+            now = monotonic()
+            pairs.extend(self._release(now))
+            for kind, data in events:
+                if kind in self._windows:
+                    self._hold(kind, data, now)
+
+                else:
+                    pairs.append((kind, data))
+
+        else:
+            pairs.extend(events)
+
+        return self._commit(pairs)
 
-    def replay(self, after=timedelta(0)):
+    def flush(self):
+        """
+        Dispatches and records every coalesced write still held back
+        """
+        return self._commit(self._release(everything=True))
+
+    def replay(self, after=timedelta(0), since=None):
         events = 0
-        for event in self.get_events(after):
+        for event in self.get_events(after, since):
             self.process(event)
             events = events + 1
 
         return events
 
+    def compact(self, seq):
+        """
+        Drops events logged before seq, they must be covered by a snapshot
+        """
+        self.flush()
+        drop = min(max(seq - self._offset, 0), len(self._events))
+        del self._events[:drop]
+        self._offset = self._offset + drop
+        return drop
+
+    def snapshot_every(self, directory, events=None, seconds=None, keep=2):
+        if self._snapshotter is not None:
+            self._snapshotter.stop()
+
+        args = self._ref, directory, events, seconds, keep
+        seq = lambda: self.seq
+        self._snapshotter = Snapshotter(*args, seq=seq)
+        return self._snapshotter
+
+    def snapshot(self):
+        # Held writes belong in the snapshot
+        self.flush()
+        if self._snapshotter is None:
+            return None
+
+        seq = self.seq
+        self._snapshotter.capture(seq)
+        return seq
+
+    def restore(self, source, tail=None, kinds=list()):
+        """
+        Loads the ref state from a snapshot and replays only the events after
+        it, either from this store or from the given tail of events
+
+        The ref only mirrors kinds it tracks: keys in the snapshot, keys set
+        through it and the given kinds, for keys first set after the
+        snapshot by another process.
+        """
+        snapshot = source
+        if isinstance(source, (str, Path)):
+            path = Path(source)
+            if path.is_dir():
+                snapshot = latest_snapshot(path)
+
+            else:
+                snapshot = load_snapshot(path)
+
+        if snapshot is None:
+            return 0
+
+        self._ref.load(snapshot.refs)
+        self._ref.track(kinds)
+        if tail is None:
+            tail = list(self.get_events(since=snapshot.seq))
+
+        else:
+            # An external tail replaces the local history after the snapshot
+            tail = list(tail)
+            self._events = list(tail)
+            self._offset = snapshot.seq
+
+        for event in tail:
+            self._ref.apply(event)
+            self.process(event)
+
+        return len(tail)
+
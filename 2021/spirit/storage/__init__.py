@@ -1,2 +1,6 @@
 from spirit.storage.database import Database
 from spirit.storage.memory import Memory, Metadata, Reference, BaseModel
+from spirit.storage.memory import Lazy, resolved, Change, change_kind
+from spirit.storage.bulk import Column, read_csv, read_ndjson
+from spirit.storage.buffer import WriteBehind
+from spirit.storage.view import View, AggregateView, IndexView
@@ -0,0 +1,286 @@
+from spirit.storage.database import Database
+from spirit.utils.metrics import metrics
+from spirit.utils import at_child_exit, eprint
+
+from threading import Thread, Lock, Condition
+from concurrent.futures import Future
+from atexit import register, unregister
+from os import register_at_fork
+from sqlite3 import Error
+from time import monotonic
+from traceback import format_exc
+
+INSERT = "insert"
+UPDATE = "update"
+DELETE = "delete"
+
+flushes = metrics.counter("memory.buffer_flushes")
+buffered = metrics.counter("memory.buffer_writes")
+flush_time = metrics.histogram("memory.buffer_flush")
+
+def matches(where, fields):
+    """
+    Evaluates a where dict against a row the way Database.where_clause does
+    """
+    for key, value in where.items():
+        field = fields.get(key)
+        if value is None:
+            if field is not None:
+                return False
+
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            if field not in value:
+                return False
+
+        elif field != value:
+            return False
+
+    return True
+
+def statement(table, kind, where, values):
+    if kind == INSERT:
+        keys = ",".join(values.keys())
+        marks = ",".join("?" * len(values))
+        query = f"INSERT INTO {table} ({keys}) VALUES ({marks});"
+        return query, tuple(values.values())
+
+    clause, conditions = Database.where_clause(where)
+    if kind == UPDATE:
+        variables = ",".join(f"{key} = ?" for key in values.keys())
+        query = f"UPDATE {table} SET {variables}{clause};"
+        return query, tuple(values.values()) + conditions
+
+    return f"DELETE FROM {table}{clause};", conditions
+
+class WriteBehind:
+    """
+    Bounded queue of writes to one table, committed by a background thread
+    in one transaction per batch
+
+    A batch is written once size writes are queued or the oldest has waited
+    interval seconds, and on flush, close and interpreter exit. Producers
+    block while capacity writes are queued. Forked children start with an
+    empty queue of their own. Every write gets a future for
+    the row id (inserts) or row count (updates and deletes); a failing write
+    only fails its own future, cancelling it before its batch is written
+    drops the write.
+    """
+    def __init__(self, db, table, size=500, interval=0.5, capacity=None):
+        self._db = db
+        self._table = table
+        self._size = size
+        self._interval = interval
+        self._capacity = capacity or size * 10
+        self._queue = list()
+        self._writing = list()
+        self._oldest = None
+        self._closed = False
+        self._start()
+        register_at_fork(after_in_child=self._after_fork)
+
+    def _start(self):
+        self._condition = Condition()
+        self._flush_lock = Lock()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+        register(self.close)
+
+    def _after_fork(self):
+        # The inherited writes are the parent's to commit, not ours
+        for _, _, _, future in self._writing + self._queue:
+            future.cancel()
+
+        self._queue = list()
+        self._writing = list()
+        self._oldest = None
+        if self._closed:
+            return
+
+        # Workers ending with _exit skip atexit, they run child exit hooks
+        unregister(self.close)
+        self._start()
+        at_child_exit(self.close)
+
+    def __len__(self):
+        with self._condition:
+            return len(self._queue) + len(self._writing)
+
+    def _due(self):
+        if len(self._queue) >= self._size:
+            return True
+
+        if self._oldest is None:
+            return False
+
+        return monotonic() - self._oldest >= self._interval
+
+    def _timeout(self):
+        if self._oldest is None:
+            return None
+
+        return max(self._interval - (monotonic() - self._oldest), 0)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and not self._due():
+                    self._condition.wait(self._timeout())
+
+                if self._closed:
+                    return
+
+            # One bad batch must not stop the writes behind it
+            try:
+                self.flush()
+
+            except Exception:
+                eprint(format_exc())
+
+    def enqueue(self, kind, where=dict(), values=dict()):
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Write buffer is closed")
+
+            while len(self._queue) >= self._capacity:
+                self._condition.notify_all()
+                self._condition.wait()
+
+            # The first write starts the interval, the thread has to know
+            if self._oldest is None:
+                self._oldest = monotonic()
+                self._condition.notify_all()
+
+            self._queue.append((kind, where, values, future))
+            if len(self._queue) >= self._size:
+                self._condition.notify_all()
+
+        buffered.inc()
+        return future
+
+    def flush(self):
+        """
+        Writes everything queued so far, returns once it is committed
+        """
+        with self._flush_lock:
+            with self._condition:
+                batch = self._queue
+                self._queue = list()
+                self._oldest = None
+                self._writing = batch
+                self._condition.notify_all()
+
+            try:
+                if len(batch) > 0:
+                    self._write(batch)
+
+            finally:
+                with self._condition:
+                    self._writing = list()
+
+    def _write(self, batch):
+        # Cancelled writes are dropped, the rest can no longer be cancelled
+        batch = [
+            write for write in batch
+            if write[3].set_running_or_notify_cancel()
+        ]
+
+        if len(batch) == 0:
+            return
+
+        table = self._table
+        outcomes = list()
+        try:
+            with flush_time.time():
+                with self._db.transaction(immediate=True) as cursor:
+                    for kind, where, values, future in batch:
+                        query, args = statement(table, kind, where, values)
+
+                        # Savepoints keep one bad row from failing the batch
+                        cursor.execute("SAVEPOINT write;")
+                        try:
+                            cursor.execute(query, args)
+
+                        except Error as e:
+                            cursor.execute("ROLLBACK TO write;")
+                            cursor.execute("RELEASE write;")
+                            outcomes.append((future, False, e))
+                            continue
+
+                        if kind == INSERT:
+                            result = cursor.lastrowid
+
+                        else:
+                            result = max(cursor.rowcount, 0)
+
+                        cursor.execute("RELEASE write;")
+                        outcomes.append((future, True, result))
+
+        except Exception as e:
+            # Nothing was committed
+            for _, _, _, future in batch:
+                future.set_exception(e)
+
+            return
+
+        flushes.inc()
+        for future, ok, result in outcomes:
+            if ok:
+                future.set_result(result)
+
+            else:
+                future.set_exception(result)
+
+    def pending(self, future):
+        """
+        Returns the values of an insert that was not committed yet
+        """
+        with self._condition:
+            writes = self._writing + self._queue
+
+        for kind, _, values, write in writes:
+            if write is future and kind == INSERT:
+                return dict(values)
+
+        return None
+
+    def overlay(self, entries):
+        """
+        Applies queued updates and deletes to rows read from the table
+        """
+        with self._condition:
+            writes = self._writing + self._queue
+
+        writes = [write for write in writes if write[0] != INSERT]
+        if len(writes) == 0:
+            return entries
+
+        result = list()
+        for fields in entries:
+            alive = True
+            for kind, where, values, _ in writes:
+                if not matches(where, fields):
+                    continue
+
+                if kind == DELETE:
+                    alive = False
+                    break
+
+                fields.update(values)
+
+            if alive:
+                result.append(fields)
+
+        return result
+
+    def close(self):
+        """
+        Stops the background thread and flushes what is left
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+        self._thread.join()
+        self.flush()
+        unregister(self.close)
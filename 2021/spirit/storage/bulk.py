@@ -0,0 +1,225 @@
+from typing import Union
+from array import array
+from csv import DictReader
+from json import loads
+from contextlib import contextmanager
+
+NoneType = None.__class__
+
+INTEGER = "integer"
+REAL = "real"
+TEXT = "text"
+BLOB = "blob"
+OBJECT = "object"
+
+KINDS = dict()
+KINDS[bool] = INTEGER
+KINDS[int] = INTEGER
+KINDS[float] = REAL
+KINDS[str] = TEXT
+KINDS[bytes] = BLOB
+
+TYPECODES = dict()
+TYPECODES[INTEGER] = "q"
+TYPECODES[REAL] = "d"
+
+def column_kind(annotation):
+    if getattr(annotation, "__origin__", None) is Union:
+        annotation = annotation.__args__[0]
+
+    return KINDS.get(annotation, OBJECT)
+
+class Column:
+    """
+    Column of exported values kept in contiguous buffers
+
+    Integers and reals live in a typed array, text and blobs in one byte
+    buffer sliced by offsets, anything else in a list. A numeric column
+    falls back to a list once a value does not fit its array. NULLs are
+    tracked in a mask that only exists once a NULL was seen.
+    """
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+        self.nulls = None
+        self._length = 0
+        self._buffer = None
+        self.offsets = None
+        if kind in TYPECODES:
+            self.values = array(TYPECODES[kind])
+
+        elif kind in (TEXT, BLOB):
+            self.values = None
+            self.offsets = array("q", [0])
+            self._buffer = bytearray()
+
+        else:
+            self.values = list()
+
+    def __len__(self):
+        return self._length
+
+    def __repr__(self):
+        return f"Column({self.name}, {self.kind}, {self._length} rows)"
+
+    def _null(self, index):
+        if self.nulls is None:
+            self.nulls = bytearray(self._length)
+
+        self.nulls[index] = 1
+
+    def _extend_array(self, values, start):
+        if None not in values:
+            self.values.extend(values)
+            return
+
+        for index, value in enumerate(values):
+            if value is None:
+                self._null(start + index)
+                value = 0
+
+            self.values.append(value)
+
+    def extend(self, values):
+        start = self._length
+        self._length = start + len(values)
+        if self.nulls is not None:
+            self.nulls.extend(bytes(len(values)))
+
+        if isinstance(self.values, array):
+            try:
+                self._extend_array(values, start)
+                return
+
+            except TypeError:
+                # SQLite returns what was stored, like floats in an int column
+                del self.values[start:]
+                self.values = self.values.tolist()
+
+        if self.offsets is None:
+            self.values.extend(values)
+            if None in values:
+                for index, value in enumerate(values):
+                    if value is None:
+                        self._null(start + index)
+
+            return
+
+        buffer = self._buffer
+        offsets = self.offsets
+        for index, value in enumerate(values):
+            if value is None:
+                self._null(start + index)
+
+            elif self.kind == TEXT:
+                buffer += value.encode("utf-8")
+
+            else:
+                buffer += value
+
+            offsets.append(len(buffer))
+
+    @property
+    def data(self):
+        """
+        Buffer holding the values, sliced by offsets for text and blobs
+        """
+        if self._buffer is not None:
+            return memoryview(self._buffer)
+
+        if isinstance(self.values, array):
+            return memoryview(self.values)
+
+        return self.values
+
+    def __getitem__(self, index):
+        if index < 0:
+            index = index + self._length
+
+        if not 0 <= index < self._length:
+            raise IndexError("Column index out of range")
+
+        if self.nulls is not None and self.nulls[index]:
+            return None
+
+        if self.offsets is None:
+            return self.values[index]
+
+        start = self.offsets[index]
+        stop = self.offsets[index + 1]
+        value = self._buffer[start:stop]
+        if self.kind == TEXT:
+            return value.decode("utf-8")
+
+        return bytes(value)
+
+    def __iter__(self):
+        for index in range(self._length):
+            yield self[index]
+
+    def tolist(self):
+        return list(self)
+
+@contextmanager
+def opened(source, mode="r"):
+    # Accepts paths as well as file objects, which are left open
+    if hasattr(source, "read"):
+        yield source
+        return
+
+    with open(source, mode, newline="") as handle:
+        yield handle
+
+def converter(annotation):
+    nullable = False
+    if getattr(annotation, "__origin__", None) is Union:
+        nullable = annotation.__args__[-1] is NoneType
+        annotation = annotation.__args__[0]
+
+    def convert(value):
+        # Empty cells are NULL unless they can be an empty string
+        empty = value == "" and (nullable or annotation is not str)
+        if value is None or empty:
+            return None
+
+        if annotation is bool:
+            return value.lower() in ("1", "true", "yes", "y")
+
+        if annotation is bytes:
+            return bytes.fromhex(value)
+
+        if annotation in (int, float):
+            return annotation(value)
+
+        return value
+
+    return convert
+
+def read_csv(source, model=None, delimiter=","):
+    """
+    Yields rows of a CSV file with a header line as dicts, converted to the
+    field types of model when one is given
+    """
+    with opened(source) as handle:
+        reader = DictReader(handle, delimiter=delimiter)
+        converters = dict()
+        if model is not None:
+            for field in model._fields:
+                converters[field] = converter(model._field_types[field])
+
+        for row in reader:
+            for key, convert in converters.items():
+                if key in row:
+                    row[key] = convert(row[key])
+
+            yield row
+
+def read_ndjson(source):
+    """
+    Yields one dict per non-empty line of newline delimited JSON
+    """
+    with opened(source) as handle:
+        for line in handle:
+            line = line.strip()
+            if len(line) > 0:
+                yield loads(line)
@@ -1,37 +1,89 @@
 from spirit.utils import UNDEFINED, eprint
+from spirit.utils.metrics import metrics
 
 from typing import NamedTuple
 from enum import Enum
 
 from pathlib import Path
-from threading import Lock
+from os import replace
+from threading import Lock, local
+from itertools import count
 from contextlib import closing, contextmanager
 from traceback import format_exc
 from sqlite3 import connect, PARSE_DECLTYPES, PARSE_COLNAMES, IntegrityError
+from sqlite3 import OperationalError
+from time import sleep
+
+BUSY_RETRIES = 5
+BUSY_DELAY = 0.01
+
+SCHEMA = "_schema"
+CHANGES = "_changes"
+MEMORY = ":memory:"
+
+# Shared-cache databases are per process, forked children get a copy
+MEMORY_URI = "file:spirit-{}?mode=memory&cache=shared"
+
+_memory_ids = count()
+
+queries = metrics.counter("database.queries")
+commits = metrics.counter("database.commits")
+busy_retries = metrics.counter("database.busy_retries")
+query_time = metrics.histogram("database.query")
+
+def is_busy(error):
+    message = str(error)
+    return "locked" in message or "busy" in message
 
 class Database:
     def __init__(self, path, tables, indices=dict(), lock=Lock(), debug=False):
         self._path = path
         self._lock = lock
         self._debug = debug
-        self._conn = None
-
-        # NOTE: current use case of :memory: does not really work here
-        #if self._path == ":memory:" or not Path(self._path).exists():
-        if not Path(self._path).exists():
+        self._local = local()
+        self._listeners = list()
+        self._tables = tables
+        self._indices = indices
+
+        # An in-memory database lives as long as one connection to it does,
+        # every other connection shares its cache through a named URI
+        self._keeper = None
+        self._uri = self._path == MEMORY
+        if self._uri:
+            self._path = MEMORY_URI.format(next(_memory_ids))
+            self._keeper = self._connect()
+
+        if self._keeper is not None or not Path(self._path).exists():
             self.create_many(tables)
             self.create_indices(**indices)
 
-    @contextmanager
-    def _connection(self):
+    @property
+    def in_memory(self):
+        return self._keeper is not None
+
+    # Every thread works on a connection of its own
+    @property
+    def _conn(self):
+        return getattr(self._local, "conn", None)
+
+    @_conn.setter
+    def _conn(self, conn):
+        self._local.conn = conn
+
+    def _connect(self):
         settings = dict()
         settings["check_same_thread"] = False
         settings["isolation_level"] = "DEFERRED"
         settings["detect_types"] = PARSE_DECLTYPES | PARSE_COLNAMES
+        settings["uri"] = self._uri
+        return connect(str(self._path), **settings)
 
-        # Open connection
+    @contextmanager
+    def _connection(self):
+        # Open connection, listeners may nest one inside another
         #print(self._path)
-        self._conn = connect(str(self._path), **settings)
+        previous = self._conn
+        self._conn = self._connect()
 
         try:
             # Give cotnrol back to caller
@@ -43,16 +95,17 @@ class Database:
         else:
             self._conn.close()
 
-        self._conn = None
+        self._conn = previous
 
     @contextmanager
-    def _transaction(self):
+    def _transaction(self, begin="BEGIN"):
+        changes = None
         with self._lock:
             # Enforce foreign keys
             self._conn.execute("PRAGMA foreign_keys = ON;")
 
             # Initiate auto-commit mode
-            self._conn.execute("BEGIN")
+            self._retry(self._conn.execute, begin)
             try:
                 # Give control back to caller
                 yield
@@ -63,15 +116,99 @@ class Database:
                 raise
 
             else:
-                # Commit on success
-                self._conn.commit()
+                # Captured changes are taken with every commit, listened to
+                # or not, so they never pile up
+                changes = self._drain()
+                self._retry(self._conn.commit)
+                commits.inc()
+
+        # Listeners may write themselves, so they run outside the lock
+        if changes:
+            self._notify(changes)
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """
+        Runs every statement executed on the yielded cursor in one transaction,
+        holding the write lock from the start when immediate is set
+        """
+        begin = "BEGIN IMMEDIATE" if immediate else "BEGIN"
+        with self._connection():
+            with closing(self._conn.cursor()) as cursor:
+                with self._transaction(begin):
+                    yield cursor
 
     def close(self):
-        self._conn.close()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+        if self._keeper is not None:
+            self._keeper.close()
+            self._keeper = None
+
+    def snapshot(self, path, pages=-1):
+        """
+        Copies the database to the file at path with the backup API, pages at
+        a time, replacing it only once the copy is complete
+        """
+        path = Path(path)
+        partial = path.with_suffix(".partial")
+        source = self._connect()
+        target = connect(str(partial))
+        try:
+            with self._lock:
+                source.backup(target, pages=pages)
+
+        finally:
+            target.close()
+            source.close()
+
+        replace(partial, path)
+        return path
+
+    def warm(self, path):
+        """
+        Replaces the contents of the database with the file at path, then
+        recreates the preloaded tables and indices it lacks
+        """
+        source = connect(str(path))
+        target = self._keeper or self._connect()
+        try:
+            with self._lock:
+                source.backup(target)
+
+        finally:
+            source.close()
+            if target is not self._keeper:
+                target.close()
+
+        self.create_many(self._tables)
+        self.create_indices(**self._indices)
+
+    def _retry(self, call, *args):
+        # Back off while another process holds the write lock
+        delay = BUSY_DELAY
+        for attempt in range(BUSY_RETRIES):
+            try:
+                return call(*args)
+
+            except OperationalError as e:
+                if not is_busy(e):
+                    raise
+
+                busy_retries.inc()
+                sleep(delay)
+                delay = delay * 2
+
+        return call(*args)
 
     def try_exec(self, cursor, args):
+        queries.inc()
         try:
-            cursor.execute(*args)
+            with query_time.time():
+                self._retry(cursor.execute, *args)
+
             return False
 
         except IntegrityError as e:
@@ -115,7 +252,9 @@ class Database:
             with closing(self._conn.cursor()) as cursor:
                 #cursor.execute(f"USE {self._database};")
                 with self._transaction():
-                    cursor.executemany(command, params)
+                    queries.inc()
+                    with query_time.time():
+                        self._retry(cursor.executemany, command, params)
 
     def get_one(self, result):
         if result is None:
@@ -162,57 +301,206 @@ class Database:
 
         self.write_many(statement, params)
 
+    @staticmethod
+    def where_clause(where):
+        """
+        Builds a WHERE clause and its arguments, lists, tuples and sets match
+        any of their values and None matches NULL
+        """
+        if len(where) == 0:
+            return "", tuple()
+
+        conditions = list()
+        args = list()
+        for key, value in where.items():
+            if value is None:
+                conditions.append(f"{key} IS NULL")
+
+            elif isinstance(value, (list, tuple, set, frozenset)):
+                value = list(value)
+                marks = ",".join("?" * len(value))
+                conditions.append(f"{key} IN ({marks})")
+                args.extend(value)
+
+            else:
+                conditions.append(f"{key} = ?")
+                args.append(value)
+
+        return " WHERE " + " AND ".join(conditions), tuple(args)
+
+    @staticmethod
+    def upsert_statement(table, fields, conflict, update=None):
+        if update is None:
+            update = [field for field in fields if field not in conflict]
+
+        # Updating a conflict column to itself still touches the row
+        if len(update) == 0:
+            update = list(conflict)
+
+        keys = ",".join(fields)
+        values = ",".join("?" * len(fields))
+        targets = ",".join(conflict)
+        changes = ",".join(f"{field} = excluded.{field}" for field in update)
+        return " ".join([
+            f"INSERT INTO {table} ({keys}) VALUES ({values})",
+            f"ON CONFLICT ({targets}) DO UPDATE SET {changes};"
+        ])
+
+    def upsert_many(self, table, fields, upserts, conflict, update=None):
+        """
+        Inserts rows or updates the ones whose conflict columns match, which
+        need a unique index, all in one transaction; returns the row ids
+        """
+        missing = [key for key in conflict if key not in fields]
+        if len(missing) > 0:
+            raise ValueError(f"Conflict columns {missing} are not upserted")
+
+        statement = self.upsert_statement(table, fields, conflict, update)
+        positions = [fields.index(key) for key in conflict]
+        params = list()
+        for upsert in upserts:
+            param = tuple(upsert.get(field) for field in fields)
+            # NULLs never conflict, such rows could not be found again
+            if any(param[i] is None for i in positions):
+                raise ValueError(f"Conflict columns {conflict} can't be NULL")
+
+            params.append(param)
+
+        clause = " AND ".join(f"{key} = ?" for key in conflict)
+        query = f"SELECT id FROM {table} WHERE {clause};"
+
+        ids = list()
+        with self.transaction() as cursor:
+            queries.inc()
+            with query_time.time():
+                self._retry(cursor.executemany, statement, params)
+
+            # Still inside the transaction, no other writer can get between
+            for param in params:
+                cursor.execute(query, tuple(param[i] for i in positions))
+                ids.append(cursor.fetchone()[0])
+
+        return ids
+
+    def upsert(self, table, conflict, update=None, **kwargs):
+        fields = list(kwargs.keys())
+        return self.upsert_many(table, fields, [kwargs], conflict, update)[0]
+
     def update(self, table, where=dict(), **kwargs):
+        if len(where) == 0:
+            raise ValueError("Refusing to update every row without a where")
+
         variables = ",".join(f"{k} = ?" for k in kwargs.keys())
-        clause = " AND ".join(f"{k} = ?" for k in where.keys())
-        statement = f"UPDATE {table} SET {variables} WHERE {clause};"
-        values = list(kwargs.values())
-        conditions = list(where.values())
-        args = tuple(values + conditions)
-        self.write(statement, *args)
+        clause, conditions = self.where_clause(where)
+        statement = f"UPDATE {table} SET {variables}{clause};"
+        args = tuple(kwargs.values()) + conditions
+        cursor = self.write(statement, *args)
+        return max(cursor.rowcount, 0)
 
     def select(self, table, keys=True, where=dict(), default=None):
         fields = "*" if keys is True else ",".join(keys)
-        clause = ""
-        args = tuple()
-        if len(where) > 0:
-            clause = " WHERE " + " AND ".join(f"{k} = ?" for k in where.keys())
-            args = tuple(where.values())
-
+        clause, args = self.where_clause(where)
         query = f"SELECT {fields} FROM {table}{clause};"
         #DEBUG
         #print(query)
-        return self.read(query, *args)
+        return self.read(query, *args, default=default)
+
+    def select_chunks(self, table, keys=True, where=dict(), size=1000):
+        """
+        Yields matching rows in chunks of up to size rows, paging by id so
+        no read stays open between chunks and writers can go on
+        """
+        fields = "*" if keys is True else ",".join(keys)
+        clause, args = self.where_clause(where)
+        select = f"SELECT id, {fields} FROM {table}"
+        first = f"{select}{clause} ORDER BY id LIMIT {int(size)};"
+        clause = f"{clause} AND" if len(clause) > 0 else " WHERE"
+        after = f"{select}{clause} id > ? ORDER BY id LIMIT {int(size)};"
+        rows = self.read(first, *args, default=list())
+        while len(rows) > 0:
+            last = rows[-1][0]
+            yield [row[1:] for row in rows]
+            if len(rows) < size:
+                return
+
+            rows = self.read(after, *args, last, default=list())
 
     def select_one(self, table, keys=True, where=dict(), default=None):
         result = self.select(table, keys=keys, where=where, default=default)
         return self.get_one(result)
 
+    def aggregate(self, table, expression, where=dict(), group=list()):
+        """
+        Evaluates an aggregate expression in SQL, per group when group lists
+        the columns to group by
+        """
+        clause, args = self.where_clause(where)
+        if len(group) == 0:
+            query = f"SELECT {expression} FROM {table}{clause};"
+            return self.get_one(self.read_one(query, *args))
+
+        columns = ",".join(group)
+        query = " ".join([
+            f"SELECT {columns}, {expression} FROM {table}{clause}",
+            f"GROUP BY {columns};"
+        ])
+        return self.read(query, *args, default=list())
+
+    def exists(self, table, where=dict()):
+        clause, args = self.where_clause(where)
+        query = f"SELECT EXISTS (SELECT 1 FROM {table}{clause});"
+        return bool(self.get_one(self.read_one(query, *args)))
+
     def delete(self, table, where=dict()):
-        clause = " AND ".join(f"{k} = ?" for k in where.keys())
-        args = tuple(where.values())
-        query = f"DELETE FROM {table} WHERE {clause};"
-        self.write(query, *args)
+        if len(where) == 0:
+            raise ValueError("Refusing to delete every row without a where")
+
+        clause, args = self.where_clause(where)
+        query = f"DELETE FROM {table}{clause};"
+        cursor = self.write(query, *args)
+        return max(cursor.rowcount, 0)
 
     def destroy(self, tables):
         for table in tables:
             self.write(f"DROP TABLE {table};")
 
-    def create(self, table, fields):
+    @staticmethod
+    def create_statement(table, fields):
         table_id = "id integer primary key"
         props = ", ".join([table_id] + fields)
+        return f"create table if not exists {table} ({props});"
+
+    def create(self, table, fields):
         #self._conn.execute("PRAGMA journal_mode=wal;")
-        self.write(f"create table if not exists {table} ({props});")
+        self.write(self.create_statement(table, fields))
 
     def create_many(self, tables):
         #self._conn.execute("PRAGMA journal_mode=wal;")
         for table, fields in tables.items():
             self.create(table, fields)
 
-    def create_index(self, table, field):
-        #self._conn.execute("PRAGMA journal_mode=wal;")
-        index = f"{table}_{field}"
-        self.write(f"create index if not exists {index} on {table}({field});")
+    @staticmethod
+    def index_statement(table, field, unique=False):
+        fields = [field] if isinstance(field, str) else list(field)
+        index = "_".join([table] + fields)
+        kind = "index"
+        if unique:
+            index = f"{index}_unique"
+            kind = "unique index"
+
+        columns = ",".join(fields)
+        return f"create {kind} if not exists {index} on {table}({columns});"
+
+    def create_index(self, table, field, unique=False):
+        # Unlike write, failures such as duplicates under a unique index
+        # raise, callers rely on the index existing afterwards
+        statement = self.index_statement(table, field, unique)
+        with self._connection():
+            with closing(self._conn.cursor()) as cursor:
+                with self._transaction():
+                    queries.inc()
+                    with query_time.time():
+                        self._retry(cursor.execute, statement)
 
     def create_indices(self, **indices):
         #self._conn.execute("PRAGMA journal_mode=wal;")
@@ -223,6 +511,248 @@ class Database:
             for field in fields:
                 self.create_index(table, field)
 
+    def fingerprints(self):
+        """
+        Returns the schema fingerprint recorded for every migrated table
+        """
+        try:
+            rows = self.read(f"SELECT name, fingerprint FROM {SCHEMA};")
+
+        except OperationalError:
+            # Nothing was migrated yet
+            return dict()
+
+        return dict(rows or list())
+
+    @staticmethod
+    def search_statements(table, fields):
+        """
+        Statements (re)building the FTS5 index of table over fields, kept in
+        sync by triggers, or dropping it when fields is empty
+        """
+        index = f"{table}_search"
+        statements = [f"drop table if exists {index};"]
+        for event in ("insert", "delete", "update"):
+            statements.append(f"drop trigger if exists {index}_{event};")
+
+        if len(fields) == 0:
+            return statements
+
+        columns = ",".join(fields)
+        new = ",".join(f"new.{field}" for field in fields)
+        old = ",".join(f"old.{field}" for field in fields)
+        insert = f"INSERT INTO {index} (rowid,{columns}) VALUES (new.id,{new});"
+        delete = " ".join([
+            f"INSERT INTO {index} ({index},rowid,{columns})",
+            f"VALUES ('delete',old.id,{old});"
+        ])
+        statements.extend([
+            " ".join([
+                f"create virtual table {index} using fts5({columns},",
+                f"content='{table}', content_rowid='id');"
+            ]),
+            f"create trigger {index}_insert after insert on {table} "
+            f"begin {insert} end;",
+            f"create trigger {index}_delete after delete on {table} "
+            f"begin {delete} end;",
+            f"create trigger {index}_update after update of {columns} "
+            f"on {table} begin {delete} {insert} end;",
+            f"INSERT INTO {index} ({index}) VALUES ('rebuild');"
+        ])
+        return statements
+
+    def search(self, table, query, keys=True, limit=None):
+        """
+        Selects the rows whose search index matches an FTS5 query, best
+        ranked first
+        """
+        index = f"{table}_search"
+        keys = ["*"] if keys is True else keys
+        fields = ",".join(f"{table}.{key}" for key in keys)
+        statement = " ".join([
+            f"SELECT {fields} FROM {index}",
+            f"JOIN {table} ON {table}.id = {index}.rowid",
+            f"WHERE {index} MATCH ? ORDER BY {index}.rank"
+        ])
+        args = (query,)
+        if limit is not None:
+            statement = f"{statement} LIMIT ?"
+            args = args + (limit,)
+
+        return self.read(f"{statement};", *args, default=list())
+
+    def migrate(
+        self,
+        table,
+        fields,
+        references,
+        indexes,
+        fingerprint,
+        search=list()
+    ):
+        """
+        Brings table up to fields and indexes in one transaction and records
+        fingerprint, returns False when it was already recorded
+
+        Missing tables are created. Existing ones only gain the columns and
+        indexes they lack, columns are never dropped or changed. references
+        maps columns to their REFERENCES clause, indexes lists (columns,
+        unique) pairs and search the columns of its full-text index.
+        """
+        with self.transaction(immediate=True) as cursor:
+            cursor.execute(" ".join([
+                f"create table if not exists {SCHEMA}",
+                "(name text primary key, fingerprint integer not null);"
+            ]))
+
+            # Another process may have migrated while we waited for the lock
+            query = f"SELECT fingerprint FROM {SCHEMA} WHERE name = ?;"
+            cursor.execute(query, (table,))
+            row = cursor.fetchone()
+            if row is not None and row[0] == fingerprint:
+                return False
+
+            cursor.execute(f"PRAGMA table_info({table});")
+            existing = set(column[1] for column in cursor.fetchall())
+            if len(existing) == 0:
+                constraints = list()
+                for key, clause in references.items():
+                    constraints.append(f"foreign key({key}) {clause}")
+
+                statement = self.create_statement(table, fields + constraints)
+                cursor.execute(statement)
+                existing = set(field.split()[0] for field in fields)
+
+            for field in fields:
+                key = field.split()[0]
+                if key in existing:
+                    continue
+
+                lowered = field.lower()
+                if "not null" in lowered and "default" not in lowered:
+                    raise ValueError(
+                        f"Cannot add required column {key} to {table} "
+                        "without a default"
+                    )
+
+                if key in references:
+                    field = f"{field} {references[key]}"
+
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {field};")
+
+            for columns, unique in indexes:
+                cursor.execute(self.index_statement(table, columns, unique))
+
+            for statement in self.search_statements(table, search):
+                cursor.execute(statement)
+
+            cursor.execute(" ".join([
+                f"INSERT INTO {SCHEMA} (name, fingerprint) VALUES (?, ?)",
+                "ON CONFLICT (name) DO UPDATE SET",
+                "fingerprint = excluded.fingerprint;"
+            ]), (table, fingerprint))
+
+        return True
+
+    @staticmethod
+    def capture_statements(table, columns):
+        """
+        Statements of the triggers recording every change to table in the
+        changes table, updates with the columns whose value changed
+        """
+        record = " ".join([
+            f"INSERT INTO {CHANGES} (name, op, row, columns)",
+            f"VALUES ('{table}', '{{}}', {{}}.id, {{}});"
+        ])
+        changed = " || ".join(
+            f"(CASE WHEN old.{column} IS NOT new.{column} "
+            f"THEN ',{column}' ELSE '' END)"
+            for column in columns
+        )
+
+        statements = list()
+        for op, row, values in (
+            ("insert", "new", "NULL"),
+            ("update", "new", changed or "''"),
+            ("delete", "old", "NULL")
+        ):
+            statements.append(" ".join([
+                f"CREATE TRIGGER {table}_capture_{op} after {op} on {table}",
+                f"begin {record.format(op, row, values)} end"
+            ]))
+
+        return statements
+
+    def capture(self, table):
+        """
+        Installs (or refreshes) the triggers capturing changes to table
+        """
+        with self.transaction(immediate=True) as cursor:
+            cursor.execute(" ".join([
+                f"create table if not exists {CHANGES}",
+                "(seq integer primary key, name text not null,",
+                "op text not null, row integer not null, columns text);"
+            ]))
+
+            cursor.execute(f"PRAGMA table_info({table});")
+            columns = [column[1] for column in cursor.fetchall()]
+            columns = [column for column in columns if column != "id"]
+
+            query = "SELECT sql FROM sqlite_master WHERE type = 'trigger';"
+            cursor.execute(query)
+            existing = set(row[0] for row in cursor.fetchall())
+            for statement in self.capture_statements(table, columns):
+                if statement in existing:
+                    continue
+
+                # Triggers are recreated when the table gained columns
+                name = statement.split()[2]
+                cursor.execute(f"drop trigger if exists {name};")
+                cursor.execute(statement)
+
+    def listen(self, listener, tables=None):
+        """
+        Calls listener with the changes captured by each transaction this
+        process commits, as (table, op, id, columns) rows of tables when
+        given, on the committing thread; returns a function that stops it
+        """
+        entry = (None if tables is None else set(tables), listener)
+        self._listeners.append(entry)
+
+        def stop():
+            if entry in self._listeners:
+                self._listeners.remove(entry)
+
+        return stop
+
+    def _notify(self, changes):
+        for tables, listener in list(self._listeners):
+            if tables is not None:
+                rows = [row for row in changes if row[0] in tables]
+
+            else:
+                rows = changes
+
+            if len(rows) > 0:
+                listener(rows)
+
+    def _drain(self):
+        # Inside the transaction, so changes are taken exactly once
+        try:
+            columns = "seq, name, op, row, columns"
+            query = f"SELECT {columns} FROM {CHANGES} ORDER BY seq;"
+            rows = self._conn.execute(query).fetchall()
+
+        except OperationalError:
+            return list()
+
+        if len(rows) == 0:
+            return rows
+
+        statement = f"DELETE FROM {CHANGES} WHERE seq <= ?;"
+        self._conn.execute(statement, (rows[-1][0],))
+        return [row[1:] for row in rows]
+
     @staticmethod
     def field(name, kind, size=None, nullable=False, default=UNDEFINED):
         result = [name, kind if size is None else f"{kind}({size})"]
@@ -1,13 +1,24 @@
 from spirit.storage.database import Database
+from spirit.storage.bulk import Column, column_kind
+from spirit.storage.buffer import WriteBehind, INSERT, UPDATE, DELETE
 from spirit.utils import Model, UNDEFINED, eprint
+from spirit.utils.metrics import metrics
 
-from collections import namedtuple
+from collections import namedtuple, deque
 from typing import Union, Optional, List, Any
 from uuid import uuid4
+from threading import Lock, Thread, Event as Signal, get_ident
+from concurrent.futures import Future
+from zlib import crc32
 
 NoneType = None.__class__
 make_uuid = lambda: uuid4().bytes
 
+hydrated = metrics.counter("memory.rows_hydrated")
+template_hits = metrics.counter("memory.template_cache_hits")
+template_misses = metrics.counter("memory.template_cache_misses")
+lazy_loads = metrics.counter("memory.lazy_loads")
+
 class Metadata(Model):
     placeholder: Optional[bool] = None
     size: Optional[int] = None
@@ -16,6 +27,7 @@ class Metadata(Model):
     primary: Optional[bool] = None
     increment: Optional[bool] = None
     index: Optional[bool] = None
+    search: Optional[bool] = None
     default: Optional[Any] = UNDEFINED
 
 class Reference(Model):
@@ -24,6 +36,18 @@ class Reference(Model):
     placeholder: Optional[str] = None
     cascade: Optional[str] = None
 
+class Change(Model):
+    table: str
+    op: str
+    id: int
+    columns: Optional[tuple] = None
+
+def change_kind(table):
+    """
+    Store event kind Change events of table are logged under
+    """
+    return f"{table}.changes"
+
 class BaseModel(Model):
     uuid: bytes = Metadata(size=16, default=make_uuid)
 
@@ -46,36 +70,15 @@ class BaseModel(Model):
             return None
 
         factory = self._factory
-
-        kwargs = dict()
-        dependencies = factory._template["dependencies"]
-        dependency_fields = list(dependencies.keys())
-        for key, value in changes.items():
-            # Remove depedency fields
-            if key in dependency_fields:
-                continue
-
-            kwargs[key] = value
-
-        # Save changes
-        where = dict()
-        where["id"] = entry_id
-        factory._db.update(factory._table, where=where, **kwargs)
+        kwargs = factory._changes(changes)
+        factory.alter_many(entry_id, **kwargs)
 
         # Create updated model object
-        fields = self._asdict()
-        placeholders = factory._template["placeholders"]
-        for key, value in kwargs.items():
-            placeholder = placeholders.get(key)
-            if placeholder is not None:
-                model = dependencies.get(placeholder)
-                if model is not None:
-                    placeholder_factory = factory._mem.meditate(model)
-                    placeholder_entry = placeholder_factory.recall(value)
-                    fields[placeholder] = placeholder_entry
-
-            fields[key] = value
+        changed = dict(kwargs)
+        factory._placeholders([changed])
 
+        fields = self._asdict()
+        fields.update(changed)
         entry = factory._model(**fields)
         entry.assign(factory, entry_id)
         return entry
@@ -85,35 +88,153 @@ class BaseModel(Model):
         if entry_id is None:
             return False
 
-        where = dict()
-        where["id"] = entry_id
-
         factory = self._factory
-        factory._db.delete(factory._table, where=where)
-        return True
+        removed = factory.forget_many(entry_id)
+
+        # Buffered forgets are only known to succeed once flushed
+        return factory._deferred or removed > 0
+
+class Pending:
+    """
+    Ids of one model referenced by a result set, recalled together the
+    first time any of their proxies is used
+    """
+    def __init__(self, factory):
+        self.factory = factory
+        self._ids = set()
+        self._loaded = dict()
+        self._lock = Lock()
+
+    def proxy(self, entry_id):
+        self._ids.add(entry_id)
+        return Lazy(self, entry_id)
+
+    def get(self, entry_id):
+        with self._lock:
+            if entry_id not in self._loaded and len(self._ids) > 0:
+                ids = self._ids
+                self._ids = set()
+                self._loaded.update(self.factory.recall_many(ids))
+                lazy_loads.inc()
+
+            return self._loaded.get(entry_id)
+
+class Lazy:
+    """
+    Stands in for a placeholder model until one of its fields is read
+    """
+    __slots__ = ("_pending", "_entry_id")
+
+    def __init__(self, pending, entry_id):
+        self._pending = pending
+        self._entry_id = entry_id
+
+    def _resolve(self):
+        return self._pending.get(self._entry_id)
+
+    def _entry(self):
+        # A deleted entry resolves to None, reading from it is an error
+        entry = self._resolve()
+        if entry is None:
+            model = self._pending.factory._model.__name__
+            raise LookupError(f"{model} {self._entry_id} no longer exists")
+
+        return entry
+
+    @property
+    def __class__(self):
+        # isinstance checks pass without loading the entry
+        return self._pending.factory._model
+
+    @property
+    def _id(self):
+        return self._entry_id
+
+    def __getattr__(self, name):
+        if name in Lazy.__slots__:
+            raise AttributeError(name)
+
+        return getattr(self._entry(), name)
+
+    def __getitem__(self, index):
+        return self._entry()[index]
+
+    def __iter__(self):
+        return iter(self._entry())
+
+    def __len__(self):
+        return len(self._entry())
+
+    def __bool__(self):
+        return self._resolve() is not None
+
+    def __eq__(self, other):
+        return self._resolve() == resolved(other)
+
+    def __hash__(self):
+        return hash(self._resolve())
+
+    def __repr__(self):
+        return repr(self._resolve())
+
+    def __reduce__(self):
+        entry = self._resolve()
+        if entry is None:
+            return resolved, (None,)
+
+        return entry.__reduce__()
+
+def resolved(value):
+    """
+    Returns the entry behind a lazy placeholder, other values as they are
+    """
+    if type(value) is Lazy:
+        return value._resolve()
+
+    return value
 
 class MemoryFactory:
-    def __init__(self, mem, model, table, template):
+    def __init__(
+        self,
+        mem,
+        model,
+        table,
+        template,
+        lazy=False,
+        buffer=None,
+        deferred=False
+    ):
         self._mem = mem
         self._db = self._mem._db
         self._model = model
         self._table = table
         self._template = template
+        self._lazy = lazy
+        self._buffer = buffer
+        self._deferred = deferred
 
-    # TODO: Implement features functions
-    def remember(self, **entry):
-        # Apply default values from callables
-        for key, value in self._template["defaults"].items():
-            if entry.get(key) is not None:
-                continue
+    def _settle(self):
+        # Queued writes go first so direct reads and writes see them in order
+        if self._buffer is not None:
+            self._buffer.flush()
 
-            entry[key] = value()
+    def flush(self):
+        """
+        Commits the writes queued for the table, if any
+        """
+        self._settle()
 
-        for field, placeholder in self._template["placeholders"].items():
-            value = entry.pop(placeholder, None)
-            if value is not None:
-                entry[field] = value._id
+    # TODO: Implement features functions
+    def remember(self, **entry):
+        """
+        Inserts entry and returns its id, or a future for it when writes are
+        deferred
+        """
+        entry = self._prepare(entry)
+        if self._deferred:
+            return self._buffer.enqueue(INSERT, values=entry)
 
+        self._settle()
         entry_id = self._db.insert(self._table, **entry)
         return entry_id
 
@@ -138,65 +259,406 @@ class MemoryFactory:
 
         return entry_ids
 
-    def recall(self, entry_id):
+    def _columns(self):
+        # Placeholder fields hold models and are not stored in the table
+        placeholder_fields = list(self._template["placeholders"].values())
         keys = list()
-        model_keys = self._model._fields
+        for key in self._model._fields:
+            if key not in placeholder_fields:
+                keys.append(key)
+
+        return keys
+
+    def _prepare(self, entry):
+        # Apply default values from callables
+        for key, value in self._template["defaults"].items():
+            if entry.get(key) is None:
+                entry[key] = value()
+
+        for field, placeholder in self._template["placeholders"].items():
+            value = entry.pop(placeholder, None)
+            if value is not None:
+                entry[field] = value._id
+
+        return entry
+
+    def ingest(self, entries, fields=None, chunk=1000):
+        """
+        Inserts entries from any iterable, chunk rows per transaction, without
+        holding more than one chunk in memory or creating models
+
+        Columns come from fields or the first entry, returns the row count
+        """
+        self._settle()
+        count = 0
+        params = list()
+        statement = None
+        for entry in entries:
+            entry = self._prepare(dict(entry))
+            if statement is None:
+                if fields is None:
+                    fields = list(entry.keys())
+
+                self._check(*fields)
+                keys = ",".join(fields)
+                values = ",".join("?" * len(fields))
+                table = self._table
+                statement = f"INSERT INTO {table} ({keys}) VALUES ({values});"
+
+            params.append(tuple([entry.get(field) for field in fields]))
+            if len(params) >= chunk:
+                self._db.write_many(statement, params)
+                count = count + len(params)
+                params = list()
+
+        if len(params) > 0:
+            self._db.write_many(statement, params)
+            count = count + len(params)
+
+        return count
+
+    def _unique(self, columns):
+        # ON CONFLICT needs a unique index covering the conflict columns
+        uniques = self._template.setdefault("unique", set())
+        if columns not in uniques:
+            self._db.create_index(self._table, list(columns), unique=True)
+            uniques.add(columns)
+
+    def merge(self, entries, conflict=("uuid",), update=None, chunk=None):
+        """
+        Inserts entries or updates the rows their conflict columns already
+        match, returns the ids in order
+
+        Everything runs in one transaction unless chunk limits its size. Only
+        the update columns are overwritten, by default the ones entries give
+        so generated defaults such as uuid never replace existing values.
+        """
+        self._settle()
+        conflict = tuple(conflict)
+        self._check(*conflict)
+        if update is not None:
+            self._check(*update)
+
+        self._unique(conflict)
 
         placeholders = self._template["placeholders"]
-        placeholder_fields = list(placeholders.values())
-        for key in model_keys:
-            if key in placeholder_fields:
-                continue
+        ids = list()
+        batch = list()
+        fields = None
+        for entry in entries:
+            given = entry.keys()
+            entry = self._prepare(dict(entry))
+            if fields is None:
+                fields = list(entry.keys())
+                self._check(*fields)
 
-            keys.append(key)
+            if update is None:
+                update = list()
+                for field in fields:
+                    if field in conflict:
+                        continue
 
-        where = dict()
-        where["id"] = entry_id
-        values = self._db.select_one(self._table, keys=keys, where=where)
-        if values is None:
-            return None
+                    if field in given or placeholders.get(field) in given:
+                        update.append(field)
 
-        fields = dict()
-        for i, key in enumerate(keys):
-            value = values[i]
-            fields[key] = value
+            batch.append(entry)
+            if chunk is not None and len(batch) >= chunk:
+                args = (self._table, fields, batch, conflict, update)
+                ids.extend(self._db.upsert_many(*args))
+                batch = list()
 
-        for field, placeholder in placeholders.items():
-            placeholder_id = fields.get(field)
-            if placeholder_id is None:
-                continue
+        if len(batch) > 0:
+            args = (self._table, fields, batch, conflict, update)
+            ids.extend(self._db.upsert_many(*args))
+
+        return ids
+
+    def _column_kinds(self, keys):
+        if keys is None:
+            keys = ["id"] + self._columns()
+
+        kinds = list()
+        for key in keys:
+            annotation = int if key == "id" else self._model._field_types[key]
+            kinds.append(column_kind(annotation))
+
+        return keys, kinds
+
+    def iter_columns(self, keys=None, where=dict(), chunk=10000):
+        """
+        Yields a dict of Column per chunk of rows, without creating models
+        """
+        self._settle()
+        keys, kinds = self._column_kinds(keys)
+        for rows in self._db.select_chunks(self._table, keys, where, chunk):
+            columns = dict()
+            for key, kind, values in zip(keys, kinds, zip(*rows)):
+                column = columns[key] = Column(key, kind)
+                column.extend(values)
+
+            yield columns
+
+    def export_columns(self, keys=None, where=dict(), chunk=10000):
+        """
+        Returns every matching row as one Column per key
+        """
+        self._settle()
+        keys, kinds = self._column_kinds(keys)
+        columns = dict()
+        for key, kind in zip(keys, kinds):
+            columns[key] = Column(key, kind)
+
+        for rows in self._db.select_chunks(self._table, keys, where, chunk):
+            for key, values in zip(keys, zip(*rows)):
+                columns[key].extend(values)
+
+        return columns
+
+    def _check(self, *keys):
+        # Field names end up in SQL, only accept the ones the table has
+        columns = ["id"] + self._columns()
+        for key in keys:
+            if key not in columns:
+                raise ValueError(f"{self._table} has no column {key}")
+
+    def _aggregate(self, function, field, where, group=list(), distinct=False):
+        self._check(*where.keys(), *group)
+        if field != "*":
+            self._check(field)
+
+        if distinct:
+            field = f"DISTINCT {field}"
+
+        self._settle()
+        expression = f"{function}({field})"
+        return self._db.aggregate(self._table, expression, where, group)
+
+    def count(self, where=dict(), field="*", distinct=False):
+        """
+        Counts matching rows, or the non-NULL (distinct) values of field
+        """
+        return self._aggregate("COUNT", field, where, distinct=distinct)
 
-            model = self._template["dependencies"].get(placeholder)
+    def exists(self, where=dict()):
+        self._check(*where.keys())
+        self._settle()
+        return self._db.exists(self._table, where)
+
+    def sum(self, field, where=dict()):
+        return self._aggregate("SUM", field, where)
+
+    def min(self, field, where=dict()):
+        return self._aggregate("MIN", field, where)
+
+    def max(self, field, where=dict()):
+        return self._aggregate("MAX", field, where)
+
+    def avg(self, field, where=dict()):
+        return self._aggregate("AVG", field, where)
+
+    def group_by(self, keys, function="count", field="*", where=dict()):
+        """
+        Aggregates per distinct value of keys, returns a dict from the key
+        value (a tuple when keys is a list) to the aggregate
+        """
+        group = [keys] if isinstance(keys, str) else list(keys)
+        function = function.upper()
+        if function not in ("COUNT", "SUM", "MIN", "MAX", "AVG", "TOTAL"):
+            raise ValueError(f"Unknown aggregate {function}")
+
+        rows = self._aggregate(function, field, where, group)
+        result = dict()
+        for row in rows:
+            key = row[0] if isinstance(keys, str) else tuple(row[:-1])
+            result[key] = row[-1]
+
+        return result
+
+    def _placeholders(self, entries):
+        # Models behind placeholders are recalled once per model, not per entry
+        dependencies = self._template["dependencies"]
+        pending = dict()
+        for field, placeholder in self._template["placeholders"].items():
+            model = dependencies.get(placeholder)
             if model is None:
                 continue
 
-            factory = self._mem.meditate(model)
-            placeholder_entry = factory.recall(placeholder_id)
-            fields[placeholder] = placeholder_entry
+            ids = set(entry.get(field) for entry in entries)
+            ids.discard(None)
+            if len(ids) == 0:
+                continue
+
+            if self._lazy:
+                # Fields sharing a model share one deferred query
+                if model not in pending:
+                    factory = self._mem.meditate(model, lazy=True)
+                    pending[model] = Pending(factory)
 
-        entry = self._model(**fields)
-        entry.assign(self, entry_id)
-        return entry
+                proxy = pending[model].proxy
+                for entry in entries:
+                    placeholder_id = entry.get(field)
+                    if placeholder_id is not None:
+                        entry[placeholder] = proxy(placeholder_id)
+
+                continue
+
+            recalled = self._mem.meditate(model).recall_many(ids)
+            for entry in entries:
+                placeholder_id = entry.get(field)
+                if placeholder_id is not None:
+                    entry[placeholder] = recalled.get(placeholder_id)
+
+    def _hydrate(self, keys, rows):
+        entries = [dict(zip(keys, row)) for row in rows]
+        if self._buffer is not None:
+            entries = self._buffer.overlay(entries)
+
+        self._placeholders(entries)
+
+        result = dict()
+        for fields in entries:
+            entry_id = fields.pop("id")
+            entry = self._model(**fields)
+            entry.assign(self, entry_id)
+            result[entry_id] = entry
+
+        hydrated.inc(len(result))
+        return result
+
+    def recall(self, entry_id):
+        """
+        Recalls an entry by id, or by the future remember returned for it,
+        in which case entries still queued come back without an id
+        """
+        if isinstance(entry_id, Future):
+            fields = self._buffer.pending(entry_id)
+            if fields is not None:
+                self._placeholders([fields])
+                return self._model(**fields)
+
+            entry_id = entry_id.result()
+
+        return self.recall_many([entry_id]).get(entry_id)
+
+    def recall_many(self, entry_ids, chunk=900):
+        """
+        Implements recall for many ids with one query per chunk of ids, plus
+        one per placeholder model, returns a dict from id to entry
+        """
+        keys = ["id"] + self._columns()
+        entry_ids = list(entry_ids)
+        rows = list()
+        for start in range(0, len(entry_ids), chunk):
+            where = dict()
+            where["id"] = entry_ids[start:start + chunk]
+            kwargs = dict()
+            kwargs["keys"] = keys
+            kwargs["where"] = where
+            kwargs["default"] = list()
+            rows.extend(self._db.select(self._table, **kwargs))
+
+        return self._hydrate(keys, rows)
+
+    def refresh(self, entries):
+        """
+        Recalls the current state of entries in bulk, dropping forgotten ones
+        """
+        recalled = self.recall_many(entry._id for entry in entries)
+        return [recalled[e._id] for e in entries if e._id in recalled]
+
+    def search(self, query, limit=20):
+        """
+        Returns the entries whose search fields match an FTS5 query, best
+        ranked first
+        """
+        if len(self._template["search"]) == 0:
+            name = self._model.__name__
+            raise ValueError(f"{name} has no fields with Metadata(search=True)")
+
+        self._settle()
+        keys = ["id"] + self._columns()
+        rows = self._db.search(self._table, query, keys=keys, limit=limit)
+        return list(self._hydrate(keys, rows).values())
 
     def recite(self):
         """
         Implements recall but for all entities
         """
-
-        entities = dict()
-        entity_ids = self._db.select(self._table, keys=["id"])
-        if entity_ids is None:
+        self._settle()
+        keys = ["id"] + self._columns()
+        rows = self._db.select(self._table, keys=keys)
+        if rows is None:
             return list()
 
-        for (entity_id,) in entity_ids:
-            entities[entity_id] = self.recall(entity_id)
+        return self._hydrate(keys, rows)
 
-        return entities
+    def _target(self, target):
+        # An id, a collection of ids or a filter
+        if isinstance(target, dict):
+            self._check(*target.keys())
+            return target
 
-    def forget(self, entry_id):
         where = dict()
-        where["id"] = entry_id
-        self._db.delete(self._table, where=where)
+        where["id"] = target if isinstance(target, int) else list(target)
+        return where
+
+    def _changes(self, changes):
+        placeholders = self._template["placeholders"]
+        fields = {placeholder: f for f, placeholder in placeholders.items()}
+        dependencies = self._template["dependencies"]
+
+        kwargs = dict()
+        for key, value in changes.items():
+            # Dependency fields are stored through their reference field
+            if key in dependencies:
+                field = fields.get(key)
+                if field is not None and field not in changes:
+                    kwargs[field] = None if value is None else value._id
+
+                continue
+
+            kwargs[key] = value
+
+        self._check(*kwargs.keys())
+        return kwargs
+
+    def alter_many(self, target, **changes):
+        """
+        Applies changes to every entry matching target (an id, ids or a
+        filter) with one UPDATE, returns the number of rows changed
+        """
+        changes = self._changes(changes)
+        if len(changes) == 0:
+            return 0
+
+        where = self._target(target)
+        if self._deferred:
+            if len(where) == 0:
+                raise ValueError("Refusing to update every row without a where")
+
+            return self._buffer.enqueue(UPDATE, where, changes)
+
+        self._settle()
+        return self._db.update(self._table, where=where, **changes)
+
+    def forget_many(self, target):
+        """
+        Deletes every entry matching target with one DELETE, references with
+        a cascade follow through their foreign keys, returns the number of
+        entries deleted (not counting cascades)
+        """
+        where = self._target(target)
+        if self._deferred:
+            if len(where) == 0:
+                raise ValueError("Refusing to delete every row without a where")
+
+            return self._buffer.enqueue(DELETE, where)
+
+        self._settle()
+        return self._db.delete(self._table, where=where)
+
+    def forget(self, entry_id):
+        self.forget_many(entry_id)
         return True
 
 class Memory:
@@ -204,13 +666,127 @@ class Memory:
         self._db = Database(path, preload)
         self._tables = dict()
         self._templates = dict()
+        self._fingerprints = None
+        self._buffers = dict()
+        self._captures = list()
+
+    def flush(self):
+        """
+        Commits the writes queued by every write-behind factory, then delivers
+        their changes to the stores this thread captures into
+        """
+        for buffer in list(self._buffers.values()):
+            buffer.flush()
+
+        self.deliver()
+
+    def deliver(self):
+        """
+        Logs the changes committed on other threads into the stores captured
+        from this one, returns how many were logged
+        """
+        delivered = 0
+        for owner, deliver in list(self._captures):
+            if owner == get_ident():
+                delivered = delivered + deliver()
+
+        return delivered
+
+    def capture(self, store, *models):
+        """
+        Logs a Change into store for every row of models' tables inserted,
+        updated or deleted, cascades included, with one log_many per batch;
+        returns a function that stops capturing
+
+        Stores are not thread-safe, so only the thread calling capture logs
+        into store. Changes other threads commit, write-behind flushes
+        included, wait for its next commit, flush or deliver.
+        """
+        tables = list()
+        for model in models:
+            table, _ = self._process_model(model)
+            self._db.capture(table)
+            tables.append(table)
+
+        owner = get_ident()
+        inbox = deque()
+
+        def deliver():
+            # Only the owner takes from the inbox, other threads append
+            events = [inbox.popleft() for _ in range(len(inbox))]
+            if len(events) > 0:
+                store.log_many(events)
+
+            return len(events)
+
+        def publish(rows):
+            for table, op, entry_id, columns in rows:
+                if columns is not None:
+                    # Updates that changed nothing are not worth an event
+                    columns = tuple(columns.split(",")[1:])
+                    if len(columns) == 0:
+                        continue
+
+                kwargs = dict()
+                kwargs["table"] = table
+                kwargs["op"] = op
+                kwargs["id"] = entry_id
+                kwargs["columns"] = columns
+                inbox.append((change_kind(table), Change(**kwargs)))
+
+            if get_ident() == owner:
+                deliver()
+
+        entry = (owner, deliver)
+        self._captures.append(entry)
+        silence = self._db.listen(publish, tables)
+
+        def stop():
+            silence()
+            if entry in self._captures:
+                self._captures.remove(entry)
+
+        return stop
+
+    def snapshot(self, path):
+        """
+        Writes a consistent copy of the database to path, in-memory or not
+        """
+        return self._db.snapshot(path)
+
+    def snapshot_every(self, seconds, path):
+        """
+        Snapshots to path every few seconds from a daemon thread, returns a
+        function that stops it
+        """
+        def run(stop):
+            while not stop.wait(seconds):
+                self.snapshot(path)
+
+        stop = Signal()
+        thread = Thread(target=run, args=(stop,), daemon=True)
+        thread.start()
+        return stop.set
+
+    def warm(self, path):
+        """
+        Loads the database from a snapshot, models are checked against its
+        schema again when next meditated on
+        """
+        self._db.warm(path)
+        self._tables = dict()
+        self._fingerprints = None
+        return self
 
     def _process_model(self, model):
         table = model.__name__.lower()
         template = self._templates.get(table, dict())
         if self._tables.get(table):
+            template_hits.inc()
             return table, template
 
+        template_misses.inc()
+
         defaults = template["defaults"] = dict()
         placeholders = template["placeholders"] = dict()
         dependencies = template["dependencies"] = dict()
@@ -222,7 +798,9 @@ class Memory:
         reassign[str] = "text"
         reassign[bytes] = "blob"
 
-        references = list()
+        references = dict()
+        indexes = list()
+        search = template["search"] = list()
 
         fields = list()
         field_types = model._field_types
@@ -231,7 +809,7 @@ class Memory:
             nullable = False
 
             field_type = field_types.get(field_name)
-            if field_type.__class__ is Union.__class__:
+            if getattr(field_type, "__origin__", None) is Union:
                 # Extract types from union / optional types
                 union_types = field_type.__args__
                 field_type = union_types[0]
@@ -248,16 +826,13 @@ class Memory:
             if field_default_type is Reference:
                 ref_table = field_default.table.__name__
                 ref_field = field_default.field
-                reference = [
-                    f"foreign key({field_name})",
-                    f"references {ref_table}({ref_field})"
-                ]
+                reference = [f"references {ref_table}({ref_field})"]
 
                 cascade = field_default.cascade
                 if cascade is not None:
                     reference.append(f"on {cascade} cascade")
 
-                references.append(" ".join(reference))
+                references[field_name] = " ".join(reference)
 
                 placeholder = field_default.placeholder
                 if placeholder is not None:
@@ -271,8 +846,9 @@ class Memory:
                 dependencies[field_name] = field_type
                 continue
 
+            # Real indexes, which unlike column constraints can be migrated
             if field_default.unique is True:
-                attributes.append("unique")
+                indexes.append((field_name, True))
 
             if field_default.primary is True:
                 attributes.append("primary key")
@@ -281,7 +857,10 @@ class Memory:
                 attributes.append("autoincroment")
 
             if field_default.index is True:
-                attributes.append("autoindex")
+                indexes.append((field_name, False))
+
+            if field_default.search is True:
+                search.append(field_name)
 
             if not nullable:
                 attributes.append("not null")
@@ -299,12 +878,47 @@ class Memory:
 
             fields.append(" ".join(attributes))
 
-        fields = fields + references
-        self._db.create(table, fields)
+        # DDL only runs when the model changed since it was last recorded
+        schema = fields + list(references.items()) + indexes
+        if len(search) > 0:
+            schema.append(("search", search))
+
+        fingerprint = crc32(repr(schema).encode("utf-8"))
+        if self._fingerprints is None:
+            self._fingerprints = self._db.fingerprints()
+
+        if self._fingerprints.get(table) != fingerprint:
+            args = table, fields, references, indexes, fingerprint, search
+            self._db.migrate(*args)
+            self._fingerprints[table] = fingerprint
+
+        template["unique"] = set((f,) for f, unique in indexes if unique)
         self._tables[table] = True
         self._templates[table] = template
         return table, template
 
-    def meditate(self, model):
+    def meditate(self, model, lazy=False, write_behind=None):
+        """
+        Returns the factory for model, with lazy placeholders recalled on
+        first use instead of along with their entries
+
+        With write_behind (True or WriteBehind options such as size and
+        interval) remember, alter and forget queue their writes and return
+        futures. The queue is shared by every factory of the table, which
+        read through it.
+        """
         table, template = self._process_model(model)
-        return MemoryFactory(self, model, table, template)
+        buffer = self._buffers.get(table)
+        if write_behind and buffer is None:
+            options = write_behind if isinstance(write_behind, dict) else dict()
+            buffer = self._buffers[table] = WriteBehind(
+                self._db,
+                table,
+                **options
+            )
+
+        kwargs = dict()
+        kwargs["lazy"] = lazy
+        kwargs["buffer"] = buffer
+        kwargs["deferred"] = bool(write_behind)
+        return MemoryFactory(self, model, table, template, **kwargs)
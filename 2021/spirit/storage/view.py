@@ -0,0 +1,223 @@
+from spirit.storage.memory import Change, change_kind
+
+from threading import Lock
+from abc import ABC, abstractmethod
+
+INSERT = "insert"
+DELETE = "delete"
+
+class View(ABC):
+    """
+    State derived from a table, kept up to date from its Change events
+
+    The table is scanned once when the view is built. After that, each batch
+    of changes only reads back the rows it touched, with one query per chunk
+    of ids. Subclasses define what one row adds to the view and what
+    removing it takes away.
+    """
+    def __init__(self, factory, store, fields, chunk=900):
+        factory._check(*fields)
+        self._factory = factory
+        self._db = factory._db
+        self._table = factory._table
+        self._fields = list(fields)
+        self._chunk = chunk
+        self._rows = dict()
+        self._lock = Lock()
+
+        # Subscribing first, rows changed during the scan are applied twice
+        # at worst, which leaves the same result
+        self._kind = change_kind(self._table)
+        self.close = store.subscribe([self._kind], self._apply, batch=True)
+
+        keys = ["id"] + self._fields
+        for rows in self._db.select_chunks(self._table, keys):
+            with self._lock:
+                for row in rows:
+                    self._set(row[0], tuple(row[1:]))
+
+    @abstractmethod
+    def _insert(self, entry_id, values):
+        """
+        Adds a row's values to the view
+        """
+
+    @abstractmethod
+    def _delete(self, entry_id, values):
+        """
+        Takes the values a row was added with back out of the view
+        """
+
+    def _set(self, entry_id, values):
+        self._remove(entry_id)
+        self._rows[entry_id] = values
+        self._insert(entry_id, values)
+
+    def _remove(self, entry_id):
+        values = self._rows.pop(entry_id, None)
+        if values is not None:
+            self._delete(entry_id, values)
+
+    def _apply(self, events):
+        # Later changes to a row win over earlier ones in the same batch
+        touched = dict()
+        for event in events:
+            change = event.data
+            if event.kind != self._kind or not isinstance(change, Change):
+                continue
+
+            if change.op == DELETE:
+                touched[change.id] = False
+
+            elif change.op == INSERT:
+                touched[change.id] = True
+
+            elif any(column in self._fields for column in change.columns):
+                touched[change.id] = True
+
+        ids = [entry_id for entry_id, read in touched.items() if read]
+        keys = ["id"] + self._fields
+        rows = list()
+        for start in range(0, len(ids), self._chunk):
+            where = dict()
+            where["id"] = ids[start:start + self._chunk]
+            kwargs = dict()
+            kwargs["keys"] = keys
+            kwargs["where"] = where
+            kwargs["default"] = list()
+            rows.extend(self._db.select(self._table, **kwargs))
+
+        with self._lock:
+            for entry_id in touched:
+                self._remove(entry_id)
+
+            for row in rows:
+                self._set(row[0], tuple(row[1:]))
+
+class AggregateView(View):
+    """
+    Count, sum or average of field, per value of the group columns
+    """
+    def __init__(self, factory, store, function="count", field=None, group=()):
+        function = function.lower()
+        if function not in ("count", "sum", "avg"):
+            raise ValueError(f"Aggregate {function} cannot be maintained")
+
+        if function != "count" and field is None:
+            raise ValueError(f"Aggregate {function} needs a field")
+
+        self._function = function
+        self._field = field
+        self._single = isinstance(group, str)
+        self._group = [group] if self._single else list(group)
+        self._totals = dict()
+
+        fields = self._group + ([] if field is None else [field])
+        super().__init__(factory, store, fields)
+
+    def _key(self, values):
+        if len(self._group) == 0:
+            return None
+
+        if self._single:
+            return values[0]
+
+        return tuple(values[:len(self._group)])
+
+    def _add(self, values, sign):
+        value = None
+        if self._field is not None:
+            # Like SQL aggregates, NULLs are left out
+            value = values[-1]
+            if value is None:
+                return
+
+        key = self._key(values)
+        total = self._totals.get(key)
+        if total is None:
+            total = self._totals[key] = [0, 0]
+
+        total[0] = total[0] + sign
+        if value is not None:
+            total[1] = total[1] + sign * value
+
+        if total[0] == 0:
+            del self._totals[key]
+
+    def _insert(self, entry_id, values):
+        self._add(values, 1)
+
+    def _delete(self, entry_id, values):
+        self._add(values, -1)
+
+    def _result(self, total):
+        if self._function == "count":
+            return total[0]
+
+        if self._function == "sum":
+            return total[1]
+
+        return total[1] / total[0]
+
+    def get(self, key=None, default=None):
+        with self._lock:
+            total = self._totals.get(key)
+            if total is None:
+                return default
+
+            return self._result(total)
+
+    def __getitem__(self, key):
+        result = self.get(key)
+        if result is None:
+            raise KeyError(key)
+
+        return result
+
+    @property
+    def value(self):
+        """
+        The aggregate over the whole table, for views without groups
+        """
+        return self.get(None, 0 if self._function == "count" else None)
+
+    def items(self):
+        with self._lock:
+            totals = list(self._totals.items())
+
+        return [(key, self._result(total)) for key, total in totals]
+
+class IndexView(View):
+    """
+    Ids of the rows per value of field
+    """
+    def __init__(self, factory, store, field):
+        self._ids = dict()
+        super().__init__(factory, store, [field])
+
+    def _insert(self, entry_id, values):
+        ids = self._ids.get(values[0])
+        if ids is None:
+            ids = self._ids[values[0]] = set()
+
+        ids.add(entry_id)
+
+    def _delete(self, entry_id, values):
+        ids = self._ids[values[0]]
+        ids.discard(entry_id)
+        if len(ids) == 0:
+            del self._ids[values[0]]
+
+    def get(self, value):
+        with self._lock:
+            return set(self._ids.get(value, ()))
+
+    def __contains__(self, value):
+        with self._lock:
+            return value in self._ids
+
+    def recall(self, value):
+        """
+        Recalls the entries whose field currently holds value
+        """
+        return self._factory.recall_many(sorted(self.get(value)))
@@ -1,8 +1,19 @@
 from spirit.utils.helpers import (
     eprint,
     infinitedict,
-    freezedict
+    freezedict,
+    lazy,
+    at_child_exit,
+    child_exit
 )
 
-from spirit.utils.log import Logger
 from spirit.utils.data import Model, UNDEFINED
+from spirit.utils.metrics import Registry, metrics, aggregate, render
+
+# Logging handlers and sockets are only imported once they are used
+exports = dict()
+exports["spirit.utils.log"] = ["Logger"]
+exports["spirit.utils.wire"] = ["Channel"]
+exports["spirit.utils.codec"] = ["Codec", "codec_for"]
+
+__getattr__ = lazy(__name__, exports)
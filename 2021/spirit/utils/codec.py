@@ -0,0 +1,359 @@
+from spirit.utils.data import Model
+
+from typing import Union
+from struct import Struct, error as StructError
+from pickle import dumps, loads, HIGHEST_PROTOCOL
+from threading import Lock
+from zlib import crc32
+
+# fingerprint, record count
+BATCH = Struct("<II")
+
+DOUBLE = Struct("<d")
+
+# Field kinds, non-optional numbers go in the fixed part of a record
+INT = "int"
+FLOAT = "float"
+BOOL = "bool"
+STR = "str"
+BYTES = "bytes"
+MODEL = "model"
+PICKLE = "pickle"
+
+FIXED = dict()
+FIXED[INT] = "q"
+FIXED[FLOAT] = "d"
+FIXED[BOOL] = "?"
+
+KINDS = dict()
+KINDS[int] = INT
+KINDS[float] = FLOAT
+KINDS[bool] = BOOL
+KINDS[str] = STR
+KINDS[bytes] = BYTES
+
+# Exact types each kind encodes, anything else escapes the record
+TYPES = dict()
+TYPES[INT] = (int,)
+TYPES[FLOAT] = (float,)
+TYPES[BOOL] = (bool,)
+TYPES[STR] = (str,)
+TYPES[BYTES] = (bytes, bytearray, memoryview)
+
+# First bit of the bitmap, set on records pickled whole
+ESCAPED = 1
+
+_codecs = dict()
+_codecs_lock = Lock()
+
+def write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value = value >> 7
+
+    out.append(value)
+
+def read_varint(view, offset):
+    byte = view[offset]
+    if byte < 0x80:
+        return byte, offset + 1
+
+    result = 0
+    shift = 0
+    while True:
+        byte = view[offset]
+        offset = offset + 1
+        result = result | ((byte & 0x7F) << shift)
+        if byte < 0x80:
+            return result, offset
+
+        shift = shift + 7
+
+def write_int(out, value):
+    # Zigzag keeps small negative numbers short
+    write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+
+def read_int(view, offset, copy):
+    value, offset = read_varint(view, offset)
+    if value & 1:
+        return -((value + 1) >> 1), offset
+
+    return value >> 1, offset
+
+def write_float(out, value):
+    out += DOUBLE.pack(value)
+
+def read_float(view, offset, copy):
+    return DOUBLE.unpack_from(view, offset)[0], offset + DOUBLE.size
+
+def write_bool(out, value):
+    out.append(1 if value else 0)
+
+def read_bool(view, offset, copy):
+    return view[offset] != 0, offset + 1
+
+def write_bytes(out, value):
+    write_varint(out, len(value))
+    out += value
+
+def read_bytes(view, offset, copy):
+    size, offset = read_varint(view, offset)
+    end = offset + size
+    if copy:
+        return bytes(view[offset:end]), end
+
+    return view[offset:end], end
+
+def write_str(out, value):
+    write_bytes(out, value.encode("utf-8"))
+
+def read_str(view, offset, copy):
+    size, offset = read_varint(view, offset)
+    end = offset + size
+    return str(view[offset:end], "utf-8"), end
+
+def write_pickle(out, value):
+    write_bytes(out, dumps(value, HIGHEST_PROTOCOL))
+
+def read_pickle(view, offset, copy):
+    size, offset = read_varint(view, offset)
+    end = offset + size
+    return loads(view[offset:end]), end
+
+WRITERS = dict()
+WRITERS[INT] = write_int
+WRITERS[FLOAT] = write_float
+WRITERS[BOOL] = write_bool
+WRITERS[STR] = write_str
+WRITERS[BYTES] = write_bytes
+WRITERS[PICKLE] = write_pickle
+
+READERS = dict()
+READERS[INT] = read_int
+READERS[FLOAT] = read_float
+READERS[BOOL] = read_bool
+READERS[STR] = read_str
+READERS[BYTES] = read_bytes
+READERS[PICKLE] = read_pickle
+
+def field_kind(annotation):
+    """
+    Returns (kind, optional, nested model) for a field annotation
+    """
+    optional = False
+    if getattr(annotation, "__origin__", None) is Union:
+        args = [arg for arg in annotation.__args__ if arg is not type(None)]
+        optional = len(args) < len(annotation.__args__)
+        if len(args) != 1:
+            return PICKLE, optional, None
+
+        annotation = args[0]
+
+    if isinstance(annotation, type) and issubclass(annotation, Model):
+        return MODEL, optional, annotation
+
+    return KINDS.get(annotation, PICKLE), optional, None
+
+def codec_for(model):
+    codec = _codecs.get(model)
+    if codec is None:
+        with _codecs_lock:
+            codec = _codecs.get(model)
+            if codec is None:
+                codec = _codecs[model] = Codec(model)
+
+    return codec
+
+class Codec:
+    """
+    Binary record layout derived from a model's fields and annotations
+
+    A record is a presence bitmap for the optional fields, then every
+    required int, float and bool packed in one fixed-size struct, then the
+    remaining fields in field order. Strings, bytes and varints are length
+    or continuation prefixed, nested models are inlined and anything else
+    is pickled. Required ints are 64 bit.
+
+    Instances holding values their annotations do not describe, like None
+    in a required field or a float in an int one, are pickled whole behind
+    the bitmap with its first bit set.
+    """
+    def __init__(self, model):
+        self.model = model
+        self._fixed = list()
+        self._fixed_types = list()
+        self._variable = list()
+        self._writers = None
+        self._readers = None
+
+        codes = list()
+        optional_count = 0
+        layout = ["escaped"]
+        for index, field in enumerate(model._fields):
+            kind, optional, nested = field_kind(model._field_types[field])
+            name = None if nested is None else nested.__name__
+            layout.append(f"{field}:{kind}:{optional}:{name}")
+            if kind in FIXED and not optional:
+                self._fixed.append(index)
+                self._fixed_types.append(TYPES[kind][0])
+                codes.append(FIXED[kind])
+                continue
+
+            optional_count = optional_count + (1 if optional else 0)
+            self._variable.append((index, kind, optional, nested))
+
+        self._bitmap = (optional_count + 8) // 8
+        self._struct = Struct(f"<{self._bitmap}s{''.join(codes)}")
+        self._size = len(model._fields)
+        self.fingerprint = crc32(";".join(layout).encode("utf-8"))
+
+    def _resolve(self):
+        # Nested codecs are looked up late so models can refer to themselves
+        writers = list()
+        readers = list()
+        for index, kind, optional, nested in self._variable:
+            if kind == MODEL:
+                codec = codec_for(nested)
+                writers.append((index, optional, codec.write, (nested,)))
+                readers.append((index, optional, codec.read))
+                continue
+
+            types = TYPES.get(kind)
+            writers.append((index, optional, WRITERS[kind], types))
+            readers.append((index, optional, READERS[kind]))
+
+        self._writers = writers
+        self._readers = readers
+
+    def write(self, out, instance):
+        """
+        Appends the record for instance to the bytearray out
+        """
+        if self._writers is None:
+            self._resolve()
+
+        start = len(out)
+        fixed = [instance[index] for index in self._fixed]
+        for value, expected in zip(fixed, self._fixed_types):
+            if type(value) is not expected:
+                return self._escape(out, start, instance)
+
+        try:
+            out += self._struct.pack(bytes(self._bitmap), *fixed)
+
+        except StructError:
+            # Ints beyond 64 bits
+            return self._escape(out, start, instance)
+
+        bits = 0
+        mask = ESCAPED << 1
+        for index, optional, writer, types in self._writers:
+            value = instance[index]
+            if optional:
+                present = value is not None
+                bits = bits | (mask if present else 0)
+                mask = mask << 1
+                if not present:
+                    continue
+
+            if types is not None and type(value) not in types:
+                return self._escape(out, start, instance)
+
+            writer(out, value)
+
+        if bits:
+            bitmap = bits.to_bytes(self._bitmap, "little")
+            out[start:start + self._bitmap] = bitmap
+
+    def _escape(self, out, start, instance):
+        del out[start:]
+        out += ESCAPED.to_bytes(self._bitmap, "little")
+        write_pickle(out, tuple(instance))
+
+    def read(self, view, offset, copy=True):
+        """
+        Decodes the record at offset, returns the instance and the offset
+        following it
+        """
+        if self._readers is None:
+            self._resolve()
+
+        if view[offset] & ESCAPED:
+            offset = offset + self._bitmap
+            values, offset = read_pickle(view, offset, copy)
+            return tuple.__new__(self.model, values), offset
+
+        unpacked = self._struct.unpack_from(view, offset)
+        offset = offset + self._struct.size
+
+        values = [None] * self._size
+        for index, value in zip(self._fixed, unpacked[1:]):
+            values[index] = value
+
+        bits = int.from_bytes(unpacked[0], "little")
+        mask = ESCAPED << 1
+        for index, optional, reader in self._readers:
+            if optional:
+                present = bits & mask
+                mask = mask << 1
+                if not present:
+                    continue
+
+            values[index], offset = reader(view, offset, copy)
+
+        # Records were validated when encoded, skip _make's length check
+        return tuple.__new__(self.model, values), offset
+
+    def encode(self, instance):
+        out = bytearray()
+        self.write(out, instance)
+        return bytes(out)
+
+    def decode(self, data, copy=True):
+        """
+        Decodes a single record, bytes fields are memoryviews into data
+        unless copy is set
+        """
+        view = memoryview(data)
+        instance, _ = self.read(view, 0, copy)
+        return instance
+
+    def encode_many(self, instances):
+        instances = list(instances)
+        out = bytearray(BATCH.pack(self.fingerprint, len(instances)))
+        for instance in instances:
+            self.write(out, instance)
+
+        return bytes(out)
+
+    def decode_many(self, data, copy=True):
+        """
+        Decodes a batch from encode_many without copying data, bytes fields
+        are memoryviews into it unless copy is set
+        """
+        view = memoryview(data)
+        fingerprint, count = BATCH.unpack_from(view)
+        if fingerprint != self.fingerprint:
+            name = self.model.__name__
+            raise ValueError(f"Batch was not encoded with the {name} layout")
+
+        instances = list()
+        offset = BATCH.size
+        read = self.read
+        for _ in range(count):
+            instance, offset = read(view, offset, copy)
+            instances.append(instance)
+
+        return instances
+
+def encode(instance):
+    return codec_for(type(instance)).encode(instance)
+
+def decode(model, data, copy=True):
+    return codec_for(model).decode(data, copy)
+
+def encode_many(model, instances):
+    return codec_for(model).encode_many(instances)
+
+def decode_many(model, data, copy=True):
+    return codec_for(model).decode_many(data, copy)
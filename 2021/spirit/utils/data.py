@@ -1,8 +1,87 @@
-from collections import OrderedDict
-from typing import NamedTuple, NamedTupleMeta
+from collections import OrderedDict, _tuplegetter
+from typing import NamedTupleMeta, _type_check, _prohibited
+from types import FunctionType
 
 UNDEFINED = "__UNDEFINED__"
 
+# Constructor code only depends on the field order, so it is compiled once
+# per order and shared by every model using it
+_constructors = dict()
+_constructor_globals = dict(_tuple_new=tuple.__new__, __name__=__name__)
+_getters = list()
+
+def _constructor(typename, fields, annotations, defaults):
+    code = _constructors.get(fields)
+    if code is None:
+        field_args = "".join(field + "," for field in fields)
+        source = "\n".join([
+            f"def __new__(_cls, *args, {field_args}):",
+            "    if len(args) > 0:",
+            "        raise TypeError('Model uses keyword arguments only')",
+            "",
+            f"    return _tuple_new(_cls, ({field_args}))"
+        ])
+        env = _constructor_globals
+        exec(compile(source, "<model>", "exec"), env)
+        code = _constructors[fields] = env.pop("__new__").__code__
+
+    __new__ = FunctionType(code, _constructor_globals, "__new__")
+    __new__.__qualname__ = f"{typename}.__new__"
+    signature = ", ".join(fields)
+    __new__.__doc__ = f"Create new instance of {typename}({signature})"
+    __new__.__annotations__ = dict(annotations)
+    __new__.__kwdefaults__ = dict(defaults)
+    return __new__
+
+def _getter(index):
+    while len(_getters) <= index:
+        position = len(_getters)
+        doc = f"Alias for field number {position}"
+        _getters.append(_tuplegetter(position, doc))
+
+    return _getters[index]
+
+def _make(cls, iterable):
+    result = tuple.__new__(cls, iterable)
+    if len(result) != len(cls._fields):
+        count = len(cls._fields)
+        raise TypeError(f"Expected {count} arguments, got {len(result)}")
+
+    return result
+
+def _replace(self, **changes):
+    result = self._make(map(changes.pop, self._fields, self))
+    if len(changes) > 0:
+        raise ValueError(f"Got unexpected field names: {list(changes)!r}")
+
+    return result
+
+def _repr(self):
+    pairs = ", ".join(f"{f}={v!r}" for f, v in zip(self._fields, self))
+    return f"{self.__class__.__name__}({pairs})"
+
+def _asdict(self):
+    return dict(zip(self._fields, self))
+
+def _getnewargs(self):
+    return tuple(self)
+
+def _reduce(self):
+    # __new__ is keyword only, so unpickling goes through _make instead
+    return self._make, (tuple(self),)
+
+_repr.__name__ = "__repr__"
+_getnewargs.__name__ = "__getnewargs__"
+_reduce.__name__ = "__reduce__"
+
+_tuple_methods = dict()
+_tuple_methods["_make"] = classmethod(_make)
+_tuple_methods["_replace"] = _replace
+_tuple_methods["__repr__"] = _repr
+_tuple_methods["_asdict"] = _asdict
+_tuple_methods["__getnewargs__"] = _getnewargs
+_tuple_methods["__reduce__"] = _reduce
+
 class ModelMeta(NamedTupleMeta):
     def __new__(mcs, typename, bases, namespace):
         # DEBUG
@@ -48,59 +127,53 @@ class ModelMeta(NamedTupleMeta):
         for key, value in field_defaults.items():
             namespace.setdefault(key, value)
 
-        # NOTE: Here be dragons
-
         # Place fields with default values at the end
         default_fields = [field for field in fields if field in namespace]
         value_fields = set(fields).difference(default_fields)
-        ordered_fields = (sorted(value_fields) + sorted(default_fields))
-
-        namespace["__annotations__"] = OrderedDict([
-            (field, fields[field]) for field in ordered_fields
-        ])
-
-        # Allows NamedTupleMeta to create annotations
-        template = super().__new__(mcs, typename, None, namespace)
-
-        # Hack to modify __new__ to be keyword arguments only
-        field_args = "".join(field + "," for field in ordered_fields)
-        rewrite = f"""
-        def __new__(_cls, *args, {field_args}):
-            if len(args) > 0:
-                raise TypeError("Model uses keyword arguments only")
-
-            return _tuple_new(_cls, ({field_args}))
-        """
-        rewrite_env = dict()
-        rewrite_env["_tuple_new"] = tuple.__new__
-        rewrite_env["__name__"] = f"namedtuple_{typename}"
+        ordered_fields = tuple(sorted(value_fields) + sorted(default_fields))
 
-        # Do never ever actually do this; Do as I say, not as I do
-        exec(rewrite.strip(), rewrite_env)
+        annotations = dict()
+        for field in ordered_fields:
+            message = f"{typename}.{field} must be a type"
+            annotations[field] = _type_check(fields[field], message)
 
-        # Hard-wire this abomination into something we can use
-        __new__ = rewrite_env["__new__"]
-        __new__.__qualname__ = f"{typename}.__new__"
-        __new__.__doc__ = template.__new__.__doc__
-        __new__.__annotations__ = template.__new__.__annotations__
-        __new__.__kwdefaults__ = {df: namespace[df] for df in default_fields}
-
-        # I will atone for this later, for now be grateful this works
-        template.__new__ = __new__
-
-        # NOTE: For the code above, you may want to avert your eyes
-
-        template_bases = template.__bases__
-        bases = bases + template_bases
-
-        new_namespace = template.__dict__.copy()
-        new_namespace["_bases"] = bases
-
-        model_type = type.__new__(mcs, typename, template_bases, new_namespace)
-
-        # Modifying __bases__ triggers MRO
-        # This happens *after* class creation
-        model_type.__bases__ = tuple(template_bases)
+        field_defaults = dict()
+        for field in ordered_fields:
+            if field in namespace:
+                field_defaults[field] = namespace[field]
+
+        # Same attributes NamedTupleMeta would give, built in a single pass
+        new_namespace = dict(_tuple_methods)
+        for index, field in enumerate(ordered_fields):
+            new_namespace[field] = _getter(index)
+
+        new_namespace["__doc__"] = f"{typename}({', '.join(ordered_fields)})"
+        new_namespace["__slots__"] = tuple()
+        new_namespace["_fields"] = ordered_fields
+        new_namespace["_field_defaults"] = field_defaults
+        new_namespace["_fields_defaults"] = field_defaults
+        new_namespace["_field_types"] = annotations
+        new_namespace["__annotations__"] = annotations
+        new_namespace["__new__"] = _constructor(
+            typename,
+            ordered_fields,
+            annotations,
+            field_defaults
+        )
+
+        for key, value in namespace.items():
+            if key in _prohibited:
+                raise AttributeError(f"Cannot overwrite Model attribute {key}")
+
+            if key not in annotations and key != "__annotations__":
+                new_namespace[key] = value
+
+        new_namespace["_bases"] = bases + (tuple,)
+        model_type = type.__new__(mcs, typename, (tuple,), new_namespace)
+
+        # The custom mro only applies once __bases__ is reassigned, the class
+        # must first be laid out as a plain tuple subclass
+        model_type.__bases__ = (tuple,)
         return model_type
 
     def mro(cls):
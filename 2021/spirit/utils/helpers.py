@@ -1,5 +1,11 @@
-from sys import exit, stderr
+from sys import exit, stdout, stderr, modules
+from os import _exit
 from collections import defaultdict, namedtuple
+from importlib import import_module
+from traceback import print_exc
+
+# Forked workers end with _exit, which skips atexit hooks
+_child_exits = list()
 
 def eprint(*args, code=0, **kwargs):
     print(*args, file=stderr, **kwargs)
@@ -13,3 +19,49 @@ def freezedict(value):
     assert isinstance(value, dict), "Can only freeze dictionary"
     FrozenDict = namedtuple("FrozenDict", value)
     return FrozenDict(**value)
+
+def lazy(package, exports):
+    """
+    Module __getattr__ that imports the module behind an export on first use,
+    exports maps each module name to the names it provides
+    """
+    sources = dict()
+    for module_name, names in exports.items():
+        for name in names:
+            sources[name] = module_name
+
+    def __getattr__(name):
+        module_name = sources.get(name)
+        if module_name is None:
+            error = f"module {package!r} has no attribute {name!r}"
+            raise AttributeError(error)
+
+        value = getattr(import_module(module_name), name)
+        setattr(modules[package], name, value)
+        return value
+
+    return __getattr__
+
+def at_child_exit(callback):
+    """
+    Registers callback to run when a forked worker ends through child_exit
+    """
+    if callback not in _child_exits:
+        _child_exits.append(callback)
+
+def child_exit(code=0):
+    """
+    Runs the child exit hooks, newest first, then flushes stdio and ends the
+    process without unwinding into the parent's stack
+    """
+    while len(_child_exits) > 0:
+        callback = _child_exits.pop()
+        try:
+            callback()
+
+        except Exception:
+            print_exc()
+
+    stdout.flush()
+    stderr.flush()
+    _exit(code)
@@ -1,9 +1,22 @@
+from spirit.utils import at_child_exit
+
 from logging import getLogger, Formatter, DEBUG, INFO, WARNING, ERROR, CRITICAL
-from logging import StreamHandler
+from logging import StreamHandler, LogRecord, makeLogRecord, getLevelName
 from logging.handlers import TimedRotatingFileHandler
 from logging.handlers import QueueListener, QueueHandler
-from queue import Queue
+from queue import Queue, Empty, Full
 from pathlib import Path
+from socket import socketpair, AF_UNIX, SOCK_DGRAM
+from threading import Thread
+from pickle import dumps, loads, HIGHEST_PROTOCOL
+from os import register_at_fork, getpid
+from atexit import register as at_exit, unregister
+from json import dumps as json_dumps
+from random import random
+from time import monotonic
+
+# Keeps shipped batches well under the unix datagram size limit
+BATCH_BYTES = 1 << 15
 
 def get_level(level):
     levels = dict()
@@ -22,15 +35,59 @@ def get_formatter(formatter, date_format):
     if date_format is None:
         date_format = "%Y-%m-%d %H:%M:%S"
 
-    return Formatter(formatter)
+    if formatter == "json":
+        return Json(datefmt=date_format)
+
+    return Formatter(formatter, date_format)
+
+# Attributes every record has, anything else came in through extra
+RESERVED = set(vars(LogRecord("", 0, "", 0, "", tuple(), None)))
+RESERVED.update(["message", "asctime"])
+
+class Json(Formatter):
+    """
+    Formats records as single line JSON objects, extra fields included
+    """
+    def format(self, record):
+        entry = dict()
+        entry["time"] = self.formatTime(record, self.datefmt)
+        entry["level"] = record.levelname
+        entry["name"] = record.name
+        entry["process"] = record.process
+        entry["thread"] = record.threadName
+        entry["message"] = record.getMessage()
+        for key, value in vars(record).items():
+            if key not in RESERVED:
+                entry[key] = value
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
 
-class Stream(StreamHandler):
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+
+        return json_dumps(entry, default=str, separators=(",", ":"))
+
+class Deferred:
+    """
+    Lets the listener hold back flushes until a whole batch is written
+    """
+    deferred = False
+
+    def defer(self, deferred):
+        self.deferred = deferred
+
+    def flush(self):
+        if not self.deferred:
+            super().flush()
+
+class Stream(Deferred, StreamHandler):
     def __init__(self, level=None, formatter=None, date_format=None):
         super().__init__()
         self.setLevel(get_level(level))
         self.setFormatter(get_formatter(formatter, date_format))
 
-class Rotated(TimedRotatingFileHandler):
+class Rotated(Deferred, TimedRotatingFileHandler):
     def __init__(
         self,
         filename,
@@ -48,13 +105,235 @@ class Rotated(TimedRotatingFileHandler):
         self.setLevel(get_level(level))
         self.setFormatter(get_formatter(formatter, date_format))
 
+class Batched(QueueListener):
+    """
+    Queue listener writing records in batches with a single flush each
+
+    A batch ends once the queue runs dry or batch records were handled.
+    """
+    def __init__(self, queue, *handlers, batch=256, **kwargs):
+        super().__init__(queue, *handlers, **kwargs)
+        self.batch = batch
+        self._pending = 0
+
+    def _deferrable(self):
+        return [h for h in self.handlers if isinstance(h, Deferred)]
+
+    def _release(self):
+        if self._pending == 0:
+            return
+
+        self._pending = 0
+        for handler in self._deferrable():
+            handler.defer(False)
+            handler.flush()
+
+    def dequeue(self, block):
+        if self._pending < self.batch:
+            try:
+                return self.queue.get_nowait()
+
+            except Empty:
+                pass
+
+        self._release()
+        return self.queue.get(block)
+
+    def handle(self, record):
+        if self._pending == 0:
+            for handler in self._deferrable():
+                handler.defer(True)
+
+        self._pending = self._pending + 1
+        super().handle(record)
+
+    def stop(self):
+        # Stopping twice is harmless, unlike with the base listener
+        if self._thread is None:
+            return
+
+        # The last batch may end with the sentinel instead of an empty queue
+        super().stop()
+        self._release()
+
+class Bounded(QueueHandler):
+    """
+    Queue handler that drops records instead of blocking when full
+    """
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+
+        except Full:
+            self.dropped = self.dropped + 1
+
+# Formats exceptions of records shipped before any handler saw them
+def get_logger(name):
+    """
+    Standard logger for library code, under the spirit namespace so a Logger
+    named spirit gets its records, stderr gets warnings when none does
+    """
+    return getLogger(f"spirit.{name}")
+
+_formatter = Formatter()
+
+def portable(value):
+    try:
+        dumps(value, HIGHEST_PROTOCOL)
+
+    except Exception:
+        return repr(value)
+
+    return value
+
+def pack_record(record):
+    exc_text = record.exc_text
+    if record.exc_info and not exc_text:
+        exc_text = _formatter.formatException(record.exc_info)
+
+    extra = dict()
+    for key, value in vars(record).items():
+        if key not in RESERVED:
+            extra[key] = portable(value)
+
+    return (
+        record.name,
+        record.levelno,
+        record.pathname,
+        record.lineno,
+        record.getMessage(),
+        record.created,
+        record.process,
+        record.threadName,
+        exc_text,
+        extra
+    )
+
+def unpack_record(packed):
+    record = dict(packed[9])
+    record["name"], record["levelno"], record["pathname"] = packed[:3]
+    record["lineno"], record["msg"], record["created"] = packed[3:6]
+    record["process"], record["threadName"], record["exc_text"] = packed[6:9]
+    record["levelname"] = getLevelName(record["levelno"])
+    record["msecs"] = (record["created"] - int(record["created"])) * 1000
+    return makeLogRecord(record)
+
+def truncate(packed, limit):
+    # Keeps the head of the message and traceback, extra fields are dropped
+    packed = list(packed)
+    for index in (4, 8):
+        text = packed[index]
+        if text is not None and len(text) > limit:
+            packed[index] = text[:limit] + " [truncated]"
+
+    packed[9] = dict()
+    return tuple(packed)
+
+class Shipper:
+    """
+    Sends records from a forked child to the parent in batched datagrams
+    """
+    def __init__(self, sock, queue, handler, batch, interval):
+        self._sock = sock
+        self._queue = queue
+        self._handler = handler
+        self._batch = batch
+        self._interval = interval
+        self._running = True
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _send(self, records):
+        if len(records) == 0:
+            return
+
+        shipment = getpid(), self._handler.dropped, records
+        message = dumps(shipment, HIGHEST_PROTOCOL)
+
+        # Sizes are only estimated while batching, halves go out separately
+        if len(message) > BATCH_BYTES and len(records) > 1:
+            half = len(records) // 2
+            self._send(records[:half])
+            self._send(records[half:])
+            return
+
+        if len(message) > BATCH_BYTES:
+            records = [truncate(records[0], BATCH_BYTES // 16)]
+            shipment = getpid(), self._handler.dropped, records
+            message = dumps(shipment, HIGHEST_PROTOCOL)
+
+        if len(message) > BATCH_BYTES:
+            self._handler.dropped = self._handler.dropped + 1
+            return
+
+        try:
+            self._sock.send(message)
+
+        except OSError:
+            self._handler.dropped = self._handler.dropped + len(records)
+
+    def _run(self):
+        while self._running or not self._queue.empty():
+            records = list()
+            size = 0
+            try:
+                record = self._queue.get(timeout=self._interval)
+
+            except Empty:
+                continue
+
+            while record is not None:
+                packed = pack_record(record)
+                records.append(packed)
+                size = size + len(packed[4]) + len(packed[2]) + 64
+                if packed[8] is not None:
+                    size = size + len(packed[8])
+
+                if len(records) >= self._batch or size >= BATCH_BYTES:
+                    self._send(records)
+                    records = list()
+                    size = 0
+
+                try:
+                    record = self._queue.get_nowait()
+
+                except Empty:
+                    record = None
+
+            self._send(records)
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+
 class Logger:
     def __init__(self, name, level=None, settings=dict()):
         self.name = name
         self.core = getLogger(name)
-        self.core.setLevel(get_level(level))
+        self.set_level(level)
         self._load(settings)
 
+        # Sampling and rate limits only ever apply below warnings
+        self._sample = settings.get("sample")
+        self._rate = settings.get("rate")
+        self._tokens = self._rate
+        self._refilled = monotonic()
+        self.suppressed = 0
+
+        multiprocess = settings.get("multiprocess")
+        self._shipper = None
+        self._receiver = None
+        self._reader = None
+        self._writer = None
+        self._dropped = dict()
+        self._corrupt = 0
+        if multiprocess is not None:
+            self._prepare_fork(multiprocess)
+
     def _load(self, settings):
         disabled = settings.get("disabled", list())
         handlers = list()
@@ -93,35 +372,176 @@ class Logger:
             rotated_handler = Rotated(*rotated_args)
             handlers.append(rotated_handler)
 
-        self.queue = Queue()
-        self.queue_handler = QueueHandler(self.queue)
+        queue_size = settings.get("queue_size", 0)
+        self.queue = Queue(queue_size)
+        self.queue_handler = Bounded(self.queue)
 
         args = tuple(handlers)
         kwargs = dict()
         kwargs["respect_handler_level"] = True
-        self.listener = QueueListener(self.queue, *args, **kwargs)
+        kwargs["batch"] = settings.get("batch", 256)
+        self.listener = Batched(self.queue, *args, **kwargs)
         self.core.addHandler(self.queue_handler)
 
+    def _prepare_fork(self, settings):
+        """
+        Children ship records to the parent, which alone writes and rotates
+        """
+        self._batch = settings.get("batch", 256)
+        self._interval = settings.get("interval", 0.1)
+        self._child_queue_size = settings.get("queue_size", 10000)
+        self._reader, self._writer = socketpair(AF_UNIX, SOCK_DGRAM)
+        register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # A stopped logger has nothing left to ship to
+        if self._writer is None:
+            return
+
+        # Grandchildren keep shipping straight to the original parent
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+        # The inherited queue and listener belong to the parent
+        self.core.removeHandler(self.queue_handler)
+        self.queue = Queue(self._child_queue_size)
+        self.queue_handler = Bounded(self.queue)
+        self.core.addHandler(self.queue_handler)
+
+        args = self._writer, self.queue, self.queue_handler
+        self._shipper = Shipper(*args, self._batch, self._interval)
+
+        # Workers ending with _exit skip atexit, they run child exit hooks
+        unregister(self._ship_remaining)
+        at_exit(self._ship_remaining)
+        at_child_exit(self._ship_remaining)
+
+    def _ship_remaining(self):
+        if self._shipper is not None:
+            self._shipper.stop()
+
+    def _receive(self):
+        while True:
+            try:
+                data = self._reader.recv(1 << 17)
+
+            except OSError:
+                return
+
+            # An empty datagram is how stop asks the receiver to end
+            if len(data) == 0:
+                return
+
+            # A bad datagram must not take the receiver down with it
+            try:
+                pid, dropped, records = loads(data)
+                records = [unpack_record(packed) for packed in records]
+
+            except Exception:
+                self._corrupt = self._corrupt + 1
+                continue
+
+            self._dropped[pid] = dropped
+            for record in records:
+                self.queue_handler.enqueue(record)
+
+    @property
+    def dropped(self):
+        dropped = self.queue_handler.dropped + self._corrupt
+        return dropped + sum(self._dropped.values())
+
     def start(self):
         self.listener.start()
+        if self._reader is not None and self._receiver is None:
+            self._receiver = Thread(target=self._receive, daemon=True)
+            self._receiver.start()
 
     def stop(self):
+        if self._shipper is not None:
+            self._shipper.stop()
+            return
+
+        # Whatever children shipped so far still goes through the listener
+        if self._receiver is not None:
+            self._writer.send(b"")
+            self._receiver.join()
+            self._receiver = None
+
+        if self._reader is not None:
+            self._reader.close()
+            self._writer.close()
+            self._reader = None
+            self._writer = None
+
         self.listener.stop()
 
-    def debug(self, message, extra=dict()):
-        self.core.debug(message, extra=extra)
+    def set_level(self, level):
+        self.core.setLevel(get_level(level))
+
+        # Cached so disabled calls return before touching the logging module
+        self._threshold = self.core.getEffectiveLevel()
+
+    def enabled(self, level):
+        return level >= self._threshold
+
+    def _allowed(self, level):
+        if level < self._threshold:
+            return False
+
+        if level >= WARNING:
+            return True
+
+        if self._sample is not None and random() >= self._sample:
+            self.suppressed = self.suppressed + 1
+            return False
+
+        if self._rate is not None:
+            now = monotonic()
+            elapsed = now - self._refilled
+            self._refilled = now
+            self._tokens = min(self._rate, self._tokens + elapsed * self._rate)
+            if self._tokens < 1:
+                self.suppressed = self.suppressed + 1
+                return False
+
+            self._tokens = self._tokens - 1
+
+        return True
+
+    def _emit(self, level, message, args, extra):
+        if callable(message):
+            message = message()
+
+        self.core.log(level, message, *args, extra=extra)
+
+    def log(self, level, message, *args, extra=None):
+        """
+        Messages may be callables, only called once the level is enabled,
+        and args are only interpolated when a handler formats the record
+        """
+        if self._allowed(level):
+            self._emit(level, message, args, extra)
+
+    def debug(self, message, *args, extra=None):
+        if self._allowed(DEBUG):
+            self._emit(DEBUG, message, args, extra)
 
-    def info(self, message, extra=dict()):
-        self.core.info(message, extra=extra)
+    def info(self, message, *args, extra=None):
+        if self._allowed(INFO):
+            self._emit(INFO, message, args, extra)
 
-    def warning(self, message, extra=dict()):
-        self.core.warning(message, extra=extra)
+    def warning(self, message, *args, extra=None):
+        if self._allowed(WARNING):
+            self._emit(WARNING, message, args, extra)
 
-    def error(self, message, extra=dict()):
-        self.core.error(message, extra=extra)
+    def error(self, message, *args, extra=None):
+        if self._allowed(ERROR):
+            self._emit(ERROR, message, args, extra)
 
-    def critical(self, message, extra=dict()):
-        self.core.critical(message, extra=extra)
+    def critical(self, message, *args, extra=None):
+        if self._allowed(CRITICAL):
+            self._emit(CRITICAL, message, args, extra)
 
     def write(self, message):
         self.core.info(message.rstrip())
@@ -0,0 +1,314 @@
+from spirit.utils.helpers import at_child_exit
+
+from threading import local, Lock, Thread, Event as Signal
+from json import dumps, loads
+from pathlib import Path
+from os import register_at_fork, getpid, replace
+from time import perf_counter
+
+# Histogram buckets keep SUB_BITS significant bits, roughly 6% precision
+SUB_BITS = 4
+HALF = 1 << (SUB_BITS - 1)
+
+def bucket_index(value):
+    shift = max(value.bit_length() - SUB_BITS, 0)
+    return (shift << (SUB_BITS - 1)) + (value >> shift)
+
+def bucket_value(index):
+    if index < (1 << SUB_BITS):
+        return index
+
+    shift = (index >> (SUB_BITS - 1)) - 1
+    mantissa = index - (shift << (SUB_BITS - 1))
+    return mantissa << shift
+
+def metric_key(name, labels):
+    if len(labels) == 0:
+        return name
+
+    pairs = ",".join(f"{k}={v}" for k, v in sorted(labels.items()))
+    return f"{name}{{{pairs}}}"
+
+class Counter:
+    def __init__(self, registry, key):
+        self._registry = registry
+        self.key = key
+
+    def inc(self, amount=1):
+        counters = self._registry._shard()[0]
+        counters[self.key] = counters.get(self.key, 0) + amount
+
+class Gauge:
+    def __init__(self, registry, key):
+        self._registry = registry
+        self.key = key
+
+    def set(self, value):
+        self._registry._gauges[self.key] = value
+
+    def inc(self, amount=1):
+        gauges = self._registry._gauges
+        gauges[self.key] = gauges.get(self.key, 0) + amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+class Histogram:
+    """
+    Latency histogram in microseconds with log-linear (HDR style) buckets
+    """
+    def __init__(self, registry, key):
+        self._registry = registry
+        self.key = key
+
+    def observe(self, seconds):
+        value = int(seconds * 1e6)
+        histograms = self._registry._shard()[1]
+        histogram = histograms.get(self.key)
+        if histogram is None:
+            histogram = histograms[self.key] = [0, 0, value, value, dict()]
+
+        histogram[0] = histogram[0] + 1
+        histogram[1] = histogram[1] + value
+        if value < histogram[2]:
+            histogram[2] = value
+
+        if value > histogram[3]:
+            histogram[3] = value
+
+        buckets = histogram[4]
+        index = bucket_index(value)
+        buckets[index] = buckets.get(index, 0) + 1
+
+    def time(self):
+        return Timer(self)
+
+class Timer:
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(perf_counter() - self._start)
+
+class Registry:
+    """
+    Counters and histograms accumulate in per-thread shards that only their
+    own thread writes to, so recording takes no locks; reads merge shards
+    """
+    def __init__(self):
+        self._local = local()
+        self._shards = list()
+        self._gauges = dict()
+        self._metrics = dict()
+        self._lock = Lock()
+        self._reporter = None
+        self._exports = None
+        register_at_fork(after_in_child=self.reset)
+
+    def _shard(self):
+        try:
+            return self._local.shard
+
+        except AttributeError:
+            shard = self._local.shard = (dict(), dict())
+            with self._lock:
+                self._shards.append(shard)
+
+            return shard
+
+    def _metric(self, kind, name, labels):
+        key = metric_key(name, labels)
+        metric = self._metrics.get((kind, key))
+        if metric is None:
+            metric = self._metrics[(kind, key)] = kind(self, key)
+
+        return metric
+
+    def counter(self, name, **labels):
+        return self._metric(Counter, name, labels)
+
+    def gauge(self, name, **labels):
+        return self._metric(Gauge, name, labels)
+
+    def histogram(self, name, **labels):
+        return self._metric(Histogram, name, labels)
+
+    def reset(self):
+        # Forked children start from zero instead of recounting the parent
+        self._local = local()
+        self._shards = list()
+        self._gauges = dict()
+        self._lock = Lock()
+        self._reporter = None
+        if self._exports is not None:
+            at_child_exit(self._export_on_exit)
+
+    def _export_on_exit(self):
+        if self._exports is not None:
+            self.export(self._exports)
+
+    def export_on_exit(self, directory):
+        """
+        Has every worker forked after this export its snapshot to directory
+        as it ends through child_exit, None stops it
+        """
+        self._exports = directory
+
+    def snapshot(self):
+        with self._lock:
+            shards = list(self._shards)
+
+        counters = dict()
+        histograms = dict()
+        for shard_counters, shard_histograms in shards:
+            for key, value in list(shard_counters.items()):
+                counters[key] = counters.get(key, 0) + value
+
+            for key, histogram in list(shard_histograms.items()):
+                count, total, low, high, buckets = histogram
+                entry = dict()
+                entry["count"] = count
+                entry["sum"] = total
+                entry["min"] = low
+                entry["max"] = high
+                entry["buckets"] = dict(buckets)
+                histograms[key] = merge_histogram(histograms.get(key), entry)
+
+        result = dict()
+        result["pid"] = getpid()
+        result["counters"] = counters
+        result["gauges"] = dict(self._gauges)
+        result["histograms"] = histograms
+        return result
+
+    def dump(self, path=None, format="text"):
+        text = render(self.snapshot(), format)
+        if path is None:
+            return text
+
+        path = Path(path)
+        partial = path.with_suffix(".partial")
+        partial.write_text(text)
+        replace(partial, path)
+        return text
+
+    def export(self, directory):
+        """
+        Writes the raw snapshot of this process for aggregate to pick up
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        return self.dump(directory / f"metrics-{getpid()}.json", "json")
+
+    def report_every(self, seconds, path=None, format="text", directory=None):
+        def run(stop):
+            while not stop.wait(seconds):
+                if directory is not None:
+                    self.export(directory)
+
+                if path is not None:
+                    self.dump(path, format)
+
+        stop = Signal()
+        thread = Thread(target=run, args=(stop,), daemon=True)
+        thread.start()
+        self._reporter = stop
+        return stop.set
+
+def merge_histogram(left, right):
+    if left is None:
+        return right
+
+    merged = dict()
+    merged["count"] = left["count"] + right["count"]
+    merged["sum"] = left["sum"] + right["sum"]
+    merged["min"] = min(left["min"], right["min"])
+    merged["max"] = max(left["max"], right["max"])
+
+    buckets = dict(left["buckets"])
+    for index, count in right["buckets"].items():
+        index = int(index)
+        buckets[index] = buckets.get(index, 0) + count
+
+    merged["buckets"] = buckets
+    return merged
+
+def merge(snapshots):
+    counters = dict()
+    gauges = dict()
+    histograms = dict()
+    for snapshot in snapshots:
+        for key, value in snapshot["counters"].items():
+            counters[key] = counters.get(key, 0) + value
+
+        for key, value in snapshot["gauges"].items():
+            gauges[key] = gauges.get(key, 0) + value
+
+        for key, histogram in snapshot["histograms"].items():
+            buckets = {int(i): c for i, c in histogram["buckets"].items()}
+            histogram = dict(histogram, buckets=buckets)
+            histograms[key] = merge_histogram(histograms.get(key), histogram)
+
+    result = dict()
+    result["counters"] = counters
+    result["gauges"] = gauges
+    result["histograms"] = histograms
+    return result
+
+def aggregate(directory, include=None):
+    """
+    Merges snapshots exported by every process into one, plus include
+    """
+    snapshots = list()
+    for path in sorted(Path(directory).glob("metrics-*.json")):
+        snapshots.append(loads(path.read_text()))
+
+    if include is not None:
+        snapshots.append(include)
+
+    return merge(snapshots)
+
+def percentile(histogram, fraction):
+    target = histogram["count"] * fraction
+    seen = 0
+    for index in sorted(histogram["buckets"]):
+        seen = seen + histogram["buckets"][index]
+        if seen >= target:
+            return min(bucket_value(index), histogram["max"])
+
+    return histogram["max"]
+
+def summarize(histogram):
+    summary = dict()
+    summary["count"] = histogram["count"]
+    summary["mean"] = histogram["sum"] / max(histogram["count"], 1)
+    summary["min"] = histogram["min"]
+    summary["p50"] = percentile(histogram, 0.5)
+    summary["p90"] = percentile(histogram, 0.9)
+    summary["p99"] = percentile(histogram, 0.99)
+    summary["max"] = histogram["max"]
+    return summary
+
+def render(snapshot, format="text"):
+    if format == "json":
+        return dumps(snapshot, sort_keys=True)
+
+    lines = list()
+    for key, value in sorted(snapshot["counters"].items()):
+        lines.append(f"{key} {value}")
+
+    for key, value in sorted(snapshot["gauges"].items()):
+        lines.append(f"{key} {value}")
+
+    for key, histogram in sorted(snapshot["histograms"].items()):
+        summary = summarize(histogram)
+        stats = " ".join(f"{k}={v:.0f}" for k, v in summary.items())
+        lines.append(f"{key} {stats} (us)")
+
+    return "\n".join(lines) + "\n"
+
+metrics = Registry()
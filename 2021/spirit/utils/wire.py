@@ -0,0 +1,107 @@
+from struct import Struct
+from pickle import dumps, loads, HIGHEST_PROTOCOL
+from collections import deque
+from threading import Lock
+from select import select
+
+FRAME = Struct("<I")
+
+class Channel:
+    """
+    Length-prefixed pickle frames over a connected stream socket
+    """
+    def __init__(self, sock):
+        self._sock = sock
+        self._buffer = bytearray()
+        self._ready = deque()
+        self._outbox = bytearray()
+        self._lock = Lock()
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def close(self):
+        self._sock.close()
+
+    def send(self, message):
+        data = dumps(message, HIGHEST_PROTOCOL)
+        with self._lock:
+            self._sock.sendall(FRAME.pack(len(data)) + data)
+
+    def put(self, message):
+        """
+        Queues a message for flush, for senders that must never block
+        """
+        data = dumps(message, HIGHEST_PROTOCOL)
+        self._outbox.extend(FRAME.pack(len(data)))
+        self._outbox.extend(data)
+
+    @property
+    def pending(self):
+        return len(self._outbox)
+
+    def flush(self):
+        """
+        Sends as much of the queue as a non-blocking socket takes, returns
+        whether it was all sent
+        """
+        while len(self._outbox) > 0:
+            try:
+                sent = self._sock.send(self._outbox)
+
+            except (BlockingIOError, InterruptedError):
+                return False
+
+            del self._outbox[:sent]
+
+        return True
+
+    def _parse(self):
+        view = memoryview(self._buffer)
+        offset = 0
+        while len(view) - offset >= FRAME.size:
+            (size,) = FRAME.unpack_from(view, offset)
+            end = offset + FRAME.size + size
+            if len(view) < end:
+                break
+
+            self._ready.append(loads(view[offset + FRAME.size:end]))
+            offset = end
+
+        view.release()
+        del self._buffer[:offset]
+
+    def read(self):
+        """
+        Reads whatever is available with a single recv, raises EOFError once
+        the other end has closed
+        """
+        if len(self._ready) == 0:
+            chunk = self._sock.recv(1 << 16)
+            if not chunk:
+                raise EOFError("Channel closed")
+
+            self._buffer.extend(chunk)
+            self._parse()
+
+        messages = list(self._ready)
+        self._ready.clear()
+        return messages
+
+    def poll(self, timeout=0):
+        if len(self._ready) > 0:
+            return True
+
+        readable, _, _ = select([self._sock], [], [], timeout)
+        return len(readable) > 0
+
+    def recv(self):
+        while len(self._ready) == 0:
+            chunk = self._sock.recv(1 << 16)
+            if not chunk:
+                raise EOFError("Channel closed")
+
+            self._buffer.extend(chunk)
+            self._parse()
+
+        return self._ready.popleft()
@@ -1 +1,34 @@
-from spirit.workers.nursery import Nursery
+from spirit.utils import lazy
+from spirit.workers.nursery import Nursery, cores, cpus
+
+# Pools, shared memory and the scheduler (which needs storage) load on use
+exports = dict()
+exports["spirit.workers.pool"] = [
+    "Pool",
+    "WorkerError",
+    "resolve",
+    "ROUND_ROBIN",
+    "LEAST_LOADED",
+    "WORK_STEALING"
+]
+
+exports["spirit.workers.supervisor"] = [
+    "Supervisor",
+    "heartbeat",
+    "PERMANENT",
+    "TRANSIENT",
+    "TEMPORARY"
+]
+
+exports["spirit.workers.shared"] = ["SharedArray", "SharedState"]
+exports["spirit.workers.scheduler"] = [
+    "Scheduler",
+    "Job",
+    "Cron",
+    "ScheduledJob",
+    "SKIP",
+    "COALESCE",
+    "CATCH_UP"
+]
+
+__getattr__ = lazy(__name__, exports)
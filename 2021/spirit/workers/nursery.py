@@ -1,12 +1,38 @@
+from spirit.utils.metrics import metrics
+from spirit.utils import child_exit
+
 from sys import exit
-from os import fork, getpid, getppid, kill, waitpid
+from traceback import print_exc
+from os import fork, getpid, getppid, kill, waitpid, cpu_count
 from signal import signal, SIGKILL, SIGINT, SIGUSR1
 
+try:
+    from os import sched_getaffinity, sched_setaffinity
+
+except ImportError:
+    # Platforms without affinity support (e.g. macOS) get no pinning
+    sched_getaffinity = None
+    sched_setaffinity = None
+
+forks = metrics.counter("nursery.forks")
+
+def cpus():
+    if sched_getaffinity is None:
+        return list(range(cpu_count() or 1))
+
+    return sorted(sched_getaffinity(0))
+
+def cores():
+    return len(cpus())
+
 class Nursery:
-    def __init__(self, parent_callback, child_callbacks):
+    def __init__(self, parent_callback, child_callbacks, bus=None, pin=False):
         self._is_parent = None
         self._is_child = None
         self._root = None
+        self._bus = bus
+        self._pin = pin
+        self._cpus = cpus()
 
         self.set_parent_callback(parent_callback)
         self.set_child_callbacks(child_callbacks)
@@ -22,10 +48,13 @@ class Nursery:
 
     def handle_parent(self, states, pids):
         # Reap children on Ctrl-C
-        signal(SIGINT, lambda: self.reap(pids))
+        signal(SIGINT, lambda signum, frame: self.reap(pids))
 
         # Re-spawn the child workers
-        signal(SIGUSR1, lambda: self.spawn(states, pids))
+        signal(SIGUSR1, lambda signum, frame: self.spawn(states, pids))
+
+        if self._bus is not None:
+            self._bus.parent()
 
         pid = getpid()
         self._is_parent = True
@@ -38,10 +67,20 @@ class Nursery:
             index = pids[pid[0]]
             print(f"Worker {index+1} of {len(pids)} closed")
 
+        # Children may have written results into shared state
+        return states
+
     def handle_child(self, state, index):
         pid = getpid()
         ppid = getppid()
-        callback = self._child_callbacks[index]
+        # A single callback can serve any number of states
+        callback = self._child_callbacks[index % len(self._child_callbacks)]
+
+        if self._pin and sched_setaffinity is not None:
+            sched_setaffinity(0, {self._cpus[index % len(self._cpus)]})
+
+        if self._bus is not None:
+            self._bus.child(index)
 
         self._is_child = True
         self._is_parent = False
@@ -54,17 +93,38 @@ class Nursery:
         for pid in pids:
             kill(pid, SIGKILL)
 
-    def spawn(self, states, pids=list()):
-        self.reap(pids)
-
+    def fork(self, states):
         pids = dict()
         children = len(states)
         for i in range(children):
             fpid = fork()
             if fpid == 0:
-                self.handle_child(states[i], i)
+                # Ends through child_exit so workers run their exit hooks
+                code = 0
+                try:
+                    self.handle_child(states[i], i)
+
+                except SystemExit as e:
+                    code = e.code if isinstance(e.code, int) else 1
+
+                except BaseException:
+                    print_exc()
+                    code = 1
+
+                child_exit(code)
 
             else:
+                forks.inc()
                 pids[fpid] = i
 
-        self.handle_parent(states, pids)
+        return pids
+
+    def spawn(self, states=None, pids=list()):
+        if states is None:
+            # One worker per usable core
+            states = [dict() for _ in self._cpus]
+
+        self.reap(pids)
+
+        pids = self.fork(states)
+        return self.handle_parent(states, pids)
@@ -0,0 +1,439 @@
+from spirit.workers.nursery import Nursery, cores
+from spirit.utils.wire import Channel
+from spirit.utils.metrics import metrics
+from spirit.utils import child_exit
+
+from os import waitpid
+from socket import socketpair
+from selectors import DefaultSelector, EVENT_READ
+from threading import Thread, Lock
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from collections import deque
+from importlib import import_module
+from traceback import format_exc, print_exc
+from itertools import islice
+from time import monotonic, perf_counter
+
+ROUND_ROBIN = "round-robin"
+LEAST_LOADED = "least-loaded"
+WORK_STEALING = "work-stealing"
+
+jobs_done = metrics.counter("pool.jobs")
+calls_done = metrics.counter("pool.calls")
+job_time = metrics.histogram("pool.job_busy")
+
+def resolve(reference):
+    """
+    Resolves "module:qualname" references to the callable they name
+    """
+    if not isinstance(reference, str):
+        return reference
+
+    module_name, _, qualname = reference.partition(":")
+    target = import_module(module_name)
+    for name in qualname.split("."):
+        target = getattr(target, name)
+
+    return target
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if len(chunk) == 0:
+            return
+
+        yield chunk
+
+class WorkerError(RuntimeError):
+    pass
+
+class Pool:
+    def __init__(
+        self,
+        workers=None,
+        prefetch=2,
+        strategy=LEAST_LOADED,
+        pin=False
+    ):
+        if strategy not in (ROUND_ROBIN, LEAST_LOADED, WORK_STEALING):
+            raise ValueError(f"Unknown dispatch strategy {strategy}")
+
+        self._workers = workers or cores()
+        self._prefetch = prefetch
+        self._strategy = strategy
+        self._nursery = Nursery(None, [self._work], pin=pin)
+
+        self._pids = dict()
+        self._channels = dict()
+        self._outstanding = dict()
+        self._queue = deque()
+        self._local = dict()
+        self._turn = 0
+        self._stats = dict()
+        self._jobs = dict()
+        self._next_job = 0
+        self._lock = Lock()
+        self._reader = None
+        self._closed = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def workers(self):
+        return self._workers
+
+    def start(self):
+        pairs = [socketpair() for _ in range(self._workers)]
+        self._pairs = pairs
+        self._pids = self._nursery.fork(list(range(self._workers)))
+
+        for index, (parent_end, child_end) in enumerate(pairs):
+            child_end.close()
+            self._channels[index] = Channel(parent_end)
+            self._outstanding[index] = list()
+            self._local[index] = deque()
+
+            stats = self._stats[index] = dict()
+            stats["started"] = monotonic()
+            stats["jobs"] = 0
+            stats["calls"] = 0
+            stats["busy"] = 0.0
+
+        del self._pairs
+        self._reader = Thread(target=self._read, daemon=True)
+        self._reader.start()
+        return self
+
+    def _work(self, index, state, pid, ppid):
+        # Never unwind into the caller's stack, its finally blocks and atexit
+        # hooks belong to the parent
+        code = 0
+        try:
+            self._serve(index)
+
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+
+        except BaseException:
+            print_exc()
+            code = 1
+
+        child_exit(code)
+
+    def _serve(self, index):
+        for i, (parent_end, child_end) in enumerate(self._pairs):
+            parent_end.close()
+            if i != index:
+                child_end.close()
+
+        channel = Channel(self._pairs[index][1])
+        while True:
+            try:
+                job = channel.recv()
+
+            except EOFError:
+                break
+
+            if job is None:
+                break
+
+            job_id, reference, calls = job
+            began = perf_counter()
+            outcomes = list()
+            try:
+                function = resolve(reference)
+
+            except Exception as e:
+                outcomes = [(False, WorkerError(format_exc()))] * len(calls)
+                function = None
+
+            if function is not None:
+                for args, kwargs in calls:
+                    try:
+                        outcomes.append((True, function(*args, **kwargs)))
+
+                    except Exception as e:
+                        outcomes.append((False, e))
+
+            busy = perf_counter() - began
+            try:
+                channel.send((job_id, outcomes, busy))
+
+            except Exception:
+                # Results or exceptions that cannot be pickled
+                error = WorkerError(format_exc())
+                channel.send((job_id, [(False, error)] * len(calls), busy))
+
+        channel.close()
+
+    def _read(self):
+        selector = DefaultSelector()
+        for index, channel in self._channels.items():
+            selector.register(channel, EVENT_READ, index)
+
+        while len(selector.get_map()) > 0:
+            for key, _ in selector.select():
+                index = key.data
+                try:
+                    messages = key.fileobj.read()
+
+                except (EOFError, OSError):
+                    selector.unregister(key.fileobj)
+                    self._lost(index)
+                    continue
+
+                for job_id, outcomes, busy in messages:
+                    self._finish(index, job_id, outcomes, busy)
+
+    def _finish(self, index, job_id, outcomes, busy):
+        with self._lock:
+            self._outstanding[index].remove(job_id)
+            stats = self._stats[index]
+            stats["jobs"] = stats["jobs"] + 1
+            stats["calls"] = stats["calls"] + len(outcomes)
+            stats["busy"] = stats["busy"] + busy
+            jobs_done.inc()
+            calls_done.inc(len(outcomes))
+            job_time.observe(busy)
+            future = self._jobs.pop(job_id)
+            failed = self._dispatch()
+
+        future.set_result(outcomes)
+        self._fail(failed)
+
+    def _lost(self, index):
+        with self._lock:
+            lost = self._outstanding.pop(index, list())
+            self._channels.pop(index, None)
+            futures = [self._jobs.pop(job_id) for job_id in lost]
+
+            # Jobs not yet sent to the lost worker go back to the shared queue
+            self._queue.extend(self._local.pop(index, deque()))
+
+            failed = list()
+            if len(self._channels) == 0:
+                futures.extend(self._jobs.pop(job[0]) for job in self._queue)
+                self._queue.clear()
+
+            else:
+                failed = self._dispatch()
+
+        error = WorkerError(f"Worker {index} exited")
+        self._fail([(future, error) for future in futures] + failed)
+
+    def _has_room(self, index):
+        return len(self._outstanding[index]) < self._prefetch
+
+    def _select(self):
+        if self._strategy == ROUND_ROBIN:
+            workers = sorted(self._outstanding)
+            for step in range(len(workers)):
+                index = workers[(self._turn + step) % len(workers)]
+                if self._has_room(index):
+                    self._turn = self._turn + step + 1
+                    return index
+
+            return None
+
+        # Least loaded worker with room for another job
+        index = min(self._outstanding, key=lambda i: len(self._outstanding[i]))
+        if not self._has_room(index):
+            return None
+
+        return index
+
+    def _take(self, index):
+        # Own jobs first, then shared ones, then the back of the longest queue
+        local = self._local[index]
+        if len(local) > 0:
+            return local.popleft()
+
+        if len(self._queue) > 0:
+            return self._queue.popleft()
+
+        victim = max(self._local, key=lambda i: len(self._local[i]))
+        if len(self._local[victim]) > 0:
+            return self._local[victim].pop()
+
+        return None
+
+    def _next(self):
+        if self._strategy != WORK_STEALING:
+            if len(self._queue) == 0:
+                return None, None
+
+            index = self._select()
+            if index is None:
+                return None, None
+
+            return index, self._queue.popleft()
+
+        for index in self._outstanding:
+            if self._has_room(index):
+                job = self._take(index)
+                if job is not None:
+                    return index, job
+
+        return None, None
+
+    def _dispatch(self):
+        failed = list()
+        while len(self._outstanding) > 0:
+            index, job = self._next()
+            if job is None:
+                break
+
+            try:
+                self._channels[index].send(job)
+
+            except Exception as e:
+                # Nothing reaches the worker when pickling the job fails
+                failed.append((self._jobs.pop(job[0]), e))
+                continue
+
+            self._outstanding[index].append(job[0])
+
+        return failed
+
+    def _fail(self, failed):
+        # Futures are settled outside the lock as callbacks may submit more
+        for future, error in failed:
+            future.set_exception(error)
+
+    def _enqueue(self, function, calls):
+        if self._closed:
+            raise RuntimeError("Pool is closed")
+
+        future = Future()
+        with self._lock:
+            job_id = self._next_job
+            self._next_job = job_id + 1
+            self._jobs[job_id] = future
+
+            job = job_id, function, calls
+            if self._strategy == WORK_STEALING and len(self._local) > 0:
+                workers = sorted(self._local)
+                self._turn = self._turn + 1
+                self._local[workers[self._turn % len(workers)]].append(job)
+
+            else:
+                self._queue.append(job)
+
+            failed = self._dispatch()
+
+        self._fail(failed)
+        return future
+
+    def stats(self):
+        now = monotonic()
+        with self._lock:
+            result = dict()
+            for index, stats in self._stats.items():
+                stats = dict(stats)
+                elapsed = now - stats.pop("started")
+                stats["utilization"] = stats["busy"] / elapsed if elapsed else 0
+                stats["outstanding"] = len(self._outstanding.get(index, list()))
+                stats["queued"] = len(self._local.get(index, list()))
+                stats["alive"] = index in self._channels
+                result[index] = stats
+
+            return result
+
+    def submit(self, function, *args, **kwargs):
+        future = Future()
+        def unwrap(job):
+            if job.exception() is not None:
+                future.set_exception(job.exception())
+                return
+
+            ok, value = job.result()[0]
+            if ok:
+                future.set_result(value)
+
+            else:
+                future.set_exception(value)
+
+        job = self._enqueue(function, [(args, kwargs)])
+        job.add_done_callback(unwrap)
+        return future
+
+    def _chunks(self, function, iterable, chunksize):
+        for chunk in chunked(iterable, chunksize):
+            calls = [(args, dict()) for args in chunk]
+            yield self._enqueue(function, calls)
+
+    def starmap(self, function, iterable, chunksize=1):
+        jobs = list(self._chunks(function, iterable, chunksize))
+        results = list()
+        for job in jobs:
+            for ok, value in job.result():
+                if not ok:
+                    raise value
+
+                results.append(value)
+
+        return results
+
+    def map(self, function, iterable, chunksize=1):
+        iterable = ((item,) for item in iterable)
+        return self.starmap(function, iterable, chunksize)
+
+    def imap_unordered(self, function, iterable, chunksize=1, window=None):
+        """
+        Yields results as they complete, taking from iterable only as jobs
+        finish so that at most window jobs are submitted at once
+        """
+        if window is None:
+            window = self._workers * self._prefetch * 2
+
+        iterable = ((item,) for item in iterable)
+        jobs = self._chunks(function, iterable, chunksize)
+        pending = set(islice(jobs, window))
+        while len(pending) > 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            # Refill before yielding, workers keep busy while results are used
+            pending.update(islice(jobs, len(done)))
+            for job in done:
+                for ok, value in job.result():
+                    if not ok:
+                        raise value
+
+                    yield value
+
+    def close(self):
+        if self._closed:
+            return
+
+        self._closed = True
+        with self._lock:
+            pending = list(self._jobs.values())
+
+        # Let queued work finish before asking workers to stop
+        wait(pending)
+        with self._lock:
+            channels = list(self._channels.values())
+
+        for channel in channels:
+            try:
+                channel.send(None)
+
+            except OSError:
+                continue
+
+        self._reader.join()
+        for pid in self._pids:
+            waitpid(pid, 0)
+
+    def terminate(self):
+        self._closed = True
+        self._nursery.reap(self._pids)
+        self._reader.join()
+        for pid in self._pids:
+            waitpid(pid, 0)
@@ -0,0 +1,416 @@
+from spirit.workers.pool import resolve
+from spirit.storage.memory import BaseModel
+from spirit.utils import eprint
+
+from typing import Optional
+from datetime import datetime, timedelta
+from heapq import heappush, heappop
+from threading import Thread, Lock, Event as Signal
+from random import uniform
+from pickle import dumps, loads
+from time import time
+
+ONCE = "once"
+INTERVAL = "interval"
+CRON = "cron"
+
+# Missed run policies
+SKIP = "skip"
+COALESCE = "coalesce"
+CATCH_UP = "catch-up"
+
+class Cron:
+    """
+    Standard five field cron expression: minute hour day month weekday
+    """
+    ranges = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"Invalid cron expression {expression}")
+
+        self.expression = expression
+        fields = [self._parse(p, *r) for p, r in zip(parts, self.ranges)]
+        self.minutes, self.hours, self.days, self.months, self.weekdays = fields
+
+        # Day of month and weekday match either when both are restricted
+        self._any_day = parts[2] == "*"
+        self._any_weekday = parts[4] == "*"
+
+    def __str__(self):
+        return self.expression
+
+    def _parse(self, part, low, high):
+        values = set()
+        for item in part.split(","):
+            step = 1
+            if "/" in item:
+                item, step = item.split("/")
+                step = int(step)
+
+            if item == "*":
+                start, stop = low, high
+
+            elif "-" in item:
+                start, stop = [int(v) for v in item.split("-")]
+
+            else:
+                start = int(item)
+                stop = high if step > 1 else start
+
+            if start < low or stop > high:
+                raise ValueError(f"Cron field {part} out of range")
+
+            values.update(range(start, stop + 1, step))
+
+        # Sunday can be written as 7
+        if high == 7 and 7 in values:
+            values.add(0)
+
+        return values
+
+    def _day_matches(self, when):
+        weekday = (when.weekday() + 1) % 7
+        in_days = when.day in self.days
+        in_weekdays = weekday in self.weekdays
+        if self._any_day or self._any_weekday:
+            return in_days and in_weekdays
+
+        return in_days or in_weekdays
+
+    def next(self, after):
+        when = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = when + timedelta(days=366 * 5)
+        while when < limit:
+            if when.month not in self.months:
+                month = when.month % 12 + 1
+                year = when.year + (1 if month == 1 else 0)
+                when = when.replace(year=year, month=month, day=1, hour=0)
+                when = when.replace(minute=0)
+                continue
+
+            if not self._day_matches(when):
+                when = when.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+
+            if when.hour not in self.hours:
+                when = when.replace(minute=0) + timedelta(hours=1)
+                continue
+
+            if when.minute not in self.minutes:
+                when = when + timedelta(minutes=1)
+                continue
+
+            return when
+
+        raise ValueError(f"Cron expression {self} never matches")
+
+class Job:
+    def __init__(
+        self,
+        job_id,
+        target,
+        args=tuple(),
+        kwargs=dict(),
+        kind=ONCE,
+        interval=None,
+        cron=None,
+        jitter=0,
+        missed=COALESCE,
+        next_run=None
+    ):
+        self.id = job_id
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs
+        self.kind = kind
+        self.interval = interval
+        self.cron = Cron(cron) if isinstance(cron, str) else cron
+        self.jitter = jitter
+        self.missed = missed
+        self.next_run = next_run
+        self.planned = next_run
+        self.version = 0
+        self.entry = None
+
+    def __repr__(self):
+        return f"Job({self.id}, {self.kind}, next_run={self.next_run})"
+
+    def following(self, after):
+        if self.kind == INTERVAL:
+            return after + self.interval
+
+        if self.kind == CRON:
+            return self.cron.next(datetime.fromtimestamp(after)).timestamp()
+
+        return None
+
+def reference_of(target):
+    if isinstance(target, str):
+        return target
+
+    return f"{target.__module__}:{target.__qualname__}"
+
+class Scheduler:
+    """
+    Runs jobs once, on an interval or on a cron schedule
+
+    Pending jobs sit in a heap keyed on their next run, with cancelled or
+    rescheduled entries dropped lazily when they reach the top. Due jobs are
+    submitted to a Pool when one is given and run inline otherwise.
+    """
+    def __init__(self, pool=None, memory=None, tolerance=1):
+        self._pool = pool
+        self._tolerance = tolerance
+        self._heap = list()
+        self._jobs = dict()
+        self._seq = 0
+        self._next_id = 0
+        self._lock = Lock()
+        self._wake = Signal()
+        self._thread = None
+        self._running = False
+
+        self._factory = None
+        if memory is not None:
+            self._factory = memory.meditate(ScheduledJob)
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def _push(self, job):
+        self._seq = self._seq + 1
+        heappush(self._heap, (job.next_run, self._seq, job.id, job.version))
+
+    def _plan(self, job, when):
+        # Jitter never feeds back into the following runs
+        job.planned = when
+        job.next_run = when
+        if job.jitter:
+            job.next_run = when + uniform(0, job.jitter)
+
+    def add(self, job):
+        with self._lock:
+            self._persist(job)
+            if job.id is None and job.entry is not None:
+                job.id = job.entry._id
+
+            elif job.id is None:
+                job.id = self._next_id + 1
+
+            self._next_id = max(self._next_id, job.id)
+            self._jobs[job.id] = job
+            self._push(job)
+
+        self._wake.set()
+        return job.id
+
+    def at(self, when, target, *args, **kwargs):
+        if isinstance(when, datetime):
+            when = when.timestamp()
+
+        job = Job(None, target, args, kwargs, kind=ONCE, next_run=when)
+        return self.add(job)
+
+    def after(self, seconds, target, *args, **kwargs):
+        return self.at(time() + seconds, target, *args, **kwargs)
+
+    def every(
+        self,
+        seconds,
+        target,
+        *args,
+        jitter=0,
+        missed=COALESCE,
+        **kwargs
+    ):
+        job = Job(None, target, args, kwargs, INTERVAL, interval=seconds)
+        job.jitter = jitter
+        job.missed = missed
+        self._plan(job, time() + seconds)
+        return self.add(job)
+
+    def cron(
+        self,
+        expression,
+        target,
+        *args,
+        jitter=0,
+        missed=COALESCE,
+        **kwargs
+    ):
+        job = Job(None, target, args, kwargs, CRON, cron=expression)
+        job.jitter = jitter
+        job.missed = missed
+        self._plan(job, job.following(time()))
+        return self.add(job)
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+            if job is None:
+                return False
+
+            # The heap entry is skipped once it surfaces
+            job.version = job.version + 1
+            self._forget(job)
+            return True
+
+    def next_run(self):
+        with self._lock:
+            self._prune()
+            if len(self._heap) == 0:
+                return None
+
+            return self._heap[0][0]
+
+    def _prune(self):
+        while len(self._heap) > 0:
+            _, _, job_id, version = self._heap[0]
+            job = self._jobs.get(job_id)
+            if job is not None and job.version == version:
+                return
+
+            heappop(self._heap)
+
+    def _due(self, now):
+        due = list()
+        with self._lock:
+            while True:
+                self._prune()
+                if len(self._heap) == 0 or self._heap[0][0] > now:
+                    break
+
+                _, _, job_id, _ = heappop(self._heap)
+                job = self._jobs[job_id]
+                late = now - job.next_run > self._tolerance
+                if not late or job.missed != SKIP:
+                    due.append(job)
+
+                if job.kind == ONCE:
+                    del self._jobs[job_id]
+                    self._forget(job)
+                    continue
+
+                # Catching up walks every missed run, one per heap pass, while
+                # skipping and coalescing continue from now
+                base = job.planned
+                if late and job.missed != CATCH_UP:
+                    base = now
+
+                self._plan(job, job.following(base))
+                job.version = job.version + 1
+                self._push(job)
+                self._persist(job)
+
+        return due
+
+    def dispatch(self, job):
+        if self._pool is None:
+            try:
+                return resolve(job.target)(*job.args, **job.kwargs)
+
+            except Exception as e:
+                eprint(f"Job {job.id} failed: {e!r}")
+                return None
+
+        future = self._pool.submit(job.target, *job.args, **job.kwargs)
+        def report(future):
+            if future.exception() is not None:
+                eprint(f"Job {job.id} failed: {future.exception()!r}")
+
+        future.add_done_callback(report)
+        return future
+
+    def run_pending(self, now=None):
+        if now is None:
+            now = time()
+
+        due = self._due(now)
+        return [self.dispatch(job) for job in due]
+
+    def run(self):
+        self._running = True
+        while self._running:
+            self.run_pending()
+            following = self.next_run()
+            timeout = None
+            if following is not None:
+                timeout = max(following - time(), 0)
+
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def start(self):
+        self._thread = Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _persist(self, job):
+        if self._factory is None:
+            return
+
+        fields = dict()
+        fields["next_run"] = job.next_run
+        if job.entry is not None:
+            job.entry = job.entry.alter(**fields)
+            return
+
+        fields["target"] = reference_of(job.target)
+        fields["payload"] = dumps((job.args, job.kwargs))
+        fields["kind"] = job.kind
+        fields["interval"] = job.interval
+        fields["cron"] = None if job.cron is None else str(job.cron)
+        fields["jitter"] = job.jitter
+        fields["missed"] = job.missed
+        entry_id = self._factory.remember(**fields)
+        job.entry = self._factory.recall(entry_id)
+
+    def _forget(self, job):
+        if job.entry is not None:
+            job.entry.forget()
+            job.entry = None
+
+    def load(self):
+        """
+        Restores the schedule persisted in memory, returns the job count
+        """
+        if self._factory is None:
+            return 0
+
+        entries = self._factory.recite()
+        with self._lock:
+            for entry_id, entry in entries.items():
+                args, kwargs = loads(entry.payload)
+                job = Job(entry_id, entry.target, args, kwargs, entry.kind)
+                job.interval = entry.interval
+                job.cron = None if entry.cron is None else Cron(entry.cron)
+                job.jitter = entry.jitter
+                job.missed = entry.missed
+                job.next_run = entry.next_run
+                job.planned = entry.next_run
+                job.entry = entry
+
+                self._next_id = max(self._next_id, entry_id)
+                self._jobs[job.id] = job
+                self._push(job)
+
+        self._wake.set()
+        return len(entries)
+
+class ScheduledJob(BaseModel):
+    target: str
+    payload: bytes
+    kind: str
+    interval: Optional[float]
+    cron: Optional[str]
+    jitter: float
+    missed: str
+    next_run: float
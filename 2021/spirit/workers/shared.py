@@ -0,0 +1,146 @@
+from mmap import mmap
+from array import array
+from multiprocessing import shared_memory, resource_tracker
+
+class SharedArray:
+    """
+    Typed array living in shared memory, writes are visible to every process
+
+    Anonymous arrays must be created before forking, named arrays can also be
+    attached to (or pickled into) processes that already exist.
+    """
+    def __init__(self, typecode, length, name=None, create=True):
+        self.typecode = typecode
+        self.length = length
+        self.itemsize = array(typecode).itemsize
+
+        size = max(self.itemsize * length, 1)
+        self._shm = None
+        if name is None:
+            self._buffer = mmap(-1, size)
+
+        else:
+            self._shm = shared_memory.SharedMemory(name, create, size)
+            self._buffer = self._shm.buf
+            if not create:
+                # Only the creator should unlink the segment
+                resource_tracker.unregister(self._shm._name, "shared_memory")
+
+        self._raw = memoryview(self._buffer)
+        self._view = self._raw.cast(typecode)
+        self._closed = False
+
+    def __del__(self):
+        try:
+            self.close()
+
+        except BufferError:
+            # Slices handed out are still alive, let the mapping go with them
+            pass
+
+    @classmethod
+    def from_sequence(cls, typecode, values, name=None):
+        values = array(typecode, values)
+        shared = cls(typecode, len(values), name=name)
+        shared.view[:] = memoryview(values)
+        return shared
+
+    def __reduce__(self):
+        if self._shm is None:
+            raise TypeError("Anonymous SharedArray is only shared by fork")
+
+        return SharedArray, (self.typecode, self.length, self.name, False)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, key):
+        return self._view[key]
+
+    def __setitem__(self, key, value):
+        self._view[key] = value
+
+    def __iter__(self):
+        return iter(self._view)
+
+    @property
+    def name(self):
+        return None if self._shm is None else self._shm.name
+
+    @property
+    def view(self):
+        return self._view
+
+    def tolist(self):
+        return self._view.tolist()
+
+    def toarray(self):
+        return array(self.typecode, self._view)
+
+    def bounds(self, parts):
+        step, extra = divmod(self.length, parts)
+        start = 0
+        for part in range(parts):
+            stop = start + step + (1 if part < extra else 0)
+            yield start, stop
+            start = stop
+
+    def partition(self, parts):
+        return [self._view[start:stop] for start, stop in self.bounds(parts)]
+
+    def close(self):
+        # Also reached from __del__ when __init__ did not finish
+        if getattr(self, "_closed", True):
+            return
+
+        self._view.release()
+        self._raw.release()
+        self._closed = True
+        if self._shm is None:
+            self._buffer.close()
+
+        else:
+            self._shm.close()
+
+    def unlink(self):
+        if self._shm is not None:
+            self._shm.unlink()
+
+class SharedState:
+    """
+    Named shared arrays handed to Nursery children as their states
+    """
+    def __init__(self, **arrays):
+        self._arrays = arrays
+
+    def __getitem__(self, name):
+        return self._arrays[name]
+
+    def __iter__(self):
+        return iter(self._arrays)
+
+    def split(self, parts, names=None):
+        """
+        Creates one state per child, arrays listed in names are partitioned
+        into contiguous views while the rest are shared whole
+        """
+        if names is None:
+            names = list(self._arrays.keys())
+
+        states = [dict() for _ in range(parts)]
+        for name, shared in self._arrays.items():
+            if name in names:
+                bounds = list(shared.bounds(parts))
+                for state, (start, stop) in zip(states, bounds):
+                    state[name] = shared.view[start:stop]
+                    state[f"{name}_offset"] = start
+
+            else:
+                for state in states:
+                    state[name] = shared
+
+        return states
+
+    def close(self):
+        for shared in self._arrays.values():
+            shared.close()
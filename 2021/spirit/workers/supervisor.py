@@ -0,0 +1,306 @@
+from spirit.workers.nursery import Nursery, forks
+from spirit.utils.metrics import metrics
+from spirit.utils import child_exit
+
+from os import fork, pipe, read, write, close, set_blocking, kill, waitpid
+from os import getpid
+from os import WNOHANG, WIFEXITED, WEXITSTATUS
+from signal import signal, SIGINT, SIGTERM, SIGUSR1, SIGKILL, SIG_DFL
+from select import select
+from time import monotonic
+from collections import deque
+from traceback import print_exc
+
+PERMANENT = "permanent"
+TRANSIENT = "transient"
+TEMPORARY = "temporary"
+
+_heartbeat_fd = None
+
+restarts = metrics.counter("nursery.restarts")
+hangs = metrics.counter("nursery.hangs")
+
+def heartbeat():
+    """
+    Tells the supervisor the calling worker is still making progress
+    """
+    if _heartbeat_fd is None:
+        return False
+
+    try:
+        write(_heartbeat_fd, b".")
+
+    except BlockingIOError:
+        # The pipe is full, the supervisor has plenty of beats to read
+        pass
+
+    return True
+
+class Supervisor(Nursery):
+    def __init__(
+        self,
+        parent_callback,
+        child_callbacks,
+        bus=None,
+        restart=PERMANENT,
+        backoff=0.1,
+        max_backoff=30,
+        intensity=10,
+        period=60,
+        heartbeat=None,
+        grace=5,
+        pin=False
+    ):
+        super().__init__(parent_callback, child_callbacks, bus=bus, pin=pin)
+        self._restart = restart
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._intensity = intensity
+        self._period = period
+        self._heartbeat = heartbeat
+        self._grace = grace
+
+        self._workers = dict()
+        self._beats = dict()
+        self._failures = dict()
+        self._restarts = deque()
+        self._scheduled = dict()
+        self._stopping = False
+        self._reload = False
+
+    def _policy(self, index):
+        if isinstance(self._restart, str):
+            return self._restart
+
+        return self._restart[index]
+
+    def _start(self, states, index):
+        # A restarted worker needs a new bus pair, its old one died with it
+        if self._bus is not None:
+            self._bus.reopen(index)
+
+        reader, writer = pipe()
+        fpid = fork()
+        if fpid == 0:
+            global _heartbeat_fd
+            close(reader)
+            set_blocking(writer, False)
+            _heartbeat_fd = writer
+
+            for signum in (SIGINT, SIGTERM, SIGUSR1):
+                signal(signum, SIG_DFL)
+
+            # Never unwind into the supervisor loop from a child
+            code = 0
+            try:
+                self.handle_child(states[index], index)
+
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 1
+
+            except BaseException:
+                print_exc()
+                code = 1
+
+            child_exit(code)
+
+        close(writer)
+        forks.inc()
+        if self._bus is not None and self._is_parent:
+            self._bus.parent()
+
+        now = monotonic()
+        self._workers[fpid] = index, reader, now
+        self._beats[reader] = fpid, now
+        return fpid
+
+    def fork(self, states):
+        pids = dict()
+        for i in range(len(states)):
+            pids[self._start(states, i)] = i
+
+        return pids
+
+    def handle_parent(self, states, pids):
+        signal(SIGINT, lambda signum, frame: self.stop())
+        signal(SIGTERM, lambda signum, frame: self.stop())
+        signal(SIGUSR1, lambda signum, frame: self.reload())
+
+        if self._bus is not None:
+            self._bus.parent()
+
+        pid = getpid()
+        self._is_parent = True
+        self._is_child = False
+        self._root = self._parent_callback(self, states, pid, pids)
+
+        self.supervise(states)
+        return states
+
+    def stop(self):
+        self._stopping = True
+
+    def reload(self):
+        self._reload = True
+
+    def _timeout(self, now):
+        deadlines = [when for when in self._scheduled.values()]
+        if self._heartbeat is not None:
+            beats = [beat for _, beat in self._beats.values()]
+            deadlines.extend(beat + self._heartbeat for beat in beats)
+
+        if len(deadlines) == 0:
+            return 0.5
+
+        return min(max(min(deadlines) - now, 0), 0.5)
+
+    def _listen(self, timeout):
+        readers = list(self._beats.keys())
+        try:
+            readable, _, _ = select(readers, [], [], timeout)
+
+        except InterruptedError:
+            return
+
+        now = monotonic()
+        for reader in readable:
+            try:
+                data = read(reader, 4096)
+
+            except OSError:
+                data = b""
+
+            fpid, _ = self._beats[reader]
+            if len(data) == 0:
+                # Worker closed its end, reaping takes care of the rest
+                self._beats.pop(reader)
+                close(reader)
+                continue
+
+            self._beats[reader] = fpid, now
+
+    def _check_hangs(self, now):
+        if self._heartbeat is None:
+            return
+
+        for reader, (fpid, beat) in list(self._beats.items()):
+            if now - beat > self._heartbeat:
+                index = self._workers[fpid][0]
+                print(f"Worker {index+1} missed its heartbeat, killing")
+                self._beats[reader] = fpid, now
+                hangs.inc()
+                kill(fpid, SIGKILL)
+
+    def _reap(self, now, restart=True):
+        while len(self._workers) > 0:
+            try:
+                fpid, status = waitpid(-1, WNOHANG)
+
+            except ChildProcessError:
+                return
+
+            if fpid == 0:
+                return
+
+            worker = self._workers.pop(fpid, None)
+            if worker is None:
+                continue
+
+            index, reader, started = worker
+            if self._beats.pop(reader, None) is not None:
+                close(reader)
+
+            normal = WIFEXITED(status) and WEXITSTATUS(status) == 0
+            outcome = "closed" if normal else f"failed ({status})"
+            print(f"Worker {index+1} of {len(self._child_callbacks)} {outcome}")
+            if restart:
+                self._plan(index, normal, now - started, now)
+
+    def _plan(self, index, normal, lifetime, now):
+        policy = self._policy(index)
+        if policy == TEMPORARY:
+            return
+
+        if policy == TRANSIENT and normal:
+            return
+
+        # Restart intensity is measured over a sliding window
+        self._restarts.append(now)
+        while self._restarts and now - self._restarts[0] > self._period:
+            self._restarts.popleft()
+
+        if len(self._restarts) > self._intensity:
+            print("Restart intensity exceeded, shutting down")
+            self._stopping = True
+            return
+
+        failures = self._failures.get(index, 0)
+        if lifetime > self._max_backoff:
+            failures = 0
+
+        delay = min(self._backoff * (2 ** failures), self._max_backoff)
+        self._failures[index] = failures + 1
+        self._scheduled[index] = now + delay
+
+    def _restart_due(self, states, now):
+        for index, when in list(self._scheduled.items()):
+            if when <= now:
+                del self._scheduled[index]
+                self._start(states, index)
+                restarts.inc()
+
+    def _restart_all(self):
+        self._reload = False
+        running = dict(self._workers)
+        self.shutdown()
+        now = monotonic()
+        for fpid, (index, _, _) in running.items():
+            self._scheduled[index] = now
+
+    def shutdown(self):
+        """
+        Asks workers to terminate, killing those still alive after grace
+        """
+        for fpid in list(self._workers):
+            try:
+                kill(fpid, SIGTERM)
+
+            except ProcessLookupError:
+                continue
+
+        deadline = monotonic() + self._grace
+        while len(self._workers) > 0 and monotonic() < deadline:
+            self._listen(0.05)
+            self._reap(monotonic(), restart=False)
+
+        for fpid in list(self._workers):
+            try:
+                kill(fpid, SIGKILL)
+
+            except ProcessLookupError:
+                continue
+
+        while len(self._workers) > 0:
+            fpid, status = waitpid(-1, 0)
+            worker = self._workers.pop(fpid, None)
+            if worker is not None and self._beats.pop(worker[1], None):
+                close(worker[1])
+
+    def supervise(self, states):
+        while not self._stopping:
+            if len(self._workers) == 0 and len(self._scheduled) == 0:
+                break
+
+            now = monotonic()
+            self._listen(self._timeout(now))
+
+            now = monotonic()
+            self._reap(now)
+            self._check_hangs(now)
+            self._restart_due(states, now)
+
+            if self._reload:
+                self._restart_all()
+
+        self._scheduled.clear()
+        self.shutdown()
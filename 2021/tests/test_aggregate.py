@@ -0,0 +1,61 @@
+from spirit.storage import Memory, BaseModel
+
+from unittest import TestCase, main
+from typing import Optional
+
+class Sale(BaseModel):
+    region: str
+    product: str
+    amount: int
+    discount: Optional[float] = None
+
+class AggregateTest(TestCase):
+    def setUp(self):
+        self.sales = Memory(":memory:").meditate(Sale)
+        rows = [
+            ("north", "a", 10, None),
+            ("north", "b", 20, 0.5),
+            ("south", "a", 30, None),
+            ("south", "a", 40, 0.25)
+        ]
+        self.sales.ingest(
+            dict(region=r, product=p, amount=a, discount=d)
+            for r, p, a, d in rows
+        )
+
+    def test_aggregates_respect_filters(self):
+        sales = self.sales
+        self.assertEqual(sales.count(), 4)
+        self.assertEqual(sales.count(dict(region="north")), 2)
+        self.assertEqual(sales.count(field="discount"), 2)
+        self.assertEqual(sales.count(field="product", distinct=True), 2)
+        self.assertEqual(sales.sum("amount", dict(product="a")), 80)
+        self.assertEqual(sales.min("amount"), 10)
+        self.assertEqual(sales.max("amount", dict(region="north")), 20)
+        self.assertEqual(sales.avg("amount"), 25)
+        self.assertTrue(sales.exists(dict(region="south", product="a")))
+        self.assertFalse(sales.exists(dict(region="east")))
+
+    def test_empty_matches(self):
+        self.assertEqual(self.sales.count(dict(region="east")), 0)
+        self.assertIsNone(self.sales.sum("amount", dict(region="east")))
+
+    def test_group_by(self):
+        sales = self.sales
+        self.assertEqual(sales.group_by("region"), dict(north=2, south=2))
+        totals = sales.group_by(["region", "product"], "sum", "amount")
+        expected = {("north", "a"): 10, ("north", "b"): 20, ("south", "a"): 70}
+        self.assertEqual(totals, expected)
+
+    def test_unknown_names_are_rejected(self):
+        with self.assertRaises(ValueError):
+            self.sales.sum("amount; DROP TABLE Sale")
+
+        with self.assertRaises(ValueError):
+            self.sales.count(dict(nothing=1))
+
+        with self.assertRaises(ValueError):
+            self.sales.group_by("region", "median", "amount")
+
+if __name__ == "__main__":
+    main()
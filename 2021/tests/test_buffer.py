@@ -0,0 +1,99 @@
+from spirit.storage import Memory
+from spirit.utils import child_exit
+
+from unittest import TestCase, main
+from tempfile import TemporaryDirectory
+from pathlib import Path
+from os import fork, waitpid, _exit
+
+from main import Author
+
+class WriteBehindTest(TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = Path(self.directory.name) / "buffer.db"
+        self.memory = Memory(self.path)
+        options = dict(size=100, interval=60)
+        self.authors = self.memory.meditate(Author, write_behind=options)
+        self.buffer = self.memory._buffers["author"]
+
+    def tearDown(self):
+        self.buffer.close()
+        self.directory.cleanup()
+
+    def names(self):
+        # Straight from the table, factories would flush the queue first
+        rows = self.memory._db.select("author", ["name"], default=list())
+        return sorted(row[0] for row in rows)
+
+    def test_writes_are_read_through_the_queue(self):
+        future = self.authors.remember(name="a")
+        self.assertFalse(future.done())
+        self.assertEqual(self.authors.recall(future).name, "a")
+        self.assertEqual(len(self.buffer), 1)
+
+        self.authors.flush()
+        author_id = future.result(timeout=0)
+        self.assertEqual(self.authors.recall(author_id).name, "a")
+
+        renamed = self.authors.alter_many(author_id, name="b")
+        self.assertEqual(self.authors.recall(author_id).name, "b")
+        self.assertEqual(self.names(), ["a"])
+        self.authors.flush()
+        self.assertEqual(self.names(), ["b"])
+        self.assertEqual(renamed.result(timeout=0), 1)
+
+    def test_full_batches_are_written_in_the_background(self):
+        futures = [self.authors.remember(name=str(i)) for i in range(100)]
+        ids = [future.result(timeout=5) for future in futures]
+        self.assertEqual(len(set(ids)), 100)
+
+    def test_failing_writes_only_fail_their_future(self):
+        good = self.authors.remember(name="a")
+        bad = self.buffer.enqueue("insert", values=dict(missing=1))
+        self.buffer.flush()
+        self.assertIsInstance(good.result(timeout=0), int)
+        with self.assertRaises(Exception):
+            bad.result(timeout=0)
+
+    def test_cancelled_writes_are_dropped(self):
+        cancelled = self.authors.remember(name="cancelled")
+        self.assertTrue(cancelled.cancel())
+        first = [self.authors.remember(name=str(i)) for i in range(99)]
+        first[-1].result(timeout=5)
+
+        # The background thread lives on to write the next batch
+        later = [self.authors.remember(name=str(i)) for i in range(100)]
+        self.assertIsInstance(later[-1].result(timeout=5), int)
+        self.assertNotIn("cancelled", self.names())
+
+    def test_closed_buffers_refuse_writes(self):
+        self.authors.remember(name="a")
+        self.buffer.close()
+        self.assertEqual(self.names(), ["a"])
+        with self.assertRaises(RuntimeError):
+            self.authors.remember(name="b")
+
+    def test_children_do_not_commit_the_parents_writes(self):
+        future = self.authors.remember(name="parent")
+        pid = fork()
+        if pid == 0:
+            code = 1
+            try:
+                empty = len(self.buffer) == 0 and future.cancelled()
+                self.authors.remember(name="child")
+                code = 0 if empty else 2
+
+            finally:
+                child_exit(code)
+                _exit(1)
+
+        _, status = waitpid(pid, 0)
+        self.assertEqual(status >> 8, 0)
+        self.assertEqual(self.names(), ["child"])
+        self.buffer.flush()
+        self.assertEqual(self.names(), ["child", "parent"])
+        self.assertFalse(future.cancelled())
+
+if __name__ == "__main__":
+    main()
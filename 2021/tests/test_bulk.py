@@ -0,0 +1,94 @@
+from spirit.storage import Memory, BaseModel, Column, read_csv, read_ndjson
+
+from unittest import TestCase, main
+from typing import Optional
+from tempfile import TemporaryDirectory
+from pathlib import Path
+from io import StringIO
+from array import array
+
+from main import Author, Note
+
+class Row(BaseModel):
+    count: int
+    ratio: Optional[float]
+    label: str
+    raw: Optional[bytes]
+
+CSV = "count,ratio,label,raw\n1,0.5,a,ff00\n2,,b,\n"
+
+class ColumnTest(TestCase):
+    def test_values_live_in_buffers(self):
+        column = Column("count", "integer")
+        column.extend((1, None, 3))
+        self.assertIsInstance(column.values, array)
+        self.assertEqual(column.tolist(), [1, None, 3])
+        self.assertEqual(column.data.tolist(), [1, 0, 3])
+
+        text = Column("label", "text")
+        text.extend(("ab", None, "é"))
+        self.assertEqual(text.tolist(), ["ab", None, "é"])
+        self.assertEqual(bytes(text.data), "abé".encode("utf-8"))
+
+    def test_integer_columns_fall_back_to_a_list(self):
+        column = Column("created", "integer")
+        column.extend((1, 2))
+        column.extend((3, 4.5, None))
+        self.assertIsInstance(column.values, list)
+        self.assertEqual(column.tolist(), [1, 2, 3, 4.5, None])
+
+class BulkTest(TestCase):
+    def setUp(self):
+        self.memory = Memory(":memory:")
+        self.rows = self.memory.meditate(Row)
+
+    def test_csv_and_ndjson_import_in_chunks(self):
+        entries = read_csv(StringIO(CSV), model=Row)
+        self.assertEqual(self.rows.ingest(entries, chunk=1), 2)
+        lines = '{"count": 3, "label": "c"}\n\n{"count": 4, "label": "d"}\n'
+        self.assertEqual(self.rows.ingest(read_ndjson(StringIO(lines))), 2)
+
+        columns = self.rows.export_columns()
+        self.assertEqual(columns["count"].tolist(), [1, 2, 3, 4])
+        self.assertEqual(columns["ratio"].tolist(), [0.5, None, None, None])
+        self.assertEqual(columns["raw"][0], b"\xff\x00")
+
+    def test_unknown_fields_fail_before_writing(self):
+        entries = [dict(count=1, label="a"), dict(count=2, label="b")]
+        with self.assertRaises(ValueError):
+            self.rows.ingest(entries, fields=["count", "label) --"], chunk=1)
+
+        with self.assertRaises(ValueError):
+            self.rows.ingest([dict(count=1, label="a", missing=1)] * 2)
+
+        self.assertEqual(self.rows.count(), 0)
+
+    def test_csv_paths_are_read(self):
+        with TemporaryDirectory() as directory:
+            path = Path(directory) / "rows.csv"
+            path.write_text(CSV)
+            labels = [row["label"] for row in read_csv(path)]
+
+        self.assertEqual(labels, ["a", "b"])
+
+    def test_chunks_do_not_block_writes(self):
+        self.rows.ingest(dict(count=i, label="x") for i in range(10))
+        chunks = self.rows.iter_columns(keys=["count"], chunk=4)
+        first = next(chunks)
+        self.rows.remember(count=10, ratio=None, label="y", raw=None)
+        counts = first["count"].tolist()
+        for columns in chunks:
+            counts.extend(columns["count"].tolist())
+
+        self.assertEqual(counts, list(range(11)))
+
+    def test_float_timestamps_in_int_columns_export(self):
+        self.memory.meditate(Author)
+        notes = self.memory.meditate(Note)
+        notes.remember(content="Hello")
+        columns = notes.export_columns(keys=["created", "content"])
+        self.assertIsInstance(columns["created"][0], float)
+        self.assertEqual(columns["content"].tolist(), ["Hello"])
+
+if __name__ == "__main__":
+    main()
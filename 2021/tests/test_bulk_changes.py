@@ -0,0 +1,55 @@
+from spirit.storage import Memory
+
+from unittest import TestCase, main
+
+from main import Author, Note
+
+class BulkChangeTest(TestCase):
+    def setUp(self):
+        memory = Memory(":memory:")
+        self.authors = memory.meditate(Author)
+        self.notes = memory.meditate(Note)
+        self.first = self.authors.recall(self.authors.remember(name="First"))
+        self.other = self.authors.recall(self.authors.remember(name="Other"))
+        for author in (self.first, self.first, self.other):
+            self.notes.remember(author=author, content="draft")
+
+    def contents(self):
+        return sorted(note.content for note in self.notes.recite().values())
+
+    def test_alter_many_reports_the_rows_changed(self):
+        where = dict(author_id=self.first._id)
+        self.assertEqual(self.notes.alter_many(where, content="done"), 2)
+        self.assertEqual(self.contents(), ["done", "done", "draft"])
+        ids = list(self.notes.recite().keys())
+        self.assertEqual(self.notes.alter_many(ids, content="x"), 3)
+        self.assertEqual(self.notes.alter_many(999, content="y"), 0)
+
+    def test_alter_stores_placeholders_through_their_reference(self):
+        note_id = self.notes.remember(content="orphan")
+        self.notes.alter_many(note_id, author=self.other)
+        note = self.notes.recall(note_id)
+        self.assertEqual(note.author_id, self.other._id)
+        self.assertEqual(note.author.name, "Other")
+
+        altered = note.alter(author=None)
+        self.assertIsNone(altered.author_id)
+        self.assertIsNone(self.notes.recall(note_id).author_id)
+
+    def test_forget_many_cascades(self):
+        self.assertEqual(self.authors.forget_many([self.first._id]), 1)
+        self.assertEqual(self.notes.count(), 1)
+        self.assertEqual(self.authors.forget_many(dict(name="Nobody")), 0)
+        self.assertTrue(self.other.forget())
+        self.assertEqual(self.notes.count(), 0)
+        self.assertFalse(self.other.forget())
+
+    def test_unfiltered_deletes_are_refused(self):
+        with self.assertRaises(ValueError):
+            self.notes.forget_many(dict())
+
+        with self.assertRaises(ValueError):
+            self.notes.alter_many(dict(missing=1), content="x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+from spirit.events import Store, Bus
+from spirit.events.bus import Backlog
+from spirit.utils.metrics import metrics
+
+from unittest import TestCase, main
+from os import fork, waitpid, kill, WNOHANG, WIFEXITED, WEXITSTATUS, _exit
+from signal import SIGKILL
+from time import monotonic, sleep
+from traceback import print_exc
+
+def spawn(bus, index, work):
+    pid = fork()
+    if pid == 0:
+        code = 1
+        try:
+            bus.child(index)
+            code = 0 if work() else 2
+
+        except BaseException:
+            print_exc()
+
+        finally:
+            _exit(code)
+
+    return pid
+
+def wait(pid, timeout=20):
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        done, status = waitpid(pid, WNOHANG)
+        if done != 0:
+            return WEXITSTATUS(status) if WIFEXITED(status) else -1
+
+        sleep(0.01)
+
+    kill(pid, SIGKILL)
+    waitpid(pid, 0)
+    return None
+
+def receive(bus, store, count, timeout=10):
+    deadline = monotonic() + timeout
+    while len(list(store.events)) < count and monotonic() < deadline:
+        bus.pump(0.1)
+
+    return len(list(store.events)) == count
+
+class BusTest(TestCase):
+    def test_events_published_before_a_child_joins_are_held(self):
+        bus = Bus(2)
+
+        def producer():
+            store = Store(dict())
+            bus.join(store, publish=["ping"])
+            store.log_many([("ping", i) for i in range(100)])
+            return True
+
+        def consumer():
+            # Joins well after the producer is done
+            sleep(0.3)
+            store = Store(dict())
+            bus.join(store, subscribe=["ping"])
+            if not receive(bus, store, 100):
+                return False
+
+            return [e.data for e in store.events] == list(range(100))
+
+        pids = [spawn(bus, 0, producer), spawn(bus, 1, consumer)]
+        bus.parent()
+        self.assertEqual([wait(pid) for pid in pids], [0, 0])
+        bus.close()
+
+    def test_parent_publishes_through_the_hub(self):
+        bus = Bus(1)
+
+        def consumer():
+            store = Store(dict())
+            bus.join(store, subscribe=["a"], publish=["b"])
+            if not receive(bus, store, 3):
+                return False
+
+            store.log("b", "done")
+            return True
+
+        pid = spawn(bus, 0, consumer)
+        bus.parent()
+        store = Store(dict())
+        bus.join(store, publish=["a"], subscribe=["b"])
+        store.log_many([("a", 1), ("ignored", 2), ("a", 3), ("a", 4)])
+        deadline = monotonic() + 10
+        while len(list(store.events)) < 5 and monotonic() < deadline:
+            bus.pump(0.1)
+
+        self.assertEqual(wait(pid), 0)
+        self.assertEqual(list(store.events)[-1].data, "done")
+        bus.close()
+
+    def test_stalled_subscriber_does_not_block_the_others(self):
+        bus = Bus(3, limit=1 << 20)
+        count = 2000
+        payload = b"x" * 4096
+
+        def producer():
+            store = Store(dict())
+            bus.join(store, publish=["blob"])
+            for _ in range(count):
+                store.log("blob", payload)
+
+            return True
+
+        def stalled():
+            store = Store(dict())
+            bus.join(store, subscribe=["blob"])
+            sleep(30)
+            return True
+
+        def reader():
+            store = Store(dict())
+            bus.join(store, subscribe=["blob"])
+            return receive(bus, store, count)
+
+        before = metrics.snapshot()["counters"].get("bus.dropped", 0)
+        stuck = spawn(bus, 1, stalled)
+        pids = [spawn(bus, 0, producer), spawn(bus, 2, reader)]
+        bus.parent()
+        self.assertEqual([wait(pid) for pid in pids], [0, 0])
+
+        kill(stuck, SIGKILL)
+        waitpid(stuck, 0)
+        bus.close()
+        after = metrics.snapshot()["counters"].get("bus.dropped", 0)
+        self.assertGreater(after, before)
+
+    def test_wildcard_publishes_every_kind(self):
+        bus = Bus(1)
+
+        def producer():
+            store = Store(dict())
+            bus.join(store, publish=["*"])
+            store.log_many([("a", 1), ("b", 2)])
+            store.log("c", 3)
+            return True
+
+        pid = spawn(bus, 0, producer)
+        bus.parent()
+        store = Store(dict())
+        bus.join(store, subscribe=["a", "c"])
+        self.assertTrue(receive(bus, store, 2))
+        self.assertEqual(wait(pid), 0)
+        self.assertEqual([e.data for e in store.events], [1, 3])
+        bus.close()
+
+    def test_held_events_are_bounded_by_the_limit(self):
+        bus = Bus(2, limit=1 << 14)
+        payload = b"x" * 1024
+
+        def producer():
+            store = Store(dict())
+            bus.join(store, publish=["blob"])
+            for i in range(100):
+                store.log("blob", (i, payload))
+
+            return True
+
+        def consumer():
+            sleep(0.5)
+            store = Store(dict())
+            bus.join(store, subscribe=["blob"])
+            receive(bus, store, 100, timeout=1)
+            received = [e.data[0] for e in store.events]
+            return 0 < len(received) < 100 and received[-1] == 99
+
+        pids = [spawn(bus, 0, producer), spawn(bus, 1, consumer)]
+        bus.parent()
+        self.assertEqual([wait(pid) for pid in pids], [0, 0])
+        bus.close()
+
+class BacklogTest(TestCase):
+    def test_oldest_batches_are_dropped_past_the_limit(self):
+        before = metrics.snapshot()["counters"].get("bus.dropped", 0)
+        backlog = Backlog(limit=1 << 12)
+        for i in range(100):
+            backlog.put([i, b"x" * 256])
+
+        batches = backlog.take()
+        after = metrics.snapshot()["counters"].get("bus.dropped", 0)
+        self.assertLess(len(batches), 100)
+        self.assertEqual(batches[-1][0], 99)
+        self.assertEqual(after - before, 2 * (100 - len(batches)))
+        self.assertEqual(backlog.take(timeout=0.01), [])
+
+    def test_unbounded_backlogs_keep_everything(self):
+        backlog = Backlog()
+        for i in range(100):
+            backlog.put([i])
+
+        self.assertEqual(len(backlog.take()), 100)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+from spirit.storage import Memory, View, AggregateView, IndexView, Change
+from spirit.storage import change_kind
+from spirit.events import Store
+
+from unittest import TestCase, main
+from tempfile import TemporaryDirectory
+from threading import get_ident
+from pathlib import Path
+
+from main import Author, Note
+
+class Recorder:
+    def __init__(self, store, kinds):
+        self.changes = list()
+        self.threads = set()
+        store.subscribe(kinds, self, batch=True)
+
+    def __call__(self, events):
+        self.threads.add(get_ident())
+        for event in events:
+            if isinstance(event.data, Change):
+                self.changes.append((event.data.op, event.data.id))
+
+class CaptureTest(TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.memory = Memory(Path(self.directory.name) / "capture.db")
+        self.authors = self.memory.meditate(Author)
+        self.notes = self.memory.meditate(Note)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def pending(self):
+        return self.memory._db.read_one("SELECT COUNT(*) FROM _changes;")[0]
+
+    def test_changes_are_logged_per_table_and_store(self):
+        authors, notes = Store(dict()), Store(dict())
+        seen = Recorder(authors, [change_kind("author"), change_kind("note")])
+        noted = Recorder(notes, [change_kind("note")])
+        self.memory.capture(authors, Author)
+        self.memory.capture(notes, Note)
+
+        author = self.authors.recall(self.authors.remember(name="a"))
+        note_id = self.notes.remember(author=author, content="x")
+        self.notes.alter_many(note_id, content="x")
+        self.notes.alter_many(note_id, content="y")
+        self.authors.forget(author._id)
+
+        self.assertEqual(seen.changes, [("insert", 1), ("delete", 1)])
+        expected = [("insert", 1), ("update", 1), ("delete", 1)]
+        self.assertEqual(noted.changes, expected)
+        self.assertEqual(self.pending(), 0)
+
+    def test_changes_do_not_pile_up_without_listeners(self):
+        stop = self.memory.capture(Store(dict()), Author)
+        stop()
+        self.authors.remember(name="a")
+        self.assertEqual(self.pending(), 0)
+
+        other = Memory(Path(self.directory.name) / "capture.db")
+        other.meditate(Author).remember(name="b")
+        self.assertEqual(self.pending(), 0)
+
+    def test_other_threads_hand_changes_to_the_owner(self):
+        store = Store(dict())
+        recorder = Recorder(store, [change_kind("author")])
+        self.memory.capture(store, Author)
+        options = dict(interval=0.01)
+        authors = self.memory.meditate(Author, write_behind=options)
+        future = authors.remember(name="a")
+        future.result(timeout=5)
+        self.assertEqual(recorder.changes, [])
+
+        self.assertEqual(self.memory.deliver(), 1)
+        self.assertEqual(recorder.changes, [("insert", 1)])
+        authors.remember(name="b")
+        self.memory.flush()
+        self.assertEqual(len(recorder.changes), 2)
+        self.assertEqual(recorder.threads, {get_ident()})
+        self.memory._buffers["author"].close()
+
+class ViewTest(TestCase):
+    def setUp(self):
+        self.memory = Memory(":memory:")
+        self.authors = self.memory.meditate(Author)
+        self.notes = self.memory.meditate(Note)
+        self.store = Store(dict())
+        self.memory.capture(self.store, Author, Note)
+        self.first = self.authors.recall(self.authors.remember(name="a"))
+        self.second = self.authors.recall(self.authors.remember(name="b"))
+        self.notes.remember(author=self.first, content="x")
+
+    def test_views_follow_changes(self):
+        counts = AggregateView(self.notes, self.store, group="author_id")
+        index = IndexView(self.notes, self.store, "content")
+        self.assertEqual(counts[self.first._id], 1)
+
+        note_id = self.notes.remember(author=self.second, content="y")
+        self.notes.alter_many(note_id, content="x")
+        self.assertEqual(counts[self.second._id], 1)
+        self.assertEqual(len(index.get("x")), 2)
+        self.assertNotIn("y", index)
+
+        self.authors.forget(self.first._id)
+        self.assertIsNone(counts.get(self.first._id))
+        self.assertEqual(index.get("x"), {note_id})
+
+    def test_views_need_both_hooks(self):
+        with self.assertRaises(TypeError):
+            View(self.notes, self.store, ["content"])
+
+        class Partial(View):
+            def _insert(self, entry_id, values):
+                pass
+
+        with self.assertRaises(TypeError):
+            Partial(self.notes, self.store, ["content"])
+
+if __name__ == "__main__":
+    main()
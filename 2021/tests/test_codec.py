@@ -0,0 +1,94 @@
+from spirit.utils import Model
+from spirit.utils.codec import codec_for, encode, decode, encode_many
+from spirit.utils.codec import decode_many, ESCAPED
+from spirit.storage import Memory
+
+from unittest import TestCase, main
+from typing import Optional, List
+from pickle import dumps
+
+from main import Author, Note
+
+class Reading(Model):
+    sensor: str
+    value: float
+    count: int
+    ok: bool
+    note: Optional[str] = None
+    tags: Optional[List[str]] = None
+
+class Pair(Model):
+    left: Reading
+    right: Optional[Reading] = None
+
+def reading(**changes):
+    fields = dict(sensor="s1", value=1.5, count=-3, ok=True)
+    fields.update(changes)
+    return Reading(**fields)
+
+class CodecTest(TestCase):
+    def test_typed_records_round_trip_compactly(self):
+        record = reading(note="hi", tags=["a", "b"])
+        data = encode(record)
+        self.assertEqual(data[0] & ESCAPED, 0)
+        self.assertLess(len(data), len(dumps(record)))
+        self.assertEqual(decode(Reading, data), record)
+
+    def test_nested_models_are_inlined(self):
+        pair = Pair(left=reading(), right=reading(count=2 ** 40))
+        self.assertEqual(decode(Pair, encode(pair)), pair)
+        single = Pair(left=reading())
+        self.assertIsNone(decode(Pair, encode(single)).right)
+
+    def test_mismatched_values_fall_back_to_pickle(self):
+        records = [
+            reading(count=None),
+            reading(count=1.5),
+            reading(value=2),
+            reading(ok=1),
+            reading(count=2 ** 70),
+            reading(sensor=b"raw")
+        ]
+        for record in records:
+            data = encode(record)
+            self.assertEqual(data[0] & ESCAPED, ESCAPED)
+            restored = decode(Reading, data)
+            self.assertEqual(restored, record)
+            types = [type(value) for value in restored]
+            self.assertEqual(types, [type(value) for value in record])
+
+        pair = Pair(left=None)
+        self.assertEqual(decode(Pair, encode(pair)), pair)
+
+    def test_batches_mix_fast_and_escaped_records(self):
+        records = [reading(), reading(count=None), reading(note="x")]
+        data = encode_many(Reading, records)
+        self.assertEqual(decode_many(Reading, data), records)
+
+    def test_batches_check_the_layout(self):
+        data = encode_many(Reading, [reading()])
+        with self.assertRaises(ValueError):
+            decode_many(Pair, data)
+
+class DemoModelTest(TestCase):
+    def test_demo_models_round_trip(self):
+        memory = Memory(":memory:")
+        authors = memory.meditate(Author)
+        notes = memory.meditate(Note)
+        author = authors.recall(authors.remember(name="First Last"))
+        note = notes.recall(notes.remember(author=author, content="Hello"))
+        orphan = notes.recall(notes.remember(content="Nobody's"))
+
+        self.assertIsInstance(note.created, float)
+        self.assertIsNone(orphan.author_id)
+        for instance in (author, note, orphan):
+            codec = codec_for(type(instance))
+            self.assertEqual(codec.decode(codec.encode(instance)), instance)
+
+        fields = dict(content="x", author=None, author_id=None)
+        fields.update(created=1.5, updated=2.5, uuid=bytes(16))
+        bare = Note(**fields)
+        self.assertEqual(decode(Note, encode(bare)), bare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+from spirit.utils import Model
+
+from unittest import TestCase, main
+from typing import Optional
+from pickle import dumps, loads
+from subprocess import run
+from sys import executable
+
+class Point(Model):
+    y: int
+    x: int
+    label: Optional[str] = None
+
+class Point3(Point):
+    z: int = 0
+
+class DataTest(TestCase):
+    def test_defaults_go_last_and_fields_are_sorted(self):
+        self.assertEqual(Point._fields, ("x", "y", "label"))
+        point = Point(x=1, y=2)
+        self.assertEqual((point.x, point.y, point.label), (1, 2, None))
+        self.assertEqual(repr(point), "Point(x=1, y=2, label=None)")
+
+    def test_constructor_is_keyword_only(self):
+        with self.assertRaises(TypeError):
+            Point(1, 2)
+
+    def test_replace_and_pickle_round_trip(self):
+        point = Point(x=1, y=2)._replace(label="a")
+        self.assertEqual(loads(dumps(point)), point)
+        self.assertEqual(point._asdict(), dict(x=1, y=2, label="a"))
+        with self.assertRaises(ValueError):
+            point._replace(w=1)
+
+    def test_fields_are_inherited(self):
+        point = Point3(x=1, y=2, z=3)
+        self.assertEqual(Point3._fields, ("x", "y", "label", "z"))
+        self.assertIsInstance(point, Point)
+        self.assertEqual(point.z, 3)
+
+    def test_models_need_fields(self):
+        with self.assertRaises(ValueError):
+            class Empty(Model):
+                pass
+
+    def test_import_defers_heavy_modules(self):
+        script = "\n".join([
+            "from sys import modules",
+            "import spirit, spirit.utils, spirit.events, spirit.workers",
+            "heavy = ['sqlite3', 'logging.handlers', 'socket']",
+            "print(','.join(m for m in heavy if m in modules))"
+        ])
+        result = run([executable, "-c", script], capture_output=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), b"")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+from spirit.storage import Memory
+
+from unittest import TestCase, main
+from tempfile import TemporaryDirectory
+from threading import Thread
+from pathlib import Path
+from time import monotonic, sleep
+
+from main import Author, Note
+
+class InMemoryTest(TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = Path(self.directory.name) / "snapshot.db"
+        self.memory = Memory(":memory:")
+        self.authors = self.memory.meditate(Author)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_data_outlives_connections_and_threads(self):
+        self.authors.remember(name="main")
+        thread = Thread(target=self.authors.remember, kwargs=dict(name="t"))
+        thread.start()
+        thread.join()
+        self.assertEqual(self.authors.count(), 2)
+        self.assertTrue(self.memory._db.in_memory)
+
+    def test_databases_are_separate(self):
+        self.authors.remember(name="a")
+        other = Memory(":memory:").meditate(Author)
+        self.assertEqual(other.count(), 0)
+
+    def test_snapshot_then_warm(self):
+        self.memory.meditate(Note).remember(content="kept")
+        self.authors.remember(name="a")
+        self.assertEqual(self.memory.snapshot(self.path), self.path)
+        self.assertFalse(self.path.with_suffix(".partial").exists())
+
+        on_disk = Memory(self.path)
+        self.assertEqual(on_disk.meditate(Author).count(), 1)
+
+        warmed = Memory(":memory:").warm(self.path)
+        self.assertEqual(warmed.meditate(Note).count(), 1)
+        self.assertEqual(warmed.meditate(Author).count(), 1)
+
+    def test_periodic_snapshots(self):
+        self.authors.remember(name="a")
+        stop = self.memory.snapshot_every(0.01, self.path)
+        deadline = monotonic() + 5
+        while not self.path.exists() and monotonic() < deadline:
+            sleep(0.01)
+
+        stop()
+        self.assertEqual(Memory(self.path).meditate(Author).count(), 1)
+
+if __name__ == "__main__":
+    main()
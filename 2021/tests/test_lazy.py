@@ -0,0 +1,66 @@
+from spirit.storage import Memory, Lazy, resolved
+from spirit.utils.metrics import metrics
+
+from unittest import TestCase, main
+from pickle import dumps, loads
+
+from main import Author, Note
+
+def lazy_loads():
+    return metrics.snapshot()["counters"].get("memory.lazy_loads", 0)
+
+class LazyTest(TestCase):
+    def setUp(self):
+        memory = Memory(":memory:")
+        authors = self.authors = memory.meditate(Author)
+        notes = memory.meditate(Note)
+        self.names = ["First", "Second", "Third"]
+        for name in self.names:
+            author = authors.recall(authors.remember(name=name))
+            notes.remember(author=author, content=name.lower())
+
+        notes.remember(content="orphan")
+        self.notes = memory.meditate(Note, lazy=True)
+
+    def test_placeholders_load_on_first_use_in_one_query(self):
+        before = lazy_loads()
+        notes = list(self.notes.recite().values())
+        self.assertEqual(lazy_loads(), before)
+        self.assertIs(type(notes[0].author), Lazy)
+        self.assertIsInstance(notes[0].author, Author)
+        self.assertIsNone(notes[-1].author_id)
+
+        names = [note.author.name for note in notes[:-1]]
+        self.assertEqual(names, self.names)
+        self.assertEqual(lazy_loads(), before + 1)
+
+    def test_ids_are_known_without_loading(self):
+        before = lazy_loads()
+        note_id = list(self.notes.recite().keys())[0]
+        author = self.notes.recall(note_id).author
+        self.assertIsInstance(author._id, int)
+        self.assertEqual(lazy_loads(), before)
+
+    def test_proxies_compare_and_pickle_as_their_entry(self):
+        note = list(self.notes.recite().values())[0]
+        entry = resolved(note.author)
+        self.assertIs(type(entry), Author)
+        self.assertEqual(note.author, entry)
+        self.assertIs(type(loads(dumps(note.author))), Author)
+
+    def test_deleted_entries_resolve_to_none(self):
+        notes = list(self.notes.recite().values())
+        author = notes[0].author
+        self.authors.forget(author._id)
+
+        self.assertFalse(author)
+        self.assertIsNone(resolved(author))
+        self.assertEqual(author, None)
+        self.assertIsNone(loads(dumps(author)))
+        with self.assertRaises(LookupError):
+            author.name
+
+        self.assertEqual(notes[1].author.name, self.names[1])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+from spirit.utils.log import Logger, Shipper, Bounded, Batched, Deferred
+from spirit.utils.log import BATCH_BYTES
+from spirit.utils.log import pack_record, unpack_record
+from spirit.workers import Supervisor, TRANSIENT
+
+from unittest import TestCase, main
+from logging import Handler, makeLogRecord, ERROR
+from signal import signal, getsignal, SIGINT, SIGTERM, SIGUSR1
+from contextlib import redirect_stdout
+from pickle import loads
+from queue import Queue
+from io import StringIO
+from sys import exc_info
+from time import monotonic, sleep
+from uuid import uuid4
+
+class Capture(Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = list()
+
+    def emit(self, record):
+        self.records.append(record)
+        self.flush()
+
+    def wait(self, count, timeout=5):
+        deadline = monotonic() + timeout
+        while len(self.records) < count and monotonic() < deadline:
+            sleep(0.01)
+
+        return self.records
+
+class Counting(Deferred, Capture):
+    flushes = 0
+
+    def flush(self):
+        if not self.deferred:
+            self.flushes = self.flushes + 1
+
+class Socket:
+    def __init__(self):
+        self.sent = list()
+
+    def send(self, message):
+        self.sent.append(message)
+
+def failed_record(**extra):
+    try:
+        raise ValueError("boom")
+
+    except ValueError:
+        info = exc_info()
+
+    fields = dict(name="test", levelno=ERROR, msg="failed", exc_info=info)
+    fields.update(extra)
+    return makeLogRecord(fields)
+
+class PackTest(TestCase):
+    def test_round_trip_keeps_extra_fields_and_traceback(self):
+        record = failed_record(user="u1", callback=lambda: None)
+        restored = unpack_record(pack_record(record))
+        self.assertEqual(restored.getMessage(), "failed")
+        self.assertEqual(restored.user, "u1")
+        self.assertIsInstance(restored.callback, str)
+        self.assertIn("ValueError: boom", restored.exc_text)
+
+    def test_shipments_stay_under_the_datagram_size(self):
+        sock = Socket()
+        queue = Queue()
+        shipper = Shipper(sock, queue, Bounded(Queue()), 256, 0.01)
+        for _ in range(20):
+            queue.put(failed_record(detail="x" * 8000))
+
+        queue.put(makeLogRecord(dict(msg="y" * (1 << 18))))
+        shipper.stop()
+
+        records = list()
+        for message in sock.sent:
+            self.assertLessEqual(len(message), BATCH_BYTES)
+            records.extend(loads(message)[2])
+
+        self.assertEqual(len(records), 21)
+        self.assertTrue(records[-1][4].endswith("[truncated]"))
+
+class LoggerTest(TestCase):
+    def setUp(self):
+        settings = dict()
+        settings["disabled"] = ["stream", "file"]
+        self.logger = Logger(uuid4().hex, "debug", settings)
+        self.capture = Capture()
+        self.logger.listener.handlers = (self.capture,)
+        self.logger.start()
+
+    def test_args_are_interpolated_lazily(self):
+        self.logger.info("%s of %d", "one", 2, extra=dict(user="u1"))
+        self.logger.debug(lambda: "computed")
+        self.logger.stop()
+        records = self.capture.records
+        self.assertEqual(records[0].getMessage(), "one of 2")
+        self.assertEqual(records[0].user, "u1")
+        self.assertEqual(records[1].getMessage(), "computed")
+
+    def test_a_lone_dict_formats_by_name(self):
+        self.logger.warning("%(user)s logged in", dict(user="u2"))
+        self.logger.stop()
+        record = self.capture.records[0]
+        self.assertEqual(record.getMessage(), "u2 logged in")
+        self.assertFalse(hasattr(record, "user"))
+
+    def test_disabled_levels_never_build_messages(self):
+        self.logger.set_level("error")
+        self.logger.info(lambda: self.fail("Message was built"))
+        self.logger.stop()
+        self.assertEqual(self.capture.records, [])
+
+class BatchedTest(TestCase):
+    def test_batches_flush_once(self):
+        queue = Queue()
+        handler = Counting()
+        listener = Batched(queue, handler, batch=100)
+        for i in range(250):
+            queue.put(makeLogRecord(dict(msg=str(i))))
+
+        listener.start()
+        listener.stop()
+        self.assertEqual(len(handler.records), 250)
+        self.assertEqual(handler.flushes, 3)
+        self.assertFalse(handler.deferred)
+
+class MultiprocessTest(TestCase):
+    def setUp(self):
+        self.handlers = [(s, getsignal(s)) for s in (SIGINT, SIGTERM, SIGUSR1)]
+        settings = dict()
+        settings["disabled"] = ["stream", "file"]
+        settings["multiprocess"] = dict(interval=0.01)
+        self.logger = Logger(uuid4().hex, "debug", settings)
+        self.capture = Capture()
+        self.logger.listener.handlers = (self.capture,)
+        self.logger.start()
+
+    def tearDown(self):
+        self.logger.stop()
+        for signum, handler in self.handlers:
+            signal(signum, handler)
+
+    def test_supervised_children_flush_before_exiting(self):
+        logger = self.logger
+
+        def parent(nursery, states, pid, pids):
+            pass
+
+        def child(index, state, pid, ppid):
+            logger.info("from child", extra=dict(worker=index))
+
+        supervisor = Supervisor(parent, [child], restart=TRANSIENT)
+        with redirect_stdout(StringIO()):
+            supervisor.spawn([dict()])
+
+        records = self.capture.wait(1)
+        self.assertEqual([r.getMessage() for r in records], ["from child"])
+        self.assertEqual(records[0].worker, 0)
+
+    def test_corrupt_datagrams_are_counted_as_dropped(self):
+        self.logger._writer.send(b"not a pickle")
+        self.logger._writer.send(b"\x80\x04\x95" + b"\x00" * 64)
+
+        deadline = monotonic() + 5
+        while self.logger.dropped < 2 and monotonic() < deadline:
+            sleep(0.01)
+
+        self.assertEqual(self.logger.dropped, 2)
+        self.assertTrue(self.logger._receiver.is_alive())
+
+    def test_stop_ends_the_receiver_and_closes_the_sockets(self):
+        receiver = self.logger._receiver
+        reader = self.logger._reader
+        self.logger.stop()
+        self.assertFalse(receiver.is_alive())
+        self.assertEqual(reader.fileno(), -1)
+        self.assertIsNone(self.logger._writer)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+from spirit.utils.metrics import Registry, aggregate, render, percentile
+from spirit.utils.metrics import bucket_index, bucket_value
+
+from unittest import TestCase, main
+from tempfile import TemporaryDirectory
+from threading import Thread
+from os import fork, waitpid, _exit
+
+class MetricsTest(TestCase):
+    def test_counters_merge_thread_shards(self):
+        registry = Registry()
+        counter = registry.counter("jobs", queue="a")
+
+        def work():
+            for _ in range(1000):
+                counter.inc()
+
+        threads = [Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        counters = registry.snapshot()["counters"]
+        self.assertEqual(counters, {"jobs{queue=a}": 4000})
+
+    def test_histogram_percentiles_stay_within_a_bucket(self):
+        registry = Registry()
+        histogram = registry.histogram("latency")
+        for micros in range(1, 1001):
+            histogram.observe(micros / 1e6)
+
+        entry = registry.snapshot()["histograms"]["latency"]
+        summary = entry["count"], entry["min"], entry["max"]
+        self.assertEqual(summary, (1000, 1, 1000))
+        self.assertAlmostEqual(percentile(entry, 0.5), 500, delta=500 * 0.07)
+        self.assertIn("latency count=1000", render(registry.snapshot()))
+
+    def test_bucket_values_round_down(self):
+        for value in (0, 7, 15, 16, 17, 1000, 123456):
+            low = bucket_value(bucket_index(value))
+            self.assertLessEqual(low, value)
+            self.assertGreaterEqual(low, value * 0.9)
+
+    def test_forked_children_start_from_zero_and_aggregate(self):
+        registry = Registry()
+        counter = registry.counter("events")
+        counter.inc(5)
+        with TemporaryDirectory() as directory:
+            pid = fork()
+            if pid == 0:
+                try:
+                    counter.inc(2)
+                    registry.export(directory)
+
+                finally:
+                    _exit(0)
+
+            waitpid(pid, 0)
+            merged = aggregate(directory, include=registry.snapshot())
+
+        self.assertEqual(merged["counters"]["events"], 7)
+
+    def test_gauges_are_not_sharded(self):
+        registry = Registry()
+        gauge = registry.gauge("open")
+        gauge.inc(3)
+        gauge.dec()
+        self.assertEqual(registry.snapshot()["gauges"], {"open": 2})
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+from spirit.workers import Supervisor, SharedArray, cpus, cores
+from spirit.workers import TRANSIENT
+
+from unittest import TestCase, main, skipIf
+from signal import signal, getsignal, SIGINT, SIGTERM, SIGUSR1
+from contextlib import redirect_stdout
+from io import StringIO
+from os import sched_getaffinity
+
+def parent(nursery, states, pid, pids):
+    pass
+
+class NurseryTest(TestCase):
+    def setUp(self):
+        self.handlers = [(s, getsignal(s)) for s in (SIGINT, SIGTERM, SIGUSR1)]
+
+    def tearDown(self):
+        for signum, handler in self.handlers:
+            signal(signum, handler)
+
+    def test_cores_follow_the_affinity_mask(self):
+        self.assertEqual(cpus(), sorted(sched_getaffinity(0)))
+        self.assertEqual(cores(), len(cpus()))
+
+    def test_supervisor_keeps_its_positional_parameters(self):
+        # bus, restart, backoff, max_backoff, intensity, period, heartbeat
+        supervisor = Supervisor(parent, [], None, TRANSIENT, 0.5, 4, 3, 9, 1)
+        self.assertEqual(supervisor._restart, TRANSIENT)
+        self.assertEqual(supervisor._backoff, 0.5)
+        self.assertEqual(supervisor._max_backoff, 4)
+        self.assertEqual(supervisor._intensity, 3)
+        self.assertEqual(supervisor._period, 9)
+        self.assertEqual(supervisor._heartbeat, 1)
+        self.assertFalse(supervisor._pin)
+
+    @skipIf(cores() < 2, "Pinning is only visible with several cores")
+    def test_pinned_workers_run_on_one_core(self):
+        seen = SharedArray("q", 2)
+
+        def child(index, state, pid, ppid):
+            seen[index] = len(sched_getaffinity(0))
+
+        supervisor = Supervisor(parent, [child], restart=TRANSIENT, pin=True)
+        with redirect_stdout(StringIO()):
+            supervisor.spawn([dict(), dict()])
+
+        self.assertEqual(seen.tolist(), [1, 1])
+        seen.close()
+
+if __name__ == "__main__":
+    main()
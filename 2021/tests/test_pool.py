@@ -0,0 +1,90 @@
+from spirit.workers import Pool, WorkerError, ROUND_ROBIN, WORK_STEALING
+from spirit.utils.metrics import metrics, aggregate
+
+from unittest import TestCase, main
+from tempfile import TemporaryDirectory
+from pathlib import Path
+from os import getpid
+from itertools import count, islice
+
+worked = metrics.counter("tests.worked")
+
+def fail(value):
+    raise ValueError(value)
+
+def tally(value):
+    worked.inc()
+    return value
+
+class PoolTest(TestCase):
+    def test_map_keeps_order(self):
+        with Pool(2) as pool:
+            results = pool.map(abs, range(-20, 0), 3)
+
+        self.assertEqual(results, list(range(20, 0, -1)))
+
+    def test_strategies_spread_jobs(self):
+        for strategy in (ROUND_ROBIN, WORK_STEALING):
+            with Pool(2, strategy=strategy) as pool:
+                futures = [pool.submit(abs, -i) for i in range(10)]
+                results = [future.result() for future in futures]
+                stats = pool.stats()
+
+            self.assertEqual(results, list(range(10)))
+            self.assertEqual(sum(s["calls"] for s in stats.values()), 10)
+
+    def test_imap_unordered_consumes_lazily(self):
+        taken = list()
+
+        def numbers():
+            for number in count():
+                taken.append(number)
+                yield -number
+
+        with Pool(2, prefetch=1) as pool:
+            results = pool.imap_unordered(abs, numbers(), window=4)
+            first = sorted(islice(results, 10))
+            results.close()
+
+        self.assertEqual(len(first), 10)
+        self.assertLess(len(taken), 20)
+
+    def test_errors_reach_the_caller(self):
+        with Pool(1) as pool:
+            with self.assertRaises(ValueError):
+                pool.submit(fail, 1).result()
+
+            with self.assertRaises(WorkerError):
+                pool.submit("tests.missing:nothing").result()
+
+    def test_workers_do_not_run_the_callers_finally(self):
+        with TemporaryDirectory() as directory:
+            marker = Path(directory) / "finally"
+            try:
+                with Pool(2) as pool:
+                    pool.map(abs, [-1, -2])
+
+            finally:
+                with open(marker, "a") as file:
+                    file.write(f"{getpid()}\n")
+
+            self.assertEqual(marker.read_text().split(), [str(getpid())])
+
+    def test_workers_export_metrics_as_they_exit(self):
+        with TemporaryDirectory() as directory:
+            metrics.export_on_exit(directory)
+            try:
+                with Pool(2) as pool:
+                    pool.map(tally, range(10))
+
+            finally:
+                metrics.export_on_exit(None)
+
+            exported = list(Path(directory).glob("metrics-*.json"))
+            merged = aggregate(directory)
+
+        self.assertEqual(len(exported), 2)
+        self.assertEqual(merged["counters"]["tests.worked"], 10)
+
+if __name__ == "__main__":
+    main()
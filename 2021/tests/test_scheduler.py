@@ -0,0 +1,88 @@
+from spirit.workers import Scheduler, Cron, SKIP, CATCH_UP
+from spirit.storage import Memory
+
+from unittest import TestCase, main
+from unittest.mock import patch
+from datetime import datetime
+
+calls = list()
+
+def record(value):
+    calls.append(value)
+    return value
+
+def explode():
+    raise RuntimeError("Job failed")
+
+class CronTest(TestCase):
+    def test_next_matches_every_field(self):
+        cron = Cron("30 9 * * 1-5")
+        friday = datetime(2021, 10, 1, 9, 30)
+        self.assertEqual(cron.next(friday), datetime(2021, 10, 4, 9, 30))
+
+    def test_steps_and_lists(self):
+        cron = Cron("*/15 0,12 1 * *")
+        after = datetime(2021, 10, 1, 0, 50)
+        self.assertEqual(cron.next(after), datetime(2021, 10, 1, 12, 0))
+
+    def test_invalid_expressions_are_rejected(self):
+        for expression in ("* * *", "60 * * * *", "* * * 13 *"):
+            with self.assertRaises(ValueError):
+                Cron(expression)
+
+class SchedulerTest(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_one_shot_jobs_run_once(self):
+        scheduler = Scheduler()
+        scheduler.at(100, record, "a")
+        self.assertEqual(scheduler.run_pending(99), [])
+        self.assertEqual(scheduler.run_pending(100), ["a"])
+        self.assertEqual(scheduler.run_pending(200), [])
+        self.assertEqual(len(scheduler), 0)
+
+    def test_missed_interval_runs_follow_the_policy(self):
+        results = dict()
+        for missed in (SKIP, CATCH_UP, "coalesce"):
+            calls.clear()
+            scheduler = Scheduler(tolerance=1)
+            job_id = scheduler.every(10, record, missed, missed=missed)
+            start = scheduler._jobs[job_id].next_run
+            for _ in range(4):
+                scheduler.run_pending(start + 35)
+
+            results[missed] = len(calls)
+
+        self.assertEqual(results[SKIP], 0)
+        self.assertEqual(results["coalesce"], 1)
+        self.assertEqual(results[CATCH_UP], 4)
+
+    def test_cancelled_jobs_do_not_run(self):
+        scheduler = Scheduler()
+        job_id = scheduler.at(100, record, "a")
+        self.assertTrue(scheduler.cancel(job_id))
+        self.assertFalse(scheduler.cancel(job_id))
+        self.assertEqual(scheduler.run_pending(100), [])
+        self.assertIsNone(scheduler.next_run())
+
+    def test_failing_jobs_are_reported(self):
+        scheduler = Scheduler()
+        scheduler.at(1, explode)
+        with patch("spirit.workers.scheduler.eprint") as eprint:
+            self.assertEqual(scheduler.run_pending(1), [None])
+
+        self.assertIn("Job failed", eprint.call_args[0][0])
+
+    def test_schedule_survives_in_memory(self):
+        memory = Memory(":memory:")
+        scheduler = Scheduler(memory=memory)
+        scheduler.at(100, "tests.test_scheduler:record", "a")
+        scheduler.every(10, record, "b")
+
+        restored = Scheduler(memory=memory)
+        self.assertEqual(restored.load(), 2)
+        self.assertEqual(restored.run_pending(100), ["a"])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+from spirit.storage import Memory, BaseModel, Metadata, Database
+
+from unittest import TestCase, main
+from unittest.mock import patch
+from tempfile import TemporaryDirectory
+from typing import Optional
+from pathlib import Path
+
+def gadget(version):
+    if version == 1:
+        class Gadget(BaseModel):
+            name: str
+
+    elif version == 2:
+        class Gadget(BaseModel):
+            name: str
+            color: Optional[str] = None
+            serial: str = Metadata(default="none", unique=True)
+
+    else:
+        class Gadget(BaseModel):
+            name: str
+            weight: int = Metadata(index=True)
+
+    return Gadget
+
+class SchemaTest(TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = Path(self.directory.name) / "schema.db"
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_matching_fingerprints_skip_ddl(self):
+        Memory(self.path).meditate(gadget(1)).remember(name="a")
+        with patch.object(Database, "migrate") as migrate:
+            gadgets = Memory(self.path).meditate(gadget(1))
+
+        migrate.assert_not_called()
+        self.assertEqual(gadgets.count(), 1)
+
+    def test_drift_adds_columns_and_indexes(self):
+        Memory(self.path).meditate(gadget(1)).remember(name="a")
+        memory = Memory(self.path)
+        gadgets = memory.meditate(gadget(2))
+        gadget_id = gadgets.remember(name="b", color="red", serial="x")
+        self.assertEqual(gadgets.recall(gadget_id).color, "red")
+        self.assertEqual(gadgets.count(), 2)
+        self.assertEqual(gadgets.count(dict(serial="none")), 1)
+
+        with patch("spirit.storage.database.eprint"):
+            self.assertIsNone(gadgets.remember(name="c", serial="x"))
+
+        fingerprints = memory._db.fingerprints()
+        self.assertEqual(list(fingerprints.keys()), ["gadget"])
+
+    def test_required_columns_need_a_default(self):
+        Memory(self.path).meditate(gadget(1)).remember(name="a")
+        with self.assertRaises(ValueError):
+            Memory(self.path).meditate(gadget(3))
+
+        gadgets = Memory(self.path).meditate(gadget(1))
+        self.assertEqual(gadgets.count(), 1)
+
+if __name__ == "__main__":
+    main()
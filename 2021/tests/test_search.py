@@ -0,0 +1,53 @@
+from spirit.storage import Memory, BaseModel, Metadata
+
+from unittest import TestCase, main
+from sqlite3 import OperationalError
+
+from main import Author
+
+class Doc(BaseModel):
+    title: str = Metadata(search=True)
+    body: str = Metadata(search=True)
+    views: int = 0
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.memory = Memory(":memory:")
+        self.docs = self.memory.meditate(Doc)
+        self.first = self.docs.remember(title="sqlite", body="fast storage")
+        self.second = self.docs.remember(
+            title="notes",
+            body="storage and more storage"
+        )
+
+    def titles(self, query, **kwargs):
+        return [doc.title for doc in self.docs.search(query, **kwargs)]
+
+    def test_matches_are_ranked(self):
+        self.assertEqual(self.titles("storage"), ["notes", "sqlite"])
+        self.assertEqual(self.titles("storage", limit=1), ["notes"])
+        self.assertEqual(self.titles("title:sqlite"), ["sqlite"])
+        self.assertEqual(self.titles("missing"), [])
+
+    def test_index_follows_writes(self):
+        self.docs.alter_many(self.first, body="quick")
+        self.assertEqual(self.titles("storage"), ["notes"])
+        self.assertEqual(self.titles("quick"), ["sqlite"])
+        self.docs.alter_many(self.first, views=3)
+        self.assertEqual(self.titles("quick"), ["sqlite"])
+
+        self.docs.forget(self.second)
+        self.assertEqual(self.titles("storage"), [])
+        self.docs.ingest([dict(title="bulk", body="storage")])
+        self.assertEqual(self.titles("storage"), ["bulk"])
+
+    def test_models_without_search_fields_refuse(self):
+        with self.assertRaises(ValueError):
+            self.memory.meditate(Author).search("anything")
+
+    def test_invalid_queries_fail(self):
+        with self.assertRaises(OperationalError):
+            self.docs.search("AND")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+from spirit.workers import SharedArray, SharedState
+
+from unittest import TestCase, main
+from pickle import dumps
+from os import fork, waitpid, _exit
+from uuid import uuid4
+
+class SharedTest(TestCase):
+    def test_child_writes_are_visible_to_the_parent(self):
+        shared = SharedArray("q", 8)
+        pid = fork()
+        if pid == 0:
+            try:
+                for i in range(len(shared)):
+                    shared[i] = i * i
+
+            finally:
+                _exit(0)
+
+        waitpid(pid, 0)
+        self.assertEqual(shared.tolist(), [i * i for i in range(8)])
+        shared.close()
+
+    def test_split_partitions_listed_arrays(self):
+        values = SharedArray.from_sequence("d", range(10))
+        totals = SharedArray("d", 3)
+        state = SharedState(values=values, totals=totals)
+        states = state.split(3, names=["values"])
+
+        self.assertEqual([len(s["values"]) for s in states], [4, 3, 3])
+        self.assertEqual([s["values_offset"] for s in states], [0, 4, 7])
+        self.assertIs(states[1]["totals"], totals)
+
+        for index, part in enumerate(states):
+            part["totals"][index] = sum(part["values"])
+
+        self.assertEqual(sum(totals), sum(range(10)))
+        del states, part
+        state.close()
+
+    def test_named_arrays_pickle_by_name(self):
+        shared = SharedArray.from_sequence("i", [1, 2, 3], name=uuid4().hex)
+        try:
+            cls, args = shared.__reduce__()
+            self.assertIs(cls, SharedArray)
+            self.assertEqual(args, ("i", 3, shared.name, False))
+            self.assertEqual(shared.tolist(), [1, 2, 3])
+
+        finally:
+            shared.close()
+            shared.unlink()
+
+    def test_anonymous_arrays_do_not_pickle(self):
+        shared = SharedArray("i", 1)
+        with self.assertRaises(TypeError):
+            dumps(shared)
+
+        shared.close()
+
+if __name__ == "__main__":
+    main()
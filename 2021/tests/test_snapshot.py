@@ -0,0 +1,144 @@
+from spirit.events import Store, dump_snapshot, load_snapshot
+from spirit.events import latest_snapshot
+
+from unittest import TestCase, main
+from unittest.mock import patch
+from tempfile import TemporaryDirectory
+from pathlib import Path
+from datetime import datetime
+from os import environ
+from time import tzset, monotonic, sleep
+
+class SnapshotTest(TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = Path(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip_keeps_time_in_any_timezone(self):
+        previous = environ.get("TZ")
+        environ["TZ"] = "America/New_York"
+        tzset()
+        try:
+            when = datetime(2021, 10, 1, 12, 0, 0, 250000)
+            path = dump_snapshot(self.path / "a.snap", 7, [("a", b"x")], when)
+            snapshot = load_snapshot(path)
+
+        finally:
+            if previous is None:
+                del environ["TZ"]
+
+            else:
+                environ["TZ"] = previous
+
+            tzset()
+
+        self.assertEqual(snapshot.seq, 7)
+        self.assertEqual(snapshot.when, when)
+        self.assertEqual(snapshot.refs, [("a", b"x")])
+
+    def test_restore_replays_tail_into_ref(self):
+        store = Store(dict())
+        store.ref["a"] = 1
+        store.snapshot_every(self.path, events=1000)
+        seq = store.snapshot()
+        store._snapshotter.stop()
+
+        store.ref["a"] = 2
+        store.ref["b"] = 3
+        tail = list(store.get_events(since=seq))
+
+        restored = Store(dict())
+        replayed = restored.restore(self.path, tail=tail, kinds=["b"])
+        self.assertEqual(replayed, 2)
+        self.assertEqual(restored.ref["a"], 2)
+        self.assertEqual(restored.ref["b"], 3)
+
+    def test_restore_ignores_kinds_the_ref_does_not_track(self):
+        store = Store(dict())
+        store.ref["a"] = 1
+        store.snapshot_every(self.path, events=1000)
+        store.snapshot()
+        store._snapshotter.stop()
+
+        store.log("audit", {"user": "u1"})
+        store.ref["a"] = 2
+
+        restored = Store(dict())
+        restored.restore(self.path, tail=list(store.get_events(since=1)))
+        self.assertEqual(restored.ref["a"], 2)
+        self.assertNotIn("audit", list(restored.ref))
+
+    def test_restore_tracks_extra_kinds(self):
+        store = Store(dict())
+        store.snapshot_every(self.path, events=1000)
+        store.snapshot()
+        store._snapshotter.stop()
+        store.log("late", 5)
+
+        restored = Store(dict())
+        tail = list(store.get_events(since=0))
+        restored.restore(self.path, tail=tail, kinds=["late"])
+        self.assertEqual(restored.ref["late"], 5)
+
+    def test_restore_forgets_what_was_tracked_before(self):
+        store = Store(dict())
+        store.snapshot_every(self.path, events=1000)
+        store.snapshot()
+        store._snapshotter.stop()
+        store.log("b", 3)
+
+        restored = Store(dict())
+        restored.ref["b"] = 0
+        restored.restore(self.path, tail=list(store.get_events(since=0)))
+        self.assertEqual(list(restored.ref), [])
+
+    def wait_for_snapshot(self, seq, timeout=5):
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            snapshot = latest_snapshot(self.path)
+            if snapshot is not None and snapshot.seq >= seq:
+                return snapshot
+
+            sleep(0.01)
+
+        return None
+
+    def test_idle_stores_snapshot_on_time(self):
+        store = Store(dict())
+        snapshotter = store.snapshot_every(self.path, seconds=0.05)
+        store.ref["a"] = 1
+        snapshot = self.wait_for_snapshot(1)
+        snapshotter.stop()
+        self.assertEqual(len(snapshot.refs), 1)
+
+    def test_failed_writes_are_logged_and_later_ones_go_on(self):
+        store = Store(dict())
+        snapshotter = store.snapshot_every(self.path, events=1)
+        failing = [OSError("disk full"), dump_snapshot]
+
+        def dump(*args):
+            outcome = failing.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+
+            return outcome(*args)
+
+        target = "spirit.events.snapshot.dump_snapshot"
+        with self.assertLogs("spirit.snapshot") as logs:
+            with patch(target, side_effect=dump):
+                store.ref["a"] = 1
+                deadline = monotonic() + 5
+                while len(failing) > 1 and monotonic() < deadline:
+                    sleep(0.01)
+
+                store.ref["a"] = 2
+                snapshotter.stop()
+
+        self.assertIn("disk full", logs.output[0])
+        self.assertEqual(latest_snapshot(self.path).seq, 2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+from spirit.events import Store
+
+from unittest import TestCase, main
+from time import sleep
+
+class StoreTest(TestCase):
+    def test_log_many_shares_one_time_and_batches_per_kind(self):
+        store = Store(dict())
+        seen = list()
+        batches = list()
+        store.subscribe(["a"], seen.append)
+        store.subscribe(["a", "b"], batches.append, batch=True)
+
+        self.assertEqual(store.log_many([("a", 1), ("b", 2), ("a", 3)]), 3)
+        self.assertEqual([event.data for event in seen], [1, 3])
+        self.assertEqual(len(batches), 2)
+        self.assertEqual([event.data for event in batches[0]], [1, 3])
+        self.assertEqual([event.data for event in batches[1]], [2])
+        self.assertEqual(len({event.when for event in store.events}), 1)
+
+    def test_log_many_accepts_a_mapping(self):
+        store = Store(dict())
+        store.log_many({"a": 1, "b": 2})
+        self.assertEqual([e.kind for e in store.events], ["a", "b"])
+        self.assertEqual(store.seq, 2)
+
+    def test_coalesced_writes_keep_the_latest(self):
+        store = Store(dict())
+        store.coalesce(["tick"], 20)
+        for value in range(10):
+            store.log("tick", value)
+
+        self.assertEqual(list(store.events), [])
+        sleep(0.03)
+        store.log("other", None)
+        self.assertEqual([e.data for e in store.events], [9, None])
+
+    def test_flush_releases_pending_writes(self):
+        store = Store(dict())
+        store.coalesce(["tick"], 10000)
+        store.log("tick", 1)
+        store.log("tick", 2)
+        self.assertEqual(store.flush(), 1)
+        self.assertEqual([e.data for e in store.events], [2])
+        self.assertEqual(store.flush(), 0)
+
+    def test_held_writes_wait_for_flush_or_snapshot(self):
+        store = Store(dict())
+        store.coalesce(["tick"], 10)
+        store.log("tick", 1)
+        sleep(0.03)
+        self.assertEqual(list(store.events), [])
+
+        self.assertIsNone(store.snapshot())
+        self.assertEqual([e.data for e in store.events], [1])
+        store.log("tick", 2)
+        store.compact(store.seq)
+        self.assertEqual([e.data for e in store.events], [2])
+
+    def test_silence_stops_every_listener_of_the_kind(self):
+        store = Store(dict())
+        seen = list()
+        batches = list()
+        store.subscribe(["a"], seen.append)
+        store.subscribe(["a", "b"], batches.append, batch=True)
+        store.ref["a"] = 1
+        del store.ref["a"]
+        store.log("a", 2)
+        store.log("b", 3)
+
+        self.assertEqual([event.data for event in seen], [1, "a"])
+        data = [[event.data for event in batch] for batch in batches]
+        self.assertEqual(data, [[1], ["a"], [3]])
+
+    def test_wildcard_listeners_get_every_kind(self):
+        store = Store(dict())
+        seen = list()
+        batches = list()
+        store.subscribe(["*"], seen.append)
+        store.subscribe(["*"], batches.append, batch=True)
+        store.log_many([("a", 1), ("b", 2)])
+        store.log("c", 3)
+
+        self.assertEqual([event.data for event in seen], [1, 2, 3])
+        kinds = [[event.kind for event in batch] for batch in batches]
+        self.assertEqual(kinds, [["a"], ["b"], ["c"]])
+
+    def test_unsubscribe_stops_batch_listener(self):
+        store = Store(dict())
+        batches = list()
+        stop = store.subscribe(["a"], batches.append, batch=True)
+        store.log("a", 1)
+        stop()
+        store.log("a", 2)
+        self.assertEqual(len(batches), 1)
+
+    def test_subscribe_ignores_non_callables(self):
+        store = Store(dict())
+        self.assertIsNone(store.subscribe(["a"], None))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+from spirit.events import Store, Bus
+from spirit.workers import Supervisor, TRANSIENT, TEMPORARY
+
+from unittest import TestCase, main
+from tempfile import TemporaryDirectory
+from pathlib import Path
+from signal import signal, getsignal, SIGINT, SIGTERM, SIGUSR1
+from contextlib import redirect_stdout, redirect_stderr
+from io import StringIO
+
+def parent(nursery, states, pid, pids):
+    pass
+
+def failing_once(marker):
+    # Fails the first time it runs, ends normally afterwards
+    def child(index, state, pid, ppid):
+        path = marker / str(index)
+        if not path.exists():
+            path.touch()
+            raise RuntimeError("First run fails")
+
+        with open(marker / "runs", "a") as file:
+            file.write(f"{index}\n")
+
+    return child
+
+class SupervisorTest(TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.marker = Path(self.directory.name)
+        self.handlers = [(s, getsignal(s)) for s in (SIGINT, SIGTERM, SIGUSR1)]
+
+    def tearDown(self):
+        for signum, handler in self.handlers:
+            signal(signum, handler)
+
+        self.directory.cleanup()
+
+    def run_supervisor(self, supervisor, states):
+        # Failing children print their tracebacks into the void
+        with redirect_stdout(StringIO()) as output, redirect_stderr(StringIO()):
+            supervisor.spawn(states)
+
+        return output.getvalue()
+
+    def runs(self):
+        path = self.marker / "runs"
+        return path.read_text().split() if path.exists() else list()
+
+    def test_transient_workers_restart_after_failing(self):
+        child = failing_once(self.marker)
+        kwargs = dict()
+        kwargs["restart"] = TRANSIENT
+        kwargs["backoff"] = 0.01
+        supervisor = Supervisor(parent, [child], **kwargs)
+        output = self.run_supervisor(supervisor, [dict(), dict()])
+        self.assertEqual(sorted(self.runs()), ["0", "1"])
+        self.assertEqual(output.count("failed"), 2)
+
+    def test_temporary_workers_are_not_restarted(self):
+        child = failing_once(self.marker)
+        supervisor = Supervisor(parent, [child], restart=TEMPORARY)
+        self.run_supervisor(supervisor, [dict()])
+        self.assertEqual(self.runs(), [])
+
+    def test_restart_intensity_stops_crash_loops(self):
+        def child(index, state, pid, ppid):
+            raise RuntimeError("Always fails")
+
+        kwargs = dict()
+        kwargs["backoff"] = 0.001
+        kwargs["intensity"] = 3
+        supervisor = Supervisor(parent, [child], **kwargs)
+        output = self.run_supervisor(supervisor, [dict()])
+        self.assertIn("Restart intensity exceeded", output)
+        self.assertEqual(output.count("failed"), 4)
+
+    def test_restarted_workers_reconnect_to_the_bus(self):
+        bus = Bus(1)
+        store = Store(dict())
+        marker = self.marker
+
+        def connected(index, state, pid, ppid):
+            failing_once(marker)(index, state, pid, ppid)
+            worker = Store(dict())
+            bus.join(worker, publish=["hello"])
+            worker.log("hello", pid)
+
+        def joined(nursery, states, pid, pids):
+            bus.join(store, subscribe=["hello"])
+
+        kwargs = dict()
+        kwargs["bus"] = bus
+        kwargs["restart"] = TRANSIENT
+        kwargs["backoff"] = 0.01
+        supervisor = Supervisor(joined, [connected], **kwargs)
+        output = self.run_supervisor(supervisor, [dict()])
+        self.assertNotIn("intensity", output)
+        self.assertEqual(output.count("failed"), 1)
+
+        bus.pump(5)
+        self.assertEqual([e.kind for e in store.events], ["hello"])
+        bus.close()
+
+if __name__ == "__main__":
+    main()
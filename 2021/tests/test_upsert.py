@@ -0,0 +1,85 @@
+from spirit.storage import Memory, BaseModel, Database
+
+from sqlite3 import IntegrityError
+
+from unittest import TestCase, main
+from typing import Optional
+
+class Item(BaseModel):
+    sku: str
+    name: str
+    stock: int = 0
+    note: Optional[str] = None
+
+class UpsertTest(TestCase):
+    def setUp(self):
+        self.items = Memory(":memory:").meditate(Item)
+
+    def test_merge_inserts_then_updates(self):
+        ids = self.items.merge(
+            [dict(sku="a", name="A", stock=1), dict(sku="b", name="B")],
+            conflict=["sku"]
+        )
+        again = self.items.merge(
+            [dict(sku="b", name="Bee", stock=5), dict(sku="c", name="C")],
+            conflict=["sku"]
+        )
+        self.assertEqual(again[0], ids[1])
+        self.assertNotIn(again[1], ids)
+        item = self.items.recall(ids[1])
+        self.assertEqual((item.name, item.stock), ("Bee", 5))
+        self.assertEqual(self.items.count(), 3)
+
+    def test_existing_uuids_survive_merges(self):
+        item_id = self.items.remember(sku="a", name="A")
+        uuid = self.items.recall(item_id).uuid
+        self.items.merge([dict(sku="a", name="B")], conflict=["sku"])
+        self.assertEqual(self.items.recall(item_id).uuid, uuid)
+
+    def test_chunks_and_named_updates(self):
+        entries = [dict(sku=str(i), name="x", stock=i) for i in range(5)]
+        ids = self.items.merge(entries, conflict=["sku"], chunk=2)
+        self.assertEqual(len(set(ids)), 5)
+        entries = [dict(sku="1", name="y", stock=9)]
+        self.items.merge(entries, conflict=["sku"], update=["stock"])
+        item = self.items.recall(ids[1])
+        self.assertEqual((item.name, item.stock), ("x", 9))
+
+    def test_null_conflict_values_are_rejected(self):
+        entries = [dict(sku="a", name="A"), dict(sku=None, name="B")]
+        with self.assertRaises(ValueError):
+            self.items.merge(entries, conflict=["sku"])
+
+        self.assertEqual(self.items.count(), 0)
+
+    def test_failed_unique_indices_are_not_recorded(self):
+        first = self.items.remember(sku="a", name="A")
+        self.items.remember(sku="a", name="B")
+        with self.assertRaises(IntegrityError):
+            self.items.merge([dict(sku="a", name="C")], conflict=["sku"])
+
+        self.items.forget(first)
+        self.items.merge([dict(sku="a", name="C")], conflict=["sku"])
+        self.assertEqual(self.items.count(), 1)
+        self.assertEqual(self.items.count(where=dict(name="C")), 1)
+
+class DatabaseUpsertTest(TestCase):
+    def setUp(self):
+        tables = dict(kv=["k text", "v text"])
+        self.db = Database(":memory:", tables)
+        self.db.create_index("kv", ["k"], unique=True)
+
+    def test_upsert_returns_the_row_id(self):
+        first = self.db.upsert("kv", ["k"], k="a", v="1")
+        self.assertEqual(self.db.upsert("kv", ["k"], k="a", v="2"), first)
+        self.assertEqual(self.db.select_one("kv", ["v"]), ("2",))
+
+    def test_conflict_columns_must_be_given_and_set(self):
+        with self.assertRaises(ValueError):
+            self.db.upsert("kv", ["k"], v="1")
+
+        with self.assertRaises(ValueError):
+            self.db.upsert("kv", ["k"], k=None, v="1")
+
+if __name__ == "__main__":
+    main()